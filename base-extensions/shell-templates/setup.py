@@ -8,7 +8,9 @@ setup(
         'pipeline.plugins': [
             'shell_templates.Command = shell_templates.shell_templates:ShellTemplatesCommand',
             'shell_templates.Arguments = shell_templates.shell_templates:ShellTemplatesArguments',
-            'shell_templates.Configurator = shell_templates.shell_templates:ShellTemplatesCommandConfigurator'
+            'shell_templates.Configurator = shell_templates.shell_templates:ShellTemplatesCommandConfigurator',
+            'shell_templates.Sweep = shell_templates.sweep:ShellTemplatesSweep',
+            'shell_templates.Cache = shell_templates.cache:ShellTemplatesCache',
         ]
     },
     install_requires=[
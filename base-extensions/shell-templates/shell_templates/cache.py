@@ -0,0 +1,289 @@
+"""
+Result cache of single commands.
+
+A cached command is generated as a call of this module wrapping the original
+command line. The wrapper keys the command by its text and the digests of its
+declared input files; on a hit the declared outputs are restored from the
+cache directory and the command is skipped, otherwise it is run and, if it
+succeeds, its outputs are stored. The build path given with `--build-path`
+is replaced by `${build_path}` in the key, so a command writing into its
+build directory hits the entry of the same command of an earlier build and
+its outputs are restored into the new build. The least recently used entries
+are evicted once the cache grows above `max_size`::
+
+    python -m shell_templates.cache --cache /scratch/cache --build-path /builds/b2 \
+        --input data.csv --output /builds/b2/out.csv -- 'sort data.csv > /builds/b2/out.csv'
+"""
+from typing import List, Optional
+from dataclasses import dataclass, field
+from pathlib import Path
+import hashlib
+import json
+import os
+import re
+import shlex
+import sys
+import time
+
+from pipeline.manifest import FileLock
+
+# Loaded with the plugin for `ShellTemplatesCache`, the wrapper imports the rest where it is used
+from .renderer import compile_recipe
+
+
+@dataclass
+class ShellTemplatesCache:
+    """
+    Declares the files a command reads and writes so that its results can be reused.
+
+    ```yaml
+    cache:
+        path: /scratch/pipeline-cache
+        inputs: ['${data}/raw_${seed}.csv']
+        outputs: ['${build_path}/clean_${seed}.csv']
+        max_size: 50G
+    ```
+
+    Commands are keyed relative to the build path, so the outputs above are
+    restored into every later build running the same command.
+    """
+
+    # Cache directory, shared between builds
+    path: Optional[str] = None
+
+    # Templates of input files rendered with the mapping of every command
+    inputs: List[str] = field(default_factory=lambda: [])
+
+    # Templates of output files restored on a cache hit
+    outputs: List[str] = field(default_factory=lambda: [])
+
+    # Size limit such as `500M` or `50G`, unlimited by default
+    max_size: Optional[str] = None
+
+    enabled: bool = True
+
+    # Interpreter running the wrapper in the generated scripts
+    python: Optional[str] = None
+
+    def __post_init__(self):
+        if self.path is None:
+            self.path = os.path.join(os.path.expanduser('~'), '.cache', 'pipeline', 'tasks')
+        # Tasks do not necessarily run in the directory the build was generated in
+        self.path = os.path.abspath(os.path.expanduser(self.path))
+
+    def prefix(self) -> str:
+        arguments = [self.python or sys.executable, '-m', 'shell_templates.cache', '--cache', self.path]
+        if self.max_size:
+            arguments += ['--max-size', self.max_size]
+        return ' '.join(map(shlex.quote, arguments))
+
+
+class CachedRecipe:
+    """
+    Renders commands of `recipe` as command lines of the cache wrapper.
+    """
+
+    def __init__(self, recipe, cache: ShellTemplatesCache):
+        self.recipe = recipe
+        self.inputs = [compile_recipe((template,)) for template in cache.inputs]
+        self.outputs = [compile_recipe((template,)) for template in cache.outputs]
+        self._prefix = cache.prefix()
+
+    def render(self, mapping=None, defaults={}) -> str:
+        arguments = [self._prefix]
+        build_path = (mapping or {}).get('build_path') or defaults.get('build_path')
+        if build_path:
+            arguments += [f'--build-path {shlex.quote(str(build_path))}']
+        arguments += [f'--input {shlex.quote(recipe.render(mapping, defaults))}' for recipe in self.inputs]
+        arguments += [f'--output {shlex.quote(recipe.render(mapping, defaults))}' for recipe in self.outputs]
+        arguments += ['--', shlex.quote(self.recipe.render(mapping, defaults))]
+        return ' '.join(arguments)
+
+
+_SIZE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)b?\s*$', re.IGNORECASE)
+
+_SIZE_UNITS = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40}
+
+
+def parse_size(value) -> int:
+    match = _SIZE.match(str(value))
+    if match is None:
+        raise ValueError(f'Invalid size: {value!r}')
+    number, unit = match.groups()
+    return int(float(number) * _SIZE_UNITS[unit.lower()])
+
+
+def file_digest(filename, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TaskCache:
+    """
+    Entries `entries/<key>/` hold the outputs of one command as `0`, `1`, ... and `meta.json`.
+
+    The mtime of `meta.json` is the last use of an entry, `size` keeps the total
+    size of all entries and every modification happens under `lock`.
+    """
+
+    def __init__(self, path, max_size: Optional[int] = None):
+        self.path = Path(path)
+        self.max_size = max_size
+        (self.path / 'entries').mkdir(parents=True, exist_ok=True)
+
+    def key(self, command: str, inputs: List[str], outputs: List[str], build_path: Optional[str] = None) -> str:
+        """
+        Digest of the command, its outputs and its inputs with their contents.
+
+        Occurrences of `build_path` are keyed as `${build_path}`, so the same
+        command of another build has the same key.
+        """
+        def relative(text):
+            return text.replace(build_path, '${build_path}') if build_path else text
+
+        return hashlib.sha256(json.dumps({
+            'command': relative(command),
+            'inputs': [[relative(filename), file_digest(filename)] for filename in inputs],
+            'outputs': list(map(relative, outputs)),
+        }).encode()).hexdigest()
+
+    def entry(self, key: str) -> Path:
+        return self.path / 'entries' / key
+
+    def _locked(self):
+        return FileLock(self.path / 'lock')
+
+    def restore(self, key: str, outputs: List[str]) -> bool:
+        import shutil
+
+        entry = self.entry(key)
+        meta = entry / 'meta.json'
+        if not meta.exists():
+            return False
+
+        try:
+            for number, filename in enumerate(outputs):
+                Path(filename).parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(entry / str(number), filename)
+            os.utime(meta)
+        except FileNotFoundError:
+            # Evicted by another task in the meantime
+            return False
+        return True
+
+    def store(self, key: str, outputs: List[str]):
+        import shutil
+
+        entry = self.entry(key)
+        temporary = entry.with_name(f'.{key}.{os.getpid()}.tmp')
+        temporary.mkdir(parents=True, exist_ok=True)
+
+        size = 0
+        for number, filename in enumerate(outputs):
+            shutil.copyfile(filename, temporary / str(number))
+            size += os.stat(temporary / str(number)).st_size
+        (temporary / 'meta.json').write_text(json.dumps({'outputs': outputs, 'size': size, 'created': time.time()}))
+
+        with self._locked():
+            if entry.exists():
+                shutil.rmtree(temporary)
+                return
+            # The total is taken before the rename, a recount would include the new entry
+            total = self._total_size() + size
+            os.rename(temporary, entry)
+            (self.path / 'size').write_text(str(total))
+            self._evict()
+
+    def _total_size(self) -> int:
+        try:
+            return int((self.path / 'size').read_text())
+        except (OSError, ValueError):
+            return sum(self._entry_size(entry) for entry in (self.path / 'entries').iterdir() if not entry.name.startswith('.'))
+
+    @staticmethod
+    def _entry_size(entry: Path) -> int:
+        try:
+            return json.loads((entry / 'meta.json').read_text())['size']
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _evict(self):
+        import shutil
+
+        if self.max_size is None or self._total_size() <= self.max_size:
+            return
+
+        entries = []
+        for entry in (self.path / 'entries').iterdir():
+            if entry.name.startswith('.'):
+                continue
+            try:
+                entries.append((os.stat(entry / 'meta.json').st_mtime, entry))
+            except OSError:
+                continue
+
+        total = sum(self._entry_size(entry) for _, entry in entries)
+        for _, entry in sorted(entries, key=lambda item: item[0]):
+            if total <= self.max_size:
+                break
+            total -= self._entry_size(entry)
+            shutil.rmtree(entry, ignore_errors=True)
+
+        (self.path / 'size').write_text(str(total))
+
+
+def run_cached(
+    command: str,
+    cache,
+    inputs: List[str] = (),
+    outputs: List[str] = (),
+    max_size: Optional[int] = None,
+    shell: str = 'bash',
+    build_path: Optional[str] = None,
+) -> int:
+    """
+    Runs `command` unless its outputs are cached, returns its exit code.
+
+    Outputs of a hit are restored to `outputs`, i.e. into the current `build_path`.
+    """
+    import subprocess
+
+    cache = cache if isinstance(cache, TaskCache) else TaskCache(cache, max_size)
+    inputs, outputs = list(inputs), list(outputs)
+
+    if not all(os.path.isfile(filename) for filename in inputs):
+        # Let the command report missing inputs itself
+        return subprocess.run([shell, '-c', command]).returncode
+
+    key = cache.key(command, inputs, outputs, build_path and str(build_path).rstrip('/'))
+    if cache.restore(key, outputs):
+        print(f'Restored {len(outputs)} outputs from cache entry {key}', file=sys.stderr)
+        return 0
+
+    returncode = subprocess.run([shell, '-c', command]).returncode
+    if returncode == 0 and all(os.path.isfile(filename) for filename in outputs):
+        cache.store(key, outputs)
+    return returncode
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m shell_templates.cache', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--cache', required=True, help='Cache directory')
+    parser.add_argument('--max-size', default=None, help='Evict least recently used entries above this size')
+    parser.add_argument('--build-path', default=None, help='Build directory, keyed as ${build_path}')
+    parser.add_argument('--input', action='append', default=[], help='Input file, part of the cache key')
+    parser.add_argument('--output', action='append', default=[], help='Output file restored on a cache hit')
+    parser.add_argument('command', help='Command line run with bash -c')
+    options = parser.parse_args(argv)
+
+    max_size = None if options.max_size is None else parse_size(options.max_size)
+    return run_cached(options.command, options.cache, options.input, options.output, max_size, build_path=options.build_path)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""
+Generation-time deduplication of rendered commands.
+
+With `dedup` a configurator writes every distinct command once, so identical
+commands of overlapping sweeps run as a single array task. Next to the
+command file a mapping file `<command file>.map` holds, for every appended
+command in order, the 1-based line of the command file that runs it, as
+little-endian uint32. Results can still be found by the original index::
+
+    python -m shell_templates.dedup /path/to/commands.sh.map 42
+
+Commands are looked up by a 64-bit BLAKE2b digest kept in flat arrays. The
+distinct commands are also written to a temporary file next to the mapping
+file, and a digest match is only taken as a duplicate once the command read
+back from there is identical, so distinct commands are never merged. Memory
+grows by 26 to 44 bytes per distinct command. Tables are deduplicated by
+their rows of placeholder values.
+"""
+from typing import Callable, Iterable, List, Optional, Sequence
+from array import array
+from hashlib import blake2b
+from itertools import compress
+import argparse
+import os
+import struct
+import sys
+import tempfile
+
+from .table import TableWriter, iter_rows
+
+
+MAP_SUFFIX = '.map'
+
+_LINE = struct.Struct('<I')
+
+_MASK = (1 << 64) - 1
+
+
+def map_filename_for(filename) -> str:
+    return f'{filename}{MAP_SUFFIX}'
+
+
+def digest(data: bytes) -> int:
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), 'little')
+
+
+class DigestTable:
+    """
+    Open-addressing hash map from 64-bit digests to line numbers.
+
+    Keys and values live in two flat arrays (12 bytes per slot, at most two
+    thirds of the slots used) instead of a dict of int objects. Different items
+    with the same digest take separate slots, told apart by `same`.
+    """
+
+    def __init__(self, capacity: int = 1 << 16):
+        self._keys = array('Q', bytes(8 * capacity))
+        self._values = array('I', bytes(4 * capacity))
+        self._mask = capacity - 1
+        self.size = 0
+
+    def setdefault(self, digest: int, value: int, same: Optional[Callable[[int], bool]] = None) -> int:
+        """
+        Returns the value stored for `digest`, storing `value` first if there is none.
+
+        With `same` only stored values for which `same(value)` is true count.
+        """
+        # 0 marks empty slots
+        key = digest & _MASK or 1
+        keys, mask = self._keys, self._mask
+        slot = key & mask
+        while True:
+            found = keys[slot]
+            if found == key and (same is None or same(self._values[slot])):
+                return self._values[slot]
+            if not found:
+                break
+            slot = (slot + 1) & mask
+
+        keys[slot] = key
+        self._values[slot] = value
+        self.size += 1
+        if 3 * self.size > 2 * (mask + 1):
+            self._grow(2 * (mask + 1))
+        return value
+
+    def reserve(self, count: int):
+        """
+        Grows the table at once to hold `count` more digests without rehashing.
+        """
+        capacity = self._mask + 1
+        while 3 * (self.size + count) > 2 * capacity:
+            capacity *= 2
+        if capacity > self._mask + 1:
+            self._grow(capacity)
+
+    def _grow(self, capacity: int):
+        keys, values = self._keys, self._values
+        self._keys = new_keys = array('Q', bytes(8 * capacity))
+        self._values = new_values = array('I', bytes(4 * capacity))
+        self._mask = mask = capacity - 1
+        for key, value in compress(zip(keys, values), keys):
+            slot = key & mask
+            while new_keys[slot]:
+                slot = (slot + 1) & mask
+            new_keys[slot] = key
+            new_values[slot] = value
+
+
+class DedupWriter:
+    """
+    Passes only the first of identical commands (or table rows) on to `writer`
+    and writes the mapping file.
+
+    Has the interface of the wrapped writer, `count` is the number of distinct
+    commands and `logical_count` the number of commands written to it.
+    """
+
+    def __init__(self, writer, map_filename, buffer_size: int = -1, manifest=None):
+        self.writer = writer
+        self.map_filename = map_filename
+        self.logical_count = 0
+        self._digests = DigestTable()
+
+        # Distinct keys back to back, the key of line n spans offsets n-1 to n
+        self._keys = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(map_filename)), buffering=buffer_size)
+        self._offsets = array('Q', [0])
+        self._flushed = 0
+
+        if manifest is not None:
+            self._map = manifest.open(map_filename, buffer_size)
+        else:
+            self._map = open(map_filename, 'wb', buffering=buffer_size)
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
+
+    @property
+    def count(self) -> int:
+        return self.writer.count
+
+    def reserve(self, count: int):
+        """
+        Sizes the digest table for `count` more commands.
+        """
+        self._digests.reserve(count)
+
+    def _stored(self, line: int) -> bytes:
+        start, end = self._offsets[line - 1], self._offsets[line]
+        if end > self._flushed:
+            self._keys.flush()
+            self._flushed = self._offsets[-1]
+        return os.pread(self._keys.fileno(), end - start, start)
+
+    def _unique(self, items, keys) -> list:
+        # Distinct items in order, every item's line goes to the mapping file
+        lines = array('I')
+        unique = []
+        base = self.writer.count + 1
+        setdefault, stored = self._digests.setdefault, self._stored
+        for item, key in zip(items, keys):
+            line = setdefault(digest(key), base + len(unique), lambda line: stored(line) == key)
+            if line == base + len(unique):
+                unique.append(item)
+                self._keys.write(key)
+                self._offsets.append(self._offsets[-1] + len(key))
+            lines.append(line)
+
+        if sys.byteorder != 'little':
+            lines.byteswap()
+        self._map.write(lines.tobytes())
+        self.logical_count += len(lines)
+        return unique
+
+    def write_items(self, items):
+        if isinstance(self.writer, TableWriter):
+            self.write_rows(items)
+        else:
+            self.write_many(items)
+
+    def write(self, command: str):
+        self.write_many([command])
+
+    def write_many(self, commands: Iterable[str]):
+        commands = list(commands)
+        self.writer.write_many(self._unique(commands, [command.encode('utf-8', 'surrogatepass') for command in commands]))
+
+    def write_row(self, values: Sequence[str]):
+        self.write_rows([values])
+
+    def write_rows(self, rows: Iterable[Sequence[str]]):
+        rows = list(rows)
+        # Values are single shell words or lines, which cannot hold NUL
+        self.writer.write_rows(self._unique(rows, ['\0'.join(map(str, row)).encode('utf-8', 'surrogatepass') for row in rows]))
+
+    def write_shard(self, filename, count: int, index_filename: Optional[str] = None, chunk_size: int = 1 << 24):
+        """
+        Deduplicates the commands of a shard, which are read back instead of copied.
+        """
+        if not count:
+            return
+
+        if isinstance(self.writer, TableWriter):
+            rows = []
+            for row in iter_rows(filename):
+                rows.append(row)
+                if len(rows) >= self.writer.block_size:
+                    self.write_rows(rows)
+                    rows = []
+            self.write_rows(rows)
+            return
+
+        rest = b''
+        with open(filename, 'rb') as file:
+            while chunk := file.read(chunk_size):
+                lines = (rest + chunk).split(b'\n')
+                rest = lines.pop()
+                self.write_many([line.decode(self.writer.encoding) for line in lines])
+        self.write_many([rest.decode(self.writer.encoding)])
+
+    @property
+    def changed(self) -> bool:
+        return self.writer.changed or getattr(self._map, 'changed', True) is not False
+
+    def discard(self):
+        self.writer.discard()
+        self._map.discard()
+        self._keys.close()
+
+    def close(self):
+        self.writer.close()
+        self._keys.close()
+        if not self._map.closed:
+            self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def count_logical(map_filename) -> int:
+    return os.path.getsize(map_filename) // _LINE.size
+
+
+def read_mapping(map_filename, first: int, last: Optional[int] = None) -> List[int]:
+    """
+    Lines of the command file running commands `first` to `last` inclusive (1-based).
+    """
+    if last is None:
+        last = first
+
+    if first < 1 or last < first:
+        raise IndexError(f'Invalid command range {first}-{last}')
+
+    with open(map_filename, 'rb') as file:
+        file.seek((first - 1) * _LINE.size)
+        lines = array('I')
+        lines.frombytes(file.read((last - first + 1) * _LINE.size))
+    if not lines:
+        raise IndexError(f'{map_filename} has no command {first}')
+    if sys.byteorder != 'little':
+        lines.byteswap()
+    return lines.tolist()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m shell_templates.dedup',
+        description='Print the command file lines running commands of a deduplicated build.',
+    )
+    parser.add_argument('map_filename')
+    parser.add_argument('first', type=int)
+    parser.add_argument('last', type=int, nargs='?')
+    options = parser.parse_args(argv)
+
+    lines = read_mapping(options.map_filename, options.first, options.last)
+    sys.stdout.write('\n'.join(map(str, lines)))
+    sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Random access to single lines of a generated command file.
+
+The index stored next to a command file is a flat array of little-endian
+unsigned 64-bit byte offsets: entry ``i`` is where line ``i + 1`` starts and
+the last entry points one byte past the end of the file, so line ``n`` always
+spans ``[offsets[n - 1], offsets[n] - 1)``.
+
+Usage from a shell script::
+
+    python -m shell_templates.lookup /path/to/commands.sh 42
+    python -m shell_templates.lookup /path/to/commands.sh 41 50
+"""
+from array import array
+from typing import Iterable, List, Optional
+import struct
+import sys
+
+from . import table
+from .table import is_table_filename
+
+
+INDEX_SUFFIX = '.idx'
+
+_OFFSET_SIZE = 8
+
+
+def index_filename_for(filename) -> str:
+    return f'{filename}{INDEX_SUFFIX}'
+
+
+def write_index(index_filename, lines: Iterable[str], encoding: str = 'utf-8', start: int = 0):
+    """
+    Writes an offset index for `lines` joined by newlines and starting at byte `start`.
+    """
+    offsets = array('Q')
+    position = start
+    for line in lines:
+        offsets.append(position)
+        position += len(line.encode(encoding)) + 1
+    offsets.append(position)
+
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+
+    with open(index_filename, 'wb') as file:
+        offsets.tofile(file)
+
+
+def build_index(filename, index_filename=None, chunk_size: int = 1 << 20):
+    """
+    Scans an existing command file and writes its offset index.
+    """
+    if index_filename is None:
+        index_filename = index_filename_for(filename)
+
+    offsets = array('Q', [0])
+    position, last = 0, b'\n'
+    with open(filename, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            newline = chunk.find(b'\n')
+            while newline != -1:
+                offsets.append(position + newline + 1)
+                newline = chunk.find(b'\n', newline + 1)
+            position += len(chunk)
+            last = chunk[-1:]
+
+    # The last line is usually not terminated, its end is the end of the file.
+    if last != b'\n':
+        offsets.append(position + 1)
+
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+
+    with open(index_filename, 'wb') as file:
+        offsets.tofile(file)
+
+
+def read_lines(
+    filename,
+    first: int,
+    last: Optional[int] = None,
+    index_filename: Optional[str] = None,
+    encoding: str = 'utf-8',
+) -> List[str]:
+    """
+    Returns 1-based lines `first` to `last` inclusive of `filename` with a single read.
+
+    `last` defaults to `first` and is clipped to the number of lines in the file.
+    Command tables (`shell_templates.table`) are decoded instead.
+    """
+    if is_table_filename(filename):
+        return table.read_lines(filename, first, last)
+
+    if index_filename is None:
+        index_filename = index_filename_for(filename)
+
+    if last is None:
+        last = first
+
+    if first < 1 or last < first:
+        raise IndexError(f'Invalid line range {first}-{last}')
+
+    with open(index_filename, 'rb') as index:
+        index.seek((first - 1) * _OFFSET_SIZE)
+        data = index.read((last - first + 2) * _OFFSET_SIZE)
+
+    entries = len(data) // _OFFSET_SIZE
+    if entries < 2:
+        raise IndexError(f'{filename} has no line {first}')
+
+    offsets = struct.unpack(f'<{entries}Q', data[:entries * _OFFSET_SIZE])
+    start, end = offsets[0], offsets[-1]
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        return file.read(end - start - 1).decode(encoding).split('\n')
+
+
+def read_line(filename, number: int, index_filename: Optional[str] = None, encoding: str = 'utf-8') -> str:
+    """
+    Returns 1-based line `number` of `filename` reading only that line from disk.
+    """
+    return read_lines(filename, number, number, index_filename, encoding)[0]
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='python -m shell_templates.lookup',
+        description='Print lines of a command file using its byte-offset index, or of a command table.',
+    )
+    parser.add_argument('filename')
+    parser.add_argument('first', type=int)
+    parser.add_argument('last', type=int, nargs='?')
+    parser.add_argument('--index', default=None, help='Index file, defaults to FILENAME' + INDEX_SUFFIX)
+    options = parser.parse_args(argv)
+
+    lines = read_lines(options.filename, options.first, options.last, options.index)
+    sys.stdout.write('\n'.join(lines))
+    sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
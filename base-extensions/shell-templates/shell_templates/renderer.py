@@ -0,0 +1,124 @@
+from typing import Iterable, List, Mapping, Optional, Sequence, Tuple
+from functools import lru_cache
+from string import Template
+
+
+class CompiledRecipe:
+    """
+    A recipe parsed once into a `str.format` template.
+
+    Rendering gives the same result as substituting every part with
+    `string.Template` and joining them with the delimiter, without parsing
+    the parts again for every command.
+    """
+
+    def __init__(self, recipe: Iterable[str], delimiter: str = ' '):
+        self.recipe = tuple(recipe)
+        self.delimiter = delimiter
+
+        keys = []
+        parts = [self._compile_part(part, keys) for part in self.recipe]
+
+        self.keys: Tuple[str, ...] = tuple(dict.fromkeys(keys))
+        self.format_string = _escape(delimiter).join(part for part, _ in parts)
+        self._format_map = self.format_string.format_map
+
+        # The same template with positional `%s` fields for column-wise rendering
+        self._occurrences = tuple(keys)
+        self._percent_string = delimiter.replace('%', '%%').join(part for _, part in parts)
+
+    @staticmethod
+    def _compile_part(part: str, keys: list) -> Tuple[str, str]:
+        pieces = []
+        percent = []
+        last = 0
+        for match in Template.pattern.finditer(part):
+            pieces.append(_escape(part[last:match.start()]))
+            percent.append(part[last:match.start()].replace('%', '%%'))
+            last = match.end()
+
+            if match.group('escaped') is not None:
+                pieces.append('$')
+                percent.append('$')
+                continue
+
+            key = match.group('named') or match.group('braced')
+            if key is None:
+                raise ValueError(f'Invalid placeholder in {part!r} at position {match.start("invalid")}')
+
+            keys.append(key)
+            pieces.append(f'{{{key}!s}}')
+            percent.append('%s')
+
+        pieces.append(_escape(part[last:]))
+        percent.append(part[last:].replace('%', '%%'))
+        return ''.join(pieces), ''.join(percent)
+
+    def render(self, mapping: Optional[Mapping] = None, defaults: Mapping = {}) -> str:
+        """
+        Substitutes placeholders from `mapping`, falling back to `defaults`
+        for keys that are missing or None in `mapping`.
+        """
+        if not mapping:
+            mapping = {}
+
+        values = {}
+        for key in self.keys:
+            value = mapping.get(key)
+            if value is None:
+                value = defaults[key] if key in defaults else mapping[key]
+            values[key] = value
+
+        return self._format_map(values)
+
+    def values(self, mapping: Optional[Mapping] = None, defaults: Mapping = {}) -> Tuple[str, ...]:
+        """
+        Placeholder values `render` would substitute, in the order of `keys`.
+        """
+        if not mapping:
+            mapping = {}
+
+        values = []
+        for key in self.keys:
+            value = mapping.get(key)
+            if value is None:
+                value = defaults[key] if key in defaults else mapping[key]
+            values.append(str(value))
+
+        return tuple(values)
+
+
+    def value_columns(self, columns: Mapping[str, Sequence], size: int, defaults: Mapping = {}) -> List[Sequence]:
+        """
+        A column of values for every key, columns missing from `columns` are filled from `defaults`.
+
+        Like in `render`, None values are replaced by defaults and keys missing from both raise KeyError.
+        """
+        values = []
+        for key in self.keys:
+            column = columns.get(key)
+            if column is None:
+                column = [defaults[key]] * size
+            elif None in column:
+                column = [defaults[key] if value is None else value for value in column]
+            values.append(column)
+        return values
+
+    def render_columns(self, columns: Mapping[str, Sequence], size: int, defaults: Mapping = {}) -> List[str]:
+        """
+        Renders `size` commands from columns of values at once, see `value_columns`.
+        """
+        by_key = dict(zip(self.keys, self.value_columns(columns, size, defaults)))
+        template = self._percent_string
+        if not self._occurrences:
+            return [template % ()] * size
+        return [template % row for row in zip(*(by_key[key] for key in self._occurrences))]
+
+
+def _escape(literal: str) -> str:
+    return literal.replace('{', '{{').replace('}', '}}')
+
+
+@lru_cache(maxsize=256)
+def compile_recipe(recipe: Tuple[str, ...], delimiter: str = ' ') -> CompiledRecipe:
+    return CompiledRecipe(recipe, delimiter)
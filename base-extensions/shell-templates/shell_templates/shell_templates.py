@@ -1,31 +1,37 @@
-from typing import List, Optional, Type
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Sized, Union
+from contextlib import ExitStack
 from pipeline.base import BaseArguments
-from dataclasses import dataclass, field, fields
-from string import Template
+from pipeline import events
+from pipeline.manifest import digest_json
+from dataclasses import dataclass, field, fields, asdict, is_dataclass, replace
+from itertools import islice
 from pathlib import Path
+import os
+import time
 
-
-def deep_set_default(d: dict, default_values: dict):
-    """
-    Recursively sets default values for missing or None keys in a nested dictionary.
-    
-    :param d: The target dictionary to update.
-    :param default_values: The default values dictionary to use.
-    """
-    for key, default in default_values.items():
-        # If key is missing or is None, set it to the default value
-        if key not in d or d[key] is None:
-            d[key] = default
-        # If both are dictionaries, recurse into the nested dictionary
-        elif isinstance(d[key], dict) and isinstance(default, dict):
-            deep_set_default(d[key], default)
-
+from .lookup import index_filename_for
+from .storage import CommandStorage, RecipeBuffer
+from .renderer import compile_recipe
+from .sweep import ShellTemplatesSweep
+from .cache import ShellTemplatesCache, CachedRecipe
 
 
 @dataclass
 class ShellTemplatesCommand:
     recipe: List[str] = field(default_factory=lambda: [])
 
+    # Optional parameter sweep consumed by `append_sweep` of the configurator
+    sweep: Optional[ShellTemplatesSweep] = None
+
+    # Optional result cache, every command is run through `shell_templates.cache`
+    cache: Optional[ShellTemplatesCache] = None
+
+    # `lines` or `table`, see `ShellTemplatesCommandConfigurator.storage`
+    storage: Optional[str] = None
+
+    # Write identical commands once, see `ShellTemplatesCommandConfigurator.dedup`
+    dedup: Optional[bool] = None
+
     def build(self, **kwargs):
         if not 'args' in kwargs and hasattr(self, '__args'):
             kwargs['args'] = getattr(self, '__args')
@@ -39,6 +45,93 @@ class ShellTemplatesCommand:
         return __factory(**kwargs)
 
 
+@dataclass
+class CommandBuildResult:
+    name: str
+
+    num_commands: int
+
+    # Array tasks of slurm commands, None for plain shell commands
+    array_size: Optional[int]
+
+    filename: str
+
+    sbatch_filenames: List[str]
+
+    # Records of the sbatch scripts by filename, see `slurm.rerun`
+    sbatch_records: Dict[str, dict]
+
+    changed: Optional[bool]
+
+    seconds: float
+
+
+class BuildErrors(Exception):
+    """
+    Errors of the commands that failed in `ShellTemplatesArguments.build_all`.
+    """
+
+    def __init__(self, errors: Dict[str, BaseException], results: Dict[str, CommandBuildResult]):
+        self.errors = errors
+        self.results = results
+        super().__init__('\n'.join(
+            f'{name}: {type(error).__name__}: {error}' for name, error in errors.items()
+        ))
+
+
+def _shard_source(source, start, stop):
+    # Sequences are sliced before they are sent to a worker
+    if isinstance(source, Sequence):
+        return source[start:stop], 0, stop - start
+    return source, start, stop
+
+
+def _source_range(source, start, stop):
+    if isinstance(source, Sequence):
+        return source[start:stop]
+    if isinstance(source, ShellTemplatesSweep):
+        return source.slice(start, stop)
+    return source(start, stop)
+
+
+def _render_shard(configurator, source, start, stop, command, delimiter):
+    started, timer = time.time(), time.perf_counter()
+    count = configurator.render_shard(_source_range(source, start, stop), command, delimiter)
+    return count, started, time.perf_counter() - timer
+
+
+def append_declared_sweep(script):
+    script.append_sweep()
+
+
+def _build_command(args, name, generator, build_kwargs) -> CommandBuildResult:
+    start = time.perf_counter()
+    with getattr(args, name).build(**build_kwargs) as script:
+        generator(script)
+    return CommandBuildResult(
+        name=name,
+        num_commands=script.num_commands,
+        array_size=getattr(script, 'array_size', None),
+        filename=script.filename,
+        sbatch_filenames=list(getattr(script, 'sbatch_filenames', [])),
+        sbatch_records=dict(getattr(script, 'sbatch_records', {})),
+        changed=script.changed,
+        seconds=time.perf_counter() - start,
+    )
+
+
+def _build_command_traced(args, name, generator, build_kwargs):
+    # Runs in a worker process, whose events are returned for the trace of the parent
+    collector = events.TraceCollector()
+    events.add_handler(collector)
+    try:
+        return _build_command(args, name, generator, build_kwargs), None, collector.events
+    except Exception as error:
+        return None, error, collector.events
+    finally:
+        events.remove_handler(collector)
+
+
 @dataclass
 class ShellTemplatesArguments(BaseArguments):
 
@@ -50,6 +143,116 @@ class ShellTemplatesArguments(BaseArguments):
                 setattr(getattr(self, f.name), '__args', self)
                 setattr(getattr(self, f.name), '__name', f.name)
 
+    def commands(self) -> Dict[str, ShellTemplatesCommand]:
+        return {
+            f.name: getattr(self, f.name) for f in fields(type(self))
+            if isinstance(getattr(self, f.name), ShellTemplatesCommand)
+        }
+
+    def build_all(
+        self,
+        generators: Union[None, Callable, Dict[str, Callable]] = None,
+        names: Optional[List[str]] = None,
+        executor: str = 'thread',
+        max_workers: Optional[int] = None,
+        **build_kwargs,
+    ) -> Dict[str, CommandBuildResult]:
+        """
+        Builds commands concurrently, each one inside its own `with command.build() as script` block.
+
+        `generators` is a function called with the configurator of every command
+        or a dict of such functions by command name; commands without one append
+        their declared sweep. By default all commands with a generator or a sweep
+        are built. `executor` is `thread` or `process`; processes scale rendering
+        with cores but need picklable generators. Every command writes its own
+        files, so the output does not depend on scheduling. Failures of single
+        commands are collected and raised together as `BuildErrors` once all
+        commands finished.
+        """
+        commands = self.commands()
+        if names is None:
+            names = [
+                name for name, command in commands.items()
+                if callable(generators) or name in (generators or {}) or command.sweep is not None
+            ]
+
+        jobs = {}
+        for name in names:
+            if name not in commands:
+                raise ValueError(f"'{name}' is not a command of {type(self).__name__}")
+            generator = generators if callable(generators) else (generators or {}).get(name)
+            if generator is None:
+                if commands[name].sweep is None:
+                    raise ValueError(f"Command '{name}' has neither a generator nor a sweep")
+                generator = append_declared_sweep
+            jobs[name] = generator
+
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        if executor == 'thread':
+            pool = ThreadPoolExecutor(max_workers=max_workers)
+        elif executor == 'process':
+            pool = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            raise ValueError(f"Unknown executor '{executor}', expected 'thread' or 'process'")
+
+        # Copies of the arguments in worker processes do not trace, their events are sent back
+        trace = getattr(self, '_trace', None) if executor == 'process' else None
+        build = _build_command if trace is None else _build_command_traced
+
+        results, errors = {}, {}
+        self._building_all = True
+        try:
+            with self.tracing(), pool:
+                futures = {name: pool.submit(build, self, name, generator, build_kwargs) for name, generator in jobs.items()}
+                for name, future in futures.items():
+                    try:
+                        result = future.result()
+                        if trace is not None:
+                            result, error, worker_events = result
+                            for event in worker_events:
+                                trace(event)
+                            if error is not None:
+                                raise error
+                        results[name] = result
+                    except Exception as error:
+                        errors[name] = error
+        finally:
+            self._building_all = False
+
+        # Other processes wrote into the build manifest
+        if executor == 'process' and self.manifest is not None:
+            self.manifest.reload()
+
+        with self.tracing():
+            self.after_build_all(results)
+
+        if errors:
+            raise BuildErrors(errors, results)
+        return results
+
+    def after_build_all(self, results: Dict[str, CommandBuildResult]):
+        """
+        Called with the results of `build_all` before errors are raised.
+        """
+        pass
+
+
+@dataclass
+class SweepInput:
+    """
+    Declared sweep a command file was generated from, recorded as input in the build manifest.
+    """
+
+    # Digest of the sweep and everything else the command file depends on, see `sweep_signature`
+    key: str
+
+    # Commands appended by the sweep
+    count: int
+
+    # `(sweep, kwargs)` of `append_sweep` while the command file of a previous build is reused
+    reused: Optional[tuple] = None
+
 
 @dataclass
 class ShellTemplatesCommandConfigurator:
@@ -65,13 +268,65 @@ class ShellTemplatesCommandConfigurator:
 
     open_mode: str = 'w'
 
+    # If True, a byte-offset index is written next to the command file
+    # so that a single line can be read without scanning the whole file.
+    write_index: Optional[bool] = None
+
+    # If True, the command file is opened on `__enter__` and every command
+    # is written as soon as it is appended instead of being kept in `recipe`.
+    stream: bool = False
+
+    buffer_size: int = 1 << 20
+
+    # Number of commands rendered at once by `append_many`.
+    batch_size: int = 4096
+
+    # `lines` writes every rendered command, `table` the recipe once and the
+    # placeholder values in compressed column blocks (`shell_templates.table`).
+    # Tables are always streamed and read back with `shell_templates.lookup`.
+    storage: Optional[str] = None
+
+    # Rows per compressed block of a table
+    table_block_size: int = 4096
+
+    table_compression: Optional[str] = 'zlib'
+
+    # If True, identical commands are written once and `{filename}.map` holds
+    # the line of every appended command (`shell_templates.dedup`). After
+    # `finalize`, `num_commands` counts the distinct commands.
+    dedup: Optional[bool] = None
+
     recipe: List[str] = field(default_factory=lambda: [])
+
+    # Writer from `open_output`, opened on the first command or on `__enter__` when streaming
+    _writer: Optional[object] = field(default=None, init=False, repr=False)
+
+    _defaults: Optional[dict] = field(default=None, init=False, repr=False)
+
+    _num_commands: int = field(default=0, init=False, repr=False)
+
+    # Whether `finalize` modified the command file, False for unchanged incremental builds
+    changed: Optional[bool] = field(default=None, init=False, repr=False)
+
+    # Declared sweep the command file is generated from in an incremental build
+    _input: Optional[SweepInput] = field(default=None, init=False, repr=False)
+
+    # Appended commands dropped by `dedup` as copies of earlier ones
+    duplicates: Optional[int] = field(default=None, init=False, repr=False)
         
     def __enter__(self):
+        # Events of the block go to the trace of the arguments, if they keep one
+        self._tracing = ExitStack()
+        if self.args is not None:
+            self._tracing.enter_context(self.args.tracing())
+        with events.span('configurator.enter', name=self.name):
+            if self.stream:
+                self._writer = self.open_output()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.finalize()
+        with self._tracing:
+            self.finalize()
         return False
 
     def __post_init__(self):
@@ -86,6 +341,32 @@ class ShellTemplatesCommandConfigurator:
 
         assert isinstance(self.command, ShellTemplatesCommand)
 
+        if self.storage is None:
+            self.storage = self.command.storage or 'lines'
+
+        if self.dedup is None:
+            self.dedup = bool(self.command.dedup)
+
+        # Checks that the features can be combined
+        suffix = self.command_storage.suffix
+        if suffix is not None and self.filename_template == type(self).filename_template:
+            self.filename_template = str(Path(self.filename_template).with_suffix(suffix))
+
+    @property
+    def command_storage(self) -> CommandStorage:
+        """
+        Layout of the command file composed from `storage`, `write_index` and `dedup`.
+        """
+        return CommandStorage(
+            kind=self.storage,
+            index=bool(self.write_index),
+            dedup=bool(self.dedup),
+            open_mode=self.open_mode,
+            buffer_size=self.buffer_size,
+            table_block_size=self.table_block_size,
+            table_compression=self.table_compression,
+        )
+
 
     @property
     def metadata(self):
@@ -95,19 +376,69 @@ class ShellTemplatesCommandConfigurator:
             # ...
         )
 
-    def create_command(self, command=None, mapping=None, delimiter=None):
-        if mapping is None:
-            mapping = {}
+    @property
+    def manifest(self):
+        return getattr(self.args, 'manifest', None)
 
-        deep_set_default(mapping, self.metadata)
+    @property
+    def num_commands(self):
+        return self._num_commands
 
+    def _count_command(self, count=1):
+        self._num_commands += count
+
+    def _count_columns(self, keys, size: int) -> Dict[str, list]:
+        """
+        Columns of the metadata among `keys` that changes with every command, for the next `size` commands.
+        """
+        return {}
+
+    @property
+    def defaults(self):
+        """
+        Metadata used for placeholders missing from a mapping, computed once per configurator.
+        """
+        if self._defaults is None:
+            self._defaults = self.metadata
+        return self._defaults
+
+    def renderer(self, command=None, delimiter=None):
         if command is None:
             command = self.command
 
         if delimiter is None:
             delimiter = self.delimiter
-        
-        return delimiter.join([Template(part).substitute(mapping) for part in self.command.recipe])
+
+        renderer = compile_recipe(tuple(command.recipe), delimiter)
+        if command.cache is not None and command.cache.enabled:
+            renderer = CachedRecipe(renderer, command.cache)
+        return renderer
+
+    def create_command(self, command=None, mapping=None, delimiter=None):
+        return self.renderer(command, delimiter).render(mapping, self.defaults)
+
+    def row_renderer(self, command=None, delimiter=None):
+        """
+        Function of `(mapping, defaults)` returning what is stored for one command:
+        the rendered line, or the row of placeholder values for tables.
+        """
+        return self._output().item_renderer(self.renderer(command, delimiter))
+
+    def _output(self):
+        """
+        Writer of appended commands, opened on first use.
+
+        Appending to a command file reused from a previous build renders its sweep again first.
+        """
+        if self._input is not None and self._input.reused is not None:
+            sweep, kwargs = self._input.reused
+            self._count_command(-self._input.count)
+            self._input = None
+            self.append_many(sweep, **kwargs)
+
+        if self._writer is None:
+            self._writer = self.open_output()
+        return self._writer
         
     
     def append_command(
@@ -117,14 +448,322 @@ class ShellTemplatesCommandConfigurator:
         mapping=None,
         delimiter=None,
     ):
+        # Keep the per-command path free of spans unless tracing
+        if events.enabled():
+            with events.span('configurator.append', name=self.name):
+                return self._append_command(command, command_str, mapping, delimiter)
+        return self._append_command(command, command_str, mapping, delimiter)
+
+    def _append_command(self, command, command_str, mapping, delimiter):
+        writer = self._output()
+        self._count_command()
         if command_str is None:
-            command_str = self.create_command(mapping=mapping, delimiter=delimiter, command=command)
+            writer.write_items([writer.item_renderer(self.renderer(command, delimiter))(mapping, self.defaults)])
+        else:
+            writer.write(command_str)
 
-        self.recipe.append(command_str)
+    def append_many(
+        self,
+        mappings: Iterable[Optional[Mapping]],
+        command=None,
+        delimiter=None,
+        batch_size=None,
+    ):
+        """
+        Renders a command for every mapping in `mappings`, `batch_size` commands at a time.
+
+        `mappings` is consumed lazily, so it can be a generator of any length.
+        """
+        writer = self._output()
+        render = writer.item_renderer(self.renderer(command, delimiter))
+        defaults = self.defaults
+        # Sweeps and sequences size the digest table of dedup writers once instead of growing it
+        if isinstance(mappings, Sized):
+            writer.reserve(len(mappings))
+        mappings = self._counted(mappings)
+        batch_size = batch_size or self.batch_size
+
+        while True:
+            with events.span('configurator.append', name=self.name) as span:
+                batch = [render(mapping, defaults) for mapping in islice(mappings, batch_size)]
+                span.count = len(batch)
+                if not batch:
+                    break
+                writer.write_items(batch)
+
+    def append_table(
+        self,
+        source,
+        command=None,
+        delimiter=None,
+        chunk_size=None,
+        **csv_kwargs,
+    ):
+        """
+        Appends a command for every row of a tabular `source`, see `shell_templates.sources`.
+
+        The source is read `chunk_size` rows at a time and every chunk is
+        rendered column-wise at once, so memory does not grow with the table
+        when streaming. Metadata placeholders depending on the number of
+        commands get a column of their own, so every row sees its own count
+        like with `append_command`.
+        """
+        from .sources import iter_column_chunks
+
+        writer = self._output()
+        renderer = self.renderer(command, delimiter)
+        if not hasattr(renderer, 'render_columns'):
+            # Cached commands are rendered row by row
+            return self.append_many(
+                (dict(zip(columns, row)) for columns, _ in iter_column_chunks(source, chunk_size or self.batch_size, **csv_kwargs) for row in zip(*columns.values())),
+                command, delimiter, chunk_size,
+            )
+
+        # Checks that a table stores this recipe
+        writer.item_renderer(renderer)
+
+        for columns, size in iter_column_chunks(source, chunk_size or self.batch_size, **csv_kwargs):
+            with events.span('configurator.append', count=size, name=self.name):
+                counted = self._count_columns(set(renderer.keys).difference(columns), size)
+                if counted:
+                    columns = {**columns, **counted}
+                self._count_command(size)
+                writer.write_items(writer.column_items(renderer, columns, size, self.defaults))
+
+    def append_sharded(
+        self,
+        source,
+        processes=None,
+        shards=None,
+        count=None,
+        command=None,
+        delimiter=None,
+    ):
+        """
+        Appends a command for every mapping of `source`, rendered by `processes` worker processes.
+
+        `source` is a sweep, a sequence of mappings or a picklable function
+        `source(start, stop)` returning mappings `start` to `stop` of `count`.
+        It is split into `shards` consecutive ranges (4 per process by default).
+        Every worker renders its ranges into shard files next to the command file,
+        which are appended to it in order. The command file, its index and the
+        metadata placeholders are the same as with `append_many`.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        import shutil
+        import tempfile
+
+        if count is None:
+            if not isinstance(source, (Sequence, ShellTemplatesSweep)):
+                raise ValueError('`count` is required for sources that are functions')
+            count = len(source)
+
+        # Shards of an unseeded sampling sweep have to share one seed to form a single sample
+        if isinstance(source, ShellTemplatesSweep):
+            source = source.seeded()
+
+        processes = processes or os.cpu_count() or 1
+        shards = shards or 4 * processes
+        storage = self.command_storage
+        block_size = storage.block_size
+
+        # Checks the table against the recipe, shards are always appended to a stream
+        self.row_renderer(command, delimiter)
+        if isinstance(self._writer, RecipeBuffer):
+            self._writer = self._writer.stream()
+        writer = self._writer
+        writer.reserve(count)
+
+        # Table shards have to start at block boundaries
+        head = min(count, -writer.count % block_size)
+        size = -(-max(1, count - head) // shards)
+        size = -(-size // block_size) * block_size
+        ranges = [(start, min(start + size, count)) for start in range(head, count, size)]
+
+        if processes == 1 or len(ranges) < 2:
+            return self.append_many(_source_range(source, 0, count), command, delimiter)
+
+        base = self.num_commands
+        if head:
+            self.append_many(_source_range(source, 0, head), command, delimiter)
+
+        index = storage.kind == 'lines' and writer.writes_index
+        directory = Path(tempfile.mkdtemp(prefix=f'.{Path(self.filename).name}.', dir=Path(self.filename).parent))
+        try:
+            span = events.span('configurator.append_sharded', count=count - head, name=self.name, shards=len(ranges))
+            with span, ProcessPoolExecutor(max_workers=processes) as pool:
+                futures = []
+                for number, (start, stop) in enumerate(ranges):
+                    filename = directory / f'{number:06d}{Path(self.filename).suffix}'
+                    futures.append((filename, pool.submit(
+                        _render_shard, self._shard_configurator(base + start, filename, index),
+                        *_shard_source(source, start, stop), command, delimiter,
+                    )))
+
+                for filename, future in futures:
+                    shard_count, start, seconds = future.result()
+                    events.emit('configurator.shard', start, seconds, shard_count, name=self.name)
+                    index_filename = index_filename_for(filename)
+                    writer.write_shard(filename, shard_count, index_filename if index else None)
+                    self._count_command(shard_count)
+                    # Merged shards are removed right away, so the disk holds little more than the command file
+                    filename.unlink()
+                    if index:
+                        os.unlink(index_filename)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _shard_configurator(self, num_commands, filename, index):
+        # A fresh configurator rendering as this one after `num_commands` commands into `filename`
+        shard = replace(
+            self,
+            filename_template=str(filename).replace('{', '{{').replace('}', '}}'),
+            write_index=index,
+            dedup=False,
+            open_mode='w',
+            recipe=[],
+        )
+        shard._count_command(num_commands)
+        return shard
+
+    def render_shard(self, mappings, command=None, delimiter=None) -> int:
+        """
+        Writes commands of `mappings` to the command file, not through the build manifest,
+        and returns their number. `append_sharded` calls it in worker processes.
+        """
+        self._writer = self.command_storage.open(self.filename, self.renderer())
+        with self._writer:
+            self.append_many(mappings, command, delimiter)
+        return self._writer.count
+
+    def _counted(self, mappings):
+        # Counting while the mappings are consumed keeps `defaults` current for every command
+        for mapping in mappings:
+            self._count_command()
+            yield mapping
 
     
-    def finalize(self):
-        filename = self.filename_template.format(**self.metadata)
+    def append_sweep(self, sweep=None, processes=None, **kwargs):
+        """
+        Appends a command for every mapping of `sweep` or of the sweep declared on the command.
+
+        In incremental builds a declared sweep that already produced the current
+        command file is not rendered again. With `processes` the sweep is
+        rendered by `append_sharded`.
+        """
+        if sweep is None:
+            sweep = self.command.sweep
+
+        if sweep is None:
+            raise ValueError(f"Command '{self.name}' has no sweep declared")
+
+        key = None
+        if self.manifest is not None and self.num_commands == 0 and 'a' not in self.open_mode and is_dataclass(sweep):
+            key = self.sweep_signature(sweep, **kwargs)
+            record = self.manifest.get_input(self.filename)
+            if record is not None and record['key'] == key and self._outputs_intact():
+                self._input = SweepInput(key, record['count'], reused=(sweep, kwargs))
+                self._count_command(record['count'])
+                return
+
+        if processes is None:
+            self.append_many(sweep, **kwargs)
+        else:
+            self.append_sharded(sweep, processes, **kwargs)
+
+        if key is not None:
+            self._input = SweepInput(key, self.num_commands)
+
+    def sweep_signature(self, sweep, command=None, delimiter=None, **kwargs):
+        """
+        Digest of everything the command file of `sweep` depends on.
+        """
+        command = command or self.command
+        return digest_json(dict(
+            recipe=list(command.recipe),
+            delimiter=delimiter or self.delimiter,
+            sweep=asdict(sweep),
+            cache=None if command.cache is None else asdict(command.cache),
+            metadata=self.metadata,
+            **self.command_storage.signature(),
+        ))
+
+    def _outputs_intact(self):
+        return all(self.manifest.is_intact(filename) for filename in self.command_storage.filenames(self.filename))
+
+    
+    @property
+    def filename(self):
+        return self.filename_template.format(**self.metadata)
+
+    @property
+    def index_filename(self):
+        return index_filename_for(self.filename)
 
-        with open(filename, self.open_mode) as file:
-            file.write('\n'.join(self.recipe))
+    @property
+    def map_filename(self):
+        from .dedup import map_filename_for
+
+        return map_filename_for(self.filename)
+
+    def open_writer(self):
+        """
+        Opens the writer of the command file, see `command_storage`.
+        """
+        return self.command_storage.open(self.filename, self.renderer(), self.manifest)
+
+    def open_output(self):
+        """
+        Writer receiving appended commands: the command file when streaming and
+        for tables, otherwise `recipe` until `finalize`.
+        """
+        if self.stream or self.storage == 'table':
+            return self.open_writer()
+        return RecipeBuffer(self.recipe, self.open_writer)
+
+    def write_text(self, filename, text):
+        """
+        Writes a generated file, through the build manifest for incremental builds.
+        """
+        if self.manifest is not None:
+            return self.manifest.write_text(filename, text)
+
+        with open(filename, 'w') as file:
+            file.write(text)
+        return True
+
+    def finalize(self):
+        with events.span('configurator.finalize', count=self.num_commands, name=self.name) as span:
+            self._finalize()
+            span.attributes['changed'] = self.changed
+            if self.dedup:
+                span.attributes['duplicates'] = self.duplicates
+
+    def _finalize(self):
+        if self._input is not None and self._input.reused is not None:
+            if self._writer is not None:
+                self._writer.discard()
+                self._writer = None
+            self.changed = False
+            if self.dedup:
+                from .dedup import count_logical
+
+                self.duplicates = count_logical(self.map_filename) - self.num_commands
+            return
+
+        writer = self._output()
+        writer.close()
+        self._writer = None
+        self.changed = writer.changed
+
+        appended = self.num_commands
+        if self.dedup:
+            # Only the distinct commands are run
+            self.duplicates = appended - writer.count
+            self._count_command(-self.duplicates)
+
+        if self.manifest is not None:
+            if self._input is not None and self._input.count == appended:
+                self.manifest.set_input(self.filename, self._input.key, count=self.num_commands)
+            else:
+                self.manifest.forget_input(self.filename)
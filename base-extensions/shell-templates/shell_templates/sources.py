@@ -0,0 +1,74 @@
+"""
+Tabular parameter sources read in chunks of columns.
+
+A source is one of
+
+* a CSV file name, the header row names the columns,
+* a NumPy structured array,
+* a dict of equally long columns (lists, tuples or NumPy arrays),
+* an iterable of such dicts, e.g. ``(batch.to_pydict() for batch in parquet_file.iter_batches())``.
+
+`iter_column_chunks` yields ``(columns, size)`` with at most `chunk_size` rows,
+every column a list, so only one chunk is held in memory at a time.
+"""
+from typing import Dict, Iterator, List, Mapping, Tuple
+from itertools import islice
+from pathlib import Path
+import csv
+import os
+
+
+Columns = Dict[str, List]
+
+
+def _as_list(column) -> List:
+    # NumPy columns become Python scalars, formatted like the values of mappings
+    return column.tolist() if hasattr(column, 'tolist') else list(column)
+
+
+def _column_dict_chunks(columns: Mapping, chunk_size: int) -> Iterator[Tuple[Columns, int]]:
+    sizes = {name: len(column) for name, column in columns.items()}
+    if len(set(sizes.values())) > 1:
+        raise ValueError(f'Columns have different lengths: {sizes}')
+
+    total = next(iter(sizes.values()), 0)
+    for start in range(0, total, chunk_size):
+        stop = min(start + chunk_size, total)
+        yield {name: _as_list(column[start:stop]) for name, column in columns.items()}, stop - start
+
+
+def _structured_array_chunks(array, chunk_size: int) -> Iterator[Tuple[Columns, int]]:
+    names = array.dtype.names
+    for start in range(0, len(array), chunk_size):
+        chunk = array[start:start + chunk_size]
+        yield {name: chunk[name].tolist() for name in names}, len(chunk)
+
+
+def _csv_chunks(filename, chunk_size: int, **reader_kwargs) -> Iterator[Tuple[Columns, int]]:
+    with open(filename, newline='') as file:
+        reader = csv.reader(file, **reader_kwargs)
+        header = next(reader, None)
+        if header is None:
+            return
+
+        width = len(header)
+        while rows := list(islice(reader, chunk_size)):
+            if any(len(row) != width for row in rows):
+                raise ValueError(f'{filename}: rows around line {reader.line_num} do not have {width} fields')
+            yield dict(zip(header, map(list, zip(*rows)))), len(rows)
+
+
+def iter_column_chunks(source, chunk_size: int = 4096, **csv_kwargs) -> Iterator[Tuple[Columns, int]]:
+    if chunk_size < 1:
+        raise ValueError(f'`chunk_size` must be positive, got {chunk_size}')
+
+    if isinstance(source, (str, os.PathLike)):
+        return _csv_chunks(Path(source), chunk_size, **csv_kwargs)
+
+    if getattr(getattr(source, 'dtype', None), 'names', None):
+        return _structured_array_chunks(source, chunk_size)
+
+    if isinstance(source, Mapping):
+        return _column_dict_chunks(source, chunk_size)
+
+    return (chunk for columns in source for chunk in _column_dict_chunks(columns, chunk_size))
@@ -0,0 +1,189 @@
+"""
+How a configurator stores its commands.
+
+`CommandStorage` composes the writer of a command file from the features
+in use: rendered lines (`writer.CommandFileWriter`) with an optional
+offset index, or a columnar table (`table.TableWriter`), either one
+wrapped by a `dedup.DedupWriter`. Commands that are not streamed are kept
+in a `RecipeBuffer` until the build is finalized.
+
+All writers share one interface, so the configurator does not depend on the
+features: `item_renderer(renderer)` returns a function of `(mapping, defaults)`
+giving what the writer stores for one command, `column_items` renders a
+chunk of columns the same way and `write_items` stores a batch of them.
+"""
+from typing import Callable, List, Optional
+from dataclasses import dataclass
+
+from .lookup import index_filename_for
+from .writer import CommandFileWriter
+from .table import TableWriter, TABLE_SUFFIX, LINE_FORMAT, LINE_KEYS
+
+
+STORAGES = ('lines', 'table')
+
+
+@dataclass
+class CommandStorage:
+    """
+    Layout of a command file and the writers producing it.
+    """
+
+    # `lines` or `table`
+    kind: str = 'lines'
+
+    # Byte-offset index next to a file of lines (`shell_templates.lookup`)
+    index: bool = False
+
+    # Identical commands written once, see `shell_templates.dedup`
+    dedup: bool = False
+
+    open_mode: str = 'w'
+
+    buffer_size: int = 1 << 20
+
+    # Rows per compressed block of a table
+    table_block_size: int = 4096
+
+    table_compression: Optional[str] = 'zlib'
+
+    def __post_init__(self):
+        if self.kind not in STORAGES:
+            raise ValueError(f"Unknown storage '{self.kind}', expected 'lines' or 'table'")
+
+        if self.dedup and 'a' in self.open_mode:
+            raise ValueError('Deduplicated command files cannot be appended to')
+
+        if self.kind == 'table' and 'a' in self.open_mode:
+            raise ValueError('Command tables cannot be appended to')
+
+    @property
+    def suffix(self) -> Optional[str]:
+        """
+        Suffix replacing the one of the default filename template, None to keep it.
+        """
+        return TABLE_SUFFIX if self.kind == 'table' else None
+
+    @property
+    def block_size(self) -> int:
+        """
+        Commands per unit that can be appended as a whole, see `write_shard`.
+        """
+        return self.table_block_size if self.kind == 'table' else 1
+
+    def filenames(self, filename) -> List[str]:
+        """
+        Files written for the command file `filename`.
+        """
+        filenames = [filename]
+        if self.index and self.kind == 'lines':
+            filenames.append(index_filename_for(filename))
+        if self.dedup:
+            from .dedup import map_filename_for
+
+            filenames.append(map_filename_for(filename))
+        return filenames
+
+    def signature(self) -> dict:
+        """
+        Everything about the layout the content of the files depends on.
+        """
+        return dict(
+            index=self.index,
+            storage=[self.kind, self.table_block_size, self.table_compression] if self.kind == 'table' else self.kind,
+            dedup=self.dedup,
+        )
+
+    def open(self, filename, renderer, manifest=None):
+        """
+        Opens the writer of `filename` for commands of `renderer`, through the build manifest if given.
+        """
+        if self.kind == 'table':
+            columns = hasattr(renderer, 'values')
+            writer = TableWriter(
+                filename,
+                format_string=renderer.format_string if columns else LINE_FORMAT,
+                keys=renderer.keys if columns else LINE_KEYS,
+                block_size=self.table_block_size,
+                compression=self.table_compression,
+                buffer_size=self.buffer_size,
+                manifest=manifest,
+            )
+        else:
+            writer = CommandFileWriter(
+                filename,
+                open_mode=self.open_mode,
+                index_filename=index_filename_for(filename) if self.index else None,
+                buffer_size=self.buffer_size,
+                manifest=manifest,
+            )
+
+        if self.dedup:
+            from .dedup import DedupWriter, map_filename_for
+
+            writer = DedupWriter(writer, map_filename_for(filename), self.buffer_size, manifest)
+        return writer
+
+
+class RecipeBuffer:
+    """
+    Keeps rendered commands in `lines` until `close` writes them with a writer from `open_writer`.
+
+    Has the writer interface, `stream` continues with the opened writer instead.
+    """
+
+    def __init__(self, lines: List[str], open_writer: Callable):
+        self.lines = lines
+        self.open_writer = open_writer
+        self._written = None
+
+    @property
+    def count(self) -> int:
+        return len(self.lines) if self._written is None else self._written.count
+
+    @property
+    def changed(self) -> bool:
+        return self._written.changed
+
+    def item_renderer(self, renderer):
+        return renderer.render
+
+    def column_items(self, renderer, columns, size: int, defaults) -> List[str]:
+        return renderer.render_columns(columns, size, defaults)
+
+    def write_items(self, items):
+        self.lines.extend(items)
+
+    def write(self, command: str):
+        self.lines.append(command)
+
+    def write_many(self, commands):
+        self.lines.extend(commands)
+
+    def reserve(self, count: int):
+        pass
+
+    def stream(self):
+        """
+        Opens the writer, writes the buffered commands and returns it for the following ones.
+        """
+        writer = self.open_writer()
+        writer.write_many(self.lines)
+        self.lines.clear()
+        return writer
+
+    def discard(self):
+        self.lines.clear()
+
+    def close(self):
+        if self._written is None:
+            with self.open_writer() as writer:
+                writer.write_many(self.lines)
+            self._written = writer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,277 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from dataclasses import dataclass, field, replace
+from itertools import chain, islice, product
+import hashlib
+import math
+import random
+
+
+def grid(
+    parameters: Dict[str, list],
+    constants: Optional[Dict[str, Any]] = None,
+    start: int = 0,
+    stop: Optional[int] = None,
+) -> Iterator[dict]:
+    """
+    Yields every combination of `parameters` values, the last parameter changing fastest.
+
+    `start` and `stop` select a range of the combinations like `islice`, the
+    combination at `start` is computed from its index without the ones before.
+    """
+    constants = constants or {}
+    keys = list(parameters)
+    combinations = _product_from([parameters[key] for key in keys], start)
+    if stop is not None:
+        combinations = islice(combinations, max(0, stop - start))
+    for values in combinations:
+        yield {**constants, **dict(zip(keys, values))}
+
+
+def _product_from(lists: List[list], start: int) -> Iterator[tuple]:
+    # `product(*lists)` from the combination with flat index `start` (mixed radix)
+    if not start:
+        return product(*lists)
+
+    digits = []
+    for values in reversed(lists):
+        start, digit = divmod(start, len(values)) if values else (start, 0)
+        digits.append(digit)
+    digits.reverse()
+    if start or not all(lists):
+        return iter(())
+
+    # The rest of the innermost run first, then every outer position after
+    # the starting one with all inner positions
+    last = len(lists) - 1
+    return chain.from_iterable(
+        product(
+            *([values[digit]] for values, digit in zip(lists[:level], digits)),
+            lists[level][digits[level] + (level != last):],
+            *lists[level + 1:],
+        )
+        for level in range(last, -1, -1)
+    )
+
+
+def zipped(
+    parameters: Dict[str, list],
+    constants: Optional[Dict[str, Any]] = None,
+    start: int = 0,
+    stop: Optional[int] = None,
+) -> Iterator[dict]:
+    """
+    Yields the i-th value of every parameter together, all value lists must have the same length.
+    """
+    constants = constants or {}
+    keys = list(parameters)
+    if len({len(parameters[key]) for key in keys}) > 1:
+        raise ValueError('Parameters of a zip sweep must have the same number of values')
+    for values in zip(*(parameters[key][start:stop] for key in keys)):
+        yield {**constants, **dict(zip(keys, values))}
+
+
+def random_samples(
+    parameters: Dict[str, Any],
+    num_samples: int,
+    constants: Optional[Dict[str, Any]] = None,
+    seed: Optional[int] = None,
+    start: int = 0,
+    stop: Optional[int] = None,
+) -> Iterator[dict]:
+    """
+    Yields `num_samples` independent samples, see `make_sampler` for the parameter specification.
+
+    With `start` the generator skips the random numbers of the samples before
+    it, so every range yields the same samples as the whole sweep.
+    """
+    constants = constants or {}
+    rng = random.Random(seed)
+    samplers = {key: make_sampler(spec) for key, spec in parameters.items()}
+    _skip(rng, start * len(samplers))
+    for _ in range(start, num_samples if stop is None else min(stop, num_samples)):
+        yield {**constants, **{key: sample(rng.random()) for key, sample in samplers.items()}}
+
+
+def latin_hypercube(
+    parameters: Dict[str, Any],
+    num_samples: int,
+    constants: Optional[Dict[str, Any]] = None,
+    seed: Optional[int] = None,
+    start: int = 0,
+    stop: Optional[int] = None,
+) -> Iterator[dict]:
+    """
+    Yields `num_samples` Latin hypercube samples: for every parameter each of the
+    `num_samples` equal strata of its range is hit exactly once.
+
+    Strata are shuffled with lazy permutations, so memory does not depend on `num_samples`.
+    """
+    constants = constants or {}
+    rng = random.Random(seed)
+    samplers = {key: make_sampler(spec) for key, spec in parameters.items()}
+    permutations = {key: LazyPermutation(num_samples, rng) for key in samplers}
+    _skip(rng, start * len(samplers))
+    for i in range(start, num_samples if stop is None else min(stop, num_samples)):
+        yield {**constants, **{
+            key: sample((permutations[key](i) + rng.random()) / num_samples)
+            for key, sample in samplers.items()
+        }}
+
+
+def _skip(rng: random.Random, draws: int, chunk: int = 1 << 20):
+    # `random()` consumes two 32-bit outputs of the generator, `getrandbits(64 * n)`
+    # consumes the same 2n outputs without a Python call per draw
+    while draws > 0:
+        rng.getrandbits(64 * min(draws, chunk))
+        draws -= chunk
+
+
+def make_sampler(spec) -> Callable[[float], Any]:
+    """
+    Maps a uniform number from [0, 1) to a parameter value.
+
+    `spec` is either a list of choices or a dict with `low`, `high` and optional
+    `log` (sample uniformly in log space) and `integer` (round down, `high` inclusive).
+    `integer` defaults to True when both bounds are integers.
+    """
+    if not isinstance(spec, dict):
+        values = list(spec)
+        if not values:
+            raise ValueError('Cannot sample from an empty list of values')
+        return lambda u: values[min(int(u * len(values)), len(values) - 1)]
+
+    low, high = _number(spec['low']), _number(spec['high'])
+    log = spec.get('log', False)
+    integer = spec.get('integer', isinstance(low, int) and isinstance(high, int))
+    if integer:
+        high = high + 1
+
+    if log:
+        low, high = math.log(low), math.log(high)
+        transform = math.exp
+    else:
+        transform = float
+
+    def sample(u):
+        value = transform(low + u * (high - low))
+        if integer:
+            return min(int(math.floor(value)), int(round(transform(high))) - 1)
+        return value
+
+    return sample
+
+
+def _number(value):
+    # YAML 1.1 loads values such as `1e-4` as strings
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+    return value
+
+
+class LazyPermutation:
+    """
+    A pseudo-random permutation of range(n) evaluated one element at a time.
+
+    A balanced Feistel network over the smallest even number of bits covering
+    `n` is restricted to range(n) by cycle walking. Its round function is
+    BLAKE2b keyed with a round key drawn from `rng`, so a seed gives the same
+    permutation with every Python version and platform.
+    """
+
+    def __init__(self, n: int, rng: random.Random, rounds: int = 4):
+        self.n = n
+        self.half = max(1, ((n - 1).bit_length() + 1) // 2)
+        self.mask = (1 << self.half) - 1
+        self.width = (self.half + 7) // 8
+        self.rounds = [hashlib.blake2b(key=rng.getrandbits(128).to_bytes(16, 'little'), digest_size=8) for _ in range(rounds)]
+
+    def _round(self, hasher, value: int) -> int:
+        hasher = hasher.copy()
+        hasher.update(value.to_bytes(self.width, 'little'))
+        return int.from_bytes(hasher.digest(), 'little') & self.mask
+
+    def __call__(self, i: int) -> int:
+        while True:
+            left, right = i >> self.half, i & self.mask
+            for hasher in self.rounds:
+                left, right = right, left ^ self._round(hasher, right)
+            i = (left << self.half) | right
+            if i < self.n:
+                return i
+
+
+SWEEPS = {
+    'grid': grid,
+    'zip': zipped,
+    'random': random_samples,
+    'latin_hypercube': latin_hypercube,
+}
+
+
+@dataclass
+class ShellTemplatesSweep:
+    """
+    Declarative parameter sweep producing recipe mappings lazily.
+
+    ```yaml
+    sweep:
+        kind: grid
+        parameters:
+            seed: [1, 2, 3]
+            lr: [0.1, 0.01]
+        constants:
+            epochs: 10
+    ```
+    """
+
+    # One of 'grid', 'zip', 'random' or 'latin_hypercube'
+    kind: str = 'grid'
+
+    # For 'grid' and 'zip' lists of values, for sampling sweeps see `make_sampler`.
+    parameters: Dict[str, Any] = field(default_factory=lambda: {})
+
+    # Values added to every mapping
+    constants: Dict[str, Any] = field(default_factory=lambda: {})
+
+    # Number of samples of the 'random' and 'latin_hypercube' sweeps
+    num_samples: Optional[int] = None
+
+    seed: Optional[int] = None
+
+    def __post_init__(self):
+        if self.kind not in SWEEPS:
+            raise ValueError(f"Unknown sweep kind '{self.kind}', expected one of {', '.join(SWEEPS)}")
+
+        if self.kind in ('random', 'latin_hypercube') and self.num_samples is None:
+            raise ValueError(f"'{self.kind}' sweep requires `num_samples`")
+
+    def __iter__(self) -> Iterator[dict]:
+        return self.slice()
+
+    def seeded(self) -> 'ShellTemplatesSweep':
+        """
+        The sweep with a fixed seed, so that every iteration and slice draws the
+        same samples. Sampling sweeps without `seed` get a random one.
+        """
+        if self.seed is not None or self.kind not in ('random', 'latin_hypercube'):
+            return self
+        return replace(self, seed=random.getrandbits(64))
+
+    def slice(self, start: int = 0, stop: Optional[int] = None) -> Iterator[dict]:
+        """
+        Mappings `start` to `stop` of the sweep without building the ones before,
+        the same as `islice(sweep, start, stop)`.
+        """
+        if self.kind in ('grid', 'zip'):
+            return SWEEPS[self.kind](self.parameters, self.constants, start, stop)
+        return SWEEPS[self.kind](self.parameters, self.num_samples, self.constants, self.seed, start, stop)
+
+    def __len__(self) -> int:
+        if self.kind == 'grid':
+            return math.prod(len(values) for values in self.parameters.values())
+        if self.kind == 'zip':
+            return min((len(values) for values in self.parameters.values()), default=0)
+        return self.num_samples
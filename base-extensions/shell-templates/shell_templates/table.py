@@ -0,0 +1,337 @@
+"""
+Columnar storage of commands rendered from a single recipe.
+
+Instead of every rendered line, a table stores the compiled format string of
+the recipe once and the values of its placeholders column by column in blocks
+of `block_size` rows, each block compressed on its own. Reading line N needs
+the trailer, the metadata, one index entry and one block::
+
+    blocks | index: uint64 offsets of blocks and of the index | meta JSON | trailer
+
+The trailer is ``<index offset> <meta offset> PLTB`` as two little-endian
+uint64 and the magic. Within a block the values of one column are joined
+with newlines and columns are separated by NUL bytes, so writing a value
+containing either raises `ValueError`.
+
+Usage from a shell script, the same as for `shell_templates.lookup`::
+
+    python -m shell_templates.table /path/to/commands.table 42
+"""
+from typing import Iterable, List, Optional, Sequence, Tuple
+from array import array
+import json
+import struct
+import sys
+import zlib
+
+
+TABLE_SUFFIX = '.table'
+
+MAGIC = b'PLTB'
+
+VERSION = 1
+
+_TRAILER = struct.Struct('<QQ4s')
+
+# Format of tables storing rendered lines, e.g. of commands that are not plain recipes
+LINE_FORMAT = '{line!s}'
+
+LINE_KEYS = ('line',)
+
+COMPRESSIONS = (None, 'zlib')
+
+
+def is_table_filename(filename) -> bool:
+    return str(filename).endswith(TABLE_SUFFIX)
+
+
+class TableWriter:
+    """
+    Streams rows of placeholder values into a table, keeping only one block in memory.
+
+    Has the writer interface of `shell_templates.storage`, `write` and
+    `write_many` accept rendered lines if the table stores lines (`LINE_FORMAT`).
+    """
+
+    def __init__(
+        self,
+        filename,
+        format_string: str = LINE_FORMAT,
+        keys: Sequence[str] = LINE_KEYS,
+        block_size: int = 4096,
+        compression: Optional[str] = 'zlib',
+        encoding: str = 'utf-8',
+        buffer_size: int = -1,
+        manifest=None,
+    ):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'Unknown compression {compression!r}, expected one of {COMPRESSIONS}')
+        if block_size < 1:
+            raise ValueError(f'`block_size` must be positive, got {block_size}')
+
+        self.filename = filename
+        self.format_string = format_string
+        self.keys = tuple(keys)
+        self.block_size = block_size
+        self.compression = compression
+        self.encoding = encoding
+
+        self.count = 0
+        self.position = 0
+        self._offsets = array('Q')
+        self._rows: List[Tuple[str, ...]] = []
+
+        if manifest is not None:
+            self._file = manifest.open(filename, buffer_size)
+        else:
+            self._file = open(filename, 'wb', buffering=buffer_size)
+
+    @property
+    def stores_lines(self) -> bool:
+        return self.keys == LINE_KEYS and self.format_string == LINE_FORMAT
+
+    def item_renderer(self, renderer):
+        """
+        Function of `(mapping, defaults)` returning the row stored for a command of `renderer`.
+        """
+        if self.stores_lines:
+            render = renderer.render
+            return lambda mapping, defaults: (render(mapping, defaults),)
+
+        if getattr(renderer, 'format_string', None) != self.format_string or renderer.keys != self.keys:
+            raise ValueError(f'{self.filename} stores commands of a single recipe')
+        return renderer.values
+
+    def column_items(self, renderer, columns, size: int, defaults) -> List[Tuple[str, ...]]:
+        if self.stores_lines:
+            return [(line,) for line in renderer.render_columns(columns, size, defaults)]
+        values = [list(map(str, column)) for column in renderer.value_columns(columns, size, defaults)]
+        return list(zip(*values)) if values else [()] * size
+
+    def write_items(self, rows):
+        self.write_rows(rows)
+
+    def reserve(self, count: int):
+        pass
+
+    def write_row(self, values: Sequence[str]):
+        self._rows.append(values)
+        self.count += 1
+        if len(self._rows) >= self.block_size:
+            self._flush()
+
+    def write_rows(self, rows: Iterable[Sequence[str]]):
+        for values in rows:
+            self._rows.append(values)
+            self.count += 1
+            if len(self._rows) >= self.block_size:
+                self._flush()
+
+    def write(self, command: str):
+        self.write_many([command])
+
+    def write_many(self, commands):
+        commands = list(commands)
+        if commands and not self.stores_lines:
+            raise ValueError(f'{self.filename} stores placeholder values of a recipe, not rendered commands')
+        self.write_rows((command,) for command in commands)
+
+    def _flush(self):
+        if not self._rows:
+            return
+
+        columns = ['\n'.join(column) for column in zip(*self._rows)] if self.keys else []
+        for number, column in enumerate(columns):
+            # A separator in a value would shift every later value of the block
+            if '\0' in column or column.count('\n') != len(self._rows) - 1:
+                key = self.keys[number]
+                value = next(values[number] for values in self._rows if '\n' in values[number] or '\0' in values[number])
+                raise ValueError(f'Value {value!r} of {key!r} in {self.filename} contains a newline or NUL byte')
+        data = '\0'.join(columns).encode(self.encoding)
+        if self.compression == 'zlib':
+            data = zlib.compress(data)
+
+        self._offsets.append(self.position)
+        self._file.write(data)
+        self.position += len(data)
+        self._rows = []
+
+    def write_shard(self, filename, count: int, index_filename: Optional[str] = None, chunk_size: int = 1 << 24):
+        """
+        Appends the rows of a table of the same format, e.g. written in another process.
+
+        Full blocks are copied without decoding them, only the rows of a last
+        partial block are written again. The table must be at a block boundary.
+        """
+        if self._rows:
+            raise ValueError(f'{self.filename} has a partial block, shards can only be appended at block boundaries')
+
+        with open(filename, 'rb') as file:
+            meta = read_meta(file)
+            layout = (meta['format'], tuple(meta['keys']), meta['block_size'], meta['compression'], meta['encoding'])
+            if layout != (self.format_string, self.keys, self.block_size, self.compression, self.encoding):
+                raise ValueError(f'{filename} does not have the format of {self.filename}')
+            if meta['rows'] != count:
+                raise ValueError(f'{filename} has {meta["rows"]} rows, expected {count}')
+
+            full = count // self.block_size
+            file.seek(meta['index_offset'])
+            offsets = array('Q')
+            offsets.frombytes(file.read(8 * (full + 1)))
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+
+            # Blocks are stored back to back from the start of the file
+            file.seek(0)
+            remaining = offsets[full]
+            while remaining:
+                chunk = file.read(min(remaining, chunk_size))
+                self._file.write(chunk)
+                remaining -= len(chunk)
+
+            self._offsets.extend(offset + self.position for offset in offsets[:full])
+            self.position += offsets[full]
+            self.count += full * self.block_size
+
+            rest = count - full * self.block_size
+            if rest:
+                columns = _read_block(file, meta, full)
+                self.write_rows(zip(*columns) if self.keys else [()] * rest)
+
+    @property
+    def changed(self) -> bool:
+        return getattr(self._file, 'changed', True) is not False
+
+    def discard(self):
+        self._rows = []
+        self._file.discard()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._flush()
+
+        index_offset = self.position
+        self._offsets.append(self.position)
+        if sys.byteorder != 'little':
+            self._offsets.byteswap()
+        index = self._offsets.tobytes()
+
+        meta = json.dumps({
+            'version': VERSION,
+            'format': self.format_string,
+            'keys': list(self.keys),
+            'rows': self.count,
+            'block_size': self.block_size,
+            'compression': self.compression,
+            'encoding': self.encoding,
+        }).encode()
+
+        self._file.write(index)
+        self._file.write(meta)
+        self._file.write(_TRAILER.pack(index_offset, index_offset + len(index), MAGIC))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def read_meta(file) -> dict:
+    file.seek(-_TRAILER.size, 2)
+    end = file.tell()
+    index_offset, meta_offset, magic = _TRAILER.unpack(file.read(_TRAILER.size))
+    if magic != MAGIC:
+        raise ValueError(f'{file.name} is not a command table')
+
+    file.seek(meta_offset)
+    meta = json.loads(file.read(end - meta_offset))
+    if meta['version'] > VERSION:
+        raise ValueError(f'{file.name} has table version {meta["version"]}, supported up to {VERSION}')
+    meta['index_offset'] = index_offset
+    return meta
+
+
+def _read_block(file, meta, block: int) -> List[List[str]]:
+    file.seek(meta['index_offset'] + block * 8)
+    start, end = struct.unpack('<2Q', file.read(16))
+    file.seek(start)
+    data = file.read(end - start)
+    if meta['compression'] == 'zlib':
+        data = zlib.decompress(data)
+    return [column.split('\n') for column in data.decode(meta['encoding']).split('\0')]
+
+
+def iter_rows(filename) -> Iterable[Tuple[str, ...]]:
+    """
+    Yields the rows of placeholder values of a table, one block decoded at a time.
+    """
+    with open(filename, 'rb') as file:
+        meta = read_meta(file)
+        block_size = meta['block_size']
+        for block in range(-(-meta['rows'] // block_size)):
+            size = min(block_size, meta['rows'] - block * block_size)
+            if not meta['keys']:
+                yield from [()] * size
+                continue
+            yield from zip(*_read_block(file, meta, block))
+
+
+def read_lines(filename, first: int, last: Optional[int] = None) -> List[str]:
+    """
+    Returns commands `first` to `last` inclusive (1-based), decoding only the blocks holding them.
+
+    `last` defaults to `first` and is clipped to the number of rows.
+    """
+    if last is None:
+        last = first
+
+    if first < 1 or last < first:
+        raise IndexError(f'Invalid line range {first}-{last}')
+
+    with open(filename, 'rb') as file:
+        meta = read_meta(file)
+        last = min(last, meta['rows'])
+        if first > last:
+            raise IndexError(f'{filename} has no line {first}')
+
+        format_map = meta['format'].format_map
+        keys = meta['keys']
+        block_size = meta['block_size']
+
+        lines = []
+        for block in range((first - 1) // block_size, (last - 1) // block_size + 1):
+            columns = _read_block(file, meta, block)
+            offset = block * block_size
+            for row in range(max(first - 1, offset) - offset, min(last, offset + block_size) - offset):
+                lines.append(format_map({key: column[row] for key, column in zip(keys, columns)}))
+        return lines
+
+
+def read_line(filename, number: int) -> str:
+    return read_lines(filename, number)[0]
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='python -m shell_templates.table',
+        description='Print lines of a command table.',
+    )
+    parser.add_argument('filename')
+    parser.add_argument('first', type=int)
+    parser.add_argument('last', type=int, nargs='?')
+    options = parser.parse_args(argv)
+
+    lines = read_lines(options.filename, options.first, options.last)
+    sys.stdout.write('\n'.join(lines))
+    sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+from typing import List, Optional
+from array import array
+import os
+import struct
+import sys
+
+from .lookup import build_index
+
+
+_OFFSET = struct.Struct('<Q')
+
+
+class CommandFileWriter:
+    """
+    Writes newline separated commands to a file, optionally maintaining
+    the byte-offset index read by `shell_templates.lookup`.
+
+    Only counters are kept in memory, so it can be used to stream
+    arbitrarily many commands to disk. See `shell_templates.storage` for the
+    interface shared by all writers.
+    """
+
+    def __init__(
+        self,
+        filename,
+        open_mode: str = 'w',
+        index_filename: Optional[str] = None,
+        encoding: str = 'utf-8',
+        buffer_size: int = -1,
+        manifest=None,
+    ):
+        self.filename = filename
+        self.index_filename = index_filename
+        self.encoding = encoding
+        self.append = 'a' in open_mode
+
+        self.position = os.path.getsize(filename) if self.append and os.path.exists(filename) else 0
+        self.count = 0
+
+        self._separate = self.position > 0
+        self._index = None
+
+        # With a build manifest (`pipeline.manifest`) files are replaced only if their content changed
+        if manifest is not None and not self.append:
+            self._file = manifest.open(filename, buffer_size)
+            if index_filename is not None:
+                self._index = manifest.open(index_filename, buffer_size)
+            return
+
+        if manifest is not None:
+            manifest.forget(filename)
+        self._file = open(filename, 'ab' if self.append else 'wb', buffering=buffer_size)
+        # In append mode the existing part of the file is re-indexed on close
+        if index_filename is not None and not self.append:
+            self._index = open(index_filename, 'wb', buffering=buffer_size)
+
+    def item_renderer(self, renderer):
+        return renderer.render
+
+    def column_items(self, renderer, columns, size: int, defaults) -> List[str]:
+        return renderer.render_columns(columns, size, defaults)
+
+    def write_items(self, commands):
+        self.write_many(commands)
+
+    def reserve(self, count: int):
+        pass
+
+    def write(self, command: str):
+        if self._separate:
+            self._file.write(b'\n')
+            self.position += 1
+        self._separate = True
+
+        if self._index is not None:
+            self._index.write(_OFFSET.pack(self.position))
+
+        data = command.encode(self.encoding)
+        self._file.write(data)
+        self.position += len(data)
+        self.count += 1
+
+    def write_many(self, commands):
+        data = [command.encode(self.encoding) for command in commands]
+        if not data:
+            return
+
+        separator = 1 if self._separate else 0
+        if self._index is not None:
+            offsets = array('Q')
+            position = self.position + separator
+            for line in data:
+                offsets.append(position)
+                position += len(line) + 1
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+            self._index.write(offsets.tobytes())
+
+        block = b'\n'.join(data)
+        if separator:
+            self._file.write(b'\n')
+        self._file.write(block)
+
+        self.position += separator + len(block)
+        self.count += len(data)
+        self._separate = True
+
+    @property
+    def writes_index(self) -> bool:
+        return self._index is not None
+
+    def write_shard(self, filename, count: int, index_filename: Optional[str] = None, chunk_size: int = 1 << 24):
+        """
+        Appends the `count` commands of a file written by another writer, e.g. in another process.
+
+        The file is copied in chunks. If this writer writes an index, the offsets
+        in the index of the shard (`index_filename`) are moved to its position.
+        """
+        if not count:
+            return
+
+        separator = 1 if self._separate else 0
+        if self._index is not None:
+            shift = self.position + separator
+            with open(index_filename, 'rb') as file:
+                # Only the offsets of the lines, not the end offset the shard index closes with
+                remaining = count
+                while remaining:
+                    offsets = array('Q')
+                    offsets.frombytes(file.read(8 * min(remaining, chunk_size // 8)))
+                    if not offsets:
+                        raise ValueError(f'{index_filename} has fewer than {count} offsets')
+                    if sys.byteorder != 'little':
+                        offsets.byteswap()
+                    offsets = array('Q', [offset + shift for offset in offsets])
+                    if sys.byteorder != 'little':
+                        offsets.byteswap()
+                    self._index.write(offsets.tobytes())
+                    remaining -= len(offsets)
+
+        if separator:
+            self._file.write(b'\n')
+        size = 0
+        with open(filename, 'rb') as file:
+            while chunk := file.read(chunk_size):
+                self._file.write(chunk)
+                size += len(chunk)
+
+        self.position += separator + size
+        self.count += count
+        self._separate = True
+
+    @property
+    def changed(self) -> bool:
+        """
+        Whether closing the writer modified the command file.
+        """
+        return getattr(self._file, 'changed', True) is not False
+
+    def discard(self):
+        """
+        Drops everything written so far, only possible with a build manifest.
+        """
+        self._file.discard()
+        if self._index is not None:
+            self._index.discard()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+
+        if self._index is not None:
+            self._index.write(_OFFSET.pack(self.position + 1))
+            self._index.close()
+        elif self.index_filename is not None:
+            build_index(self.filename, self.index_filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -12,6 +12,11 @@ setup(
             'slurm.Slurm = slurm.slurm:Slurm',
             'slurm.DefaultTemplateBody = slurm.slurm:SlurmDefaultTemplateBody',
             'slurm.Arguments = slurm.slurm:SlurmArguments',
+            'slurm.LocalExecutor = slurm.local:LocalExecutor',
+            'slurm.LocalScheduler = slurm.local_sbatch:LocalScheduler',
+            'slurm.LogSink = slurm.logsink:LogSink',
+            'slurm.Submitter = slurm.submit:Submitter',
+            'slurm.JobTracker = slurm.tracker:JobTracker',
             
         ]
     },
@@ -0,0 +1,119 @@
+"""
+Dependencies between the commands of one build.
+
+A command lists the commands it runs after in `slurm.dependencies`, either by
+name, meaning `afterok` on the whole array, or as `<type>:<name>` with an
+sbatch dependency type, e.g. `aftercorr:generate_file` to start task N as soon
+as task N of `generate_file` succeeded. `submit_script` submits the sbatch
+scripts of all commands in topological order and passes the captured job IDs
+to `--dependency`, `slurm.submit` does the same from Python with retries.
+"""
+from typing import Dict, List, Tuple
+import shlex
+
+
+DEPENDENCY_TYPES = ('after', 'afterany', 'afterok', 'afternotok', 'aftercorr')
+
+
+def parse_dependency(spec: str) -> Tuple[str, str]:
+    """
+    Splits `aftercorr:name` into `('aftercorr', 'name')`, a bare name depends with `afterok`.
+    """
+    kind, separator, name = spec.partition(':')
+    if not separator:
+        return 'afterok', spec.strip()
+
+    kind = kind.strip()
+    if kind not in DEPENDENCY_TYPES:
+        raise ValueError(f'Unknown dependency type {kind!r} in {spec!r}, expected one of {", ".join(DEPENDENCY_TYPES)}')
+    return kind, name.strip()
+
+
+def topological_order(dependencies: Dict[str, List[Tuple[str, str]]]) -> List[str]:
+    """
+    Orders commands so that every command follows its dependencies, otherwise keeping the declaration order.
+    """
+    for name, upstream in dependencies.items():
+        for _, dependency in upstream:
+            if dependency not in dependencies:
+                raise ValueError(f"Command '{name}' depends on unknown command '{dependency}'")
+
+    order = []
+    remaining = dict(dependencies)
+    while remaining:
+        ready = [
+            name for name, upstream in remaining.items()
+            if all(dependency not in remaining for _, dependency in upstream)
+        ]
+        if not ready:
+            raise ValueError(f'Dependency cycle between commands {", ".join(remaining)}')
+        for name in ready:
+            order.append(name)
+            del remaining[name]
+    return order
+
+
+def chunk_conditions(name: str, chunk: int, scripts: Dict[str, List[str]], dependencies: Dict[str, List[Tuple[str, str]]]) -> List[Tuple[str, str, List[int]]]:
+    """
+    `(type, upstream command, upstream chunks)` that chunk `chunk` (1-based) of `name` waits for.
+
+    `aftercorr` pairs chunks when both commands have the same number of chunks
+    and waits for all chunks otherwise. Commands without scripts are skipped.
+    """
+    conditions = []
+    for kind, upstream in dependencies[name]:
+        chunks = list(range(1, len(scripts.get(upstream) or []) + 1))
+        if not chunks:
+            continue
+        if kind == 'aftercorr' and len(chunks) == len(scripts[name]):
+            chunks = [chunk]
+        conditions.append((kind, upstream, chunks))
+    return conditions
+
+
+def _job_variable(name: str, chunk: int) -> str:
+    return f'job_{name}_{chunk}'
+
+
+def submit_script(scripts: Dict[str, List[str]], dependencies: Dict[str, List[Tuple[str, str]]]) -> str:
+    """
+    Bash script submitting `scripts` (command name -> sbatch scripts) in dependency order.
+
+    Commands split into several arrays depend chunk by chunk with `aftercorr`
+    when both sides have the same number of chunks, and on all chunks otherwise.
+    """
+    lines = [
+        '#!/bin/bash',
+        '# Submits all commands of the build in dependency order.',
+        '# Set SBATCH to use another submission command, e.g. SBATCH="python -m slurm.local_sbatch"',
+        'set -e',
+        'SBATCH=${SBATCH:-sbatch}',
+    ]
+
+    for name in topological_order(dependencies):
+        if not scripts.get(name):
+            continue
+
+        lines.append('')
+        for kind, upstream in dependencies[name]:
+            if not scripts.get(upstream):
+                lines.append(f'# {name} runs after {upstream}, which is not generated in this build')
+            elif kind == 'aftercorr' and len(scripts[upstream]) != len(scripts[name]):
+                lines.append(f'# {name} and {upstream} are split into different arrays, aftercorr waits for all of {upstream}')
+
+        for chunk, script in enumerate(scripts[name], start=1):
+            conditions = [
+                f'{kind}:' + ':'.join(f'${{{_job_variable(upstream, number)}}}' for number in chunks)
+                for kind, upstream, chunks in chunk_conditions(name, chunk, scripts, dependencies)
+            ]
+
+            variable = _job_variable(name, chunk)
+            option = f' --dependency={",".join(conditions)}' if conditions else ''
+            lines += [
+                f'{variable}=$($SBATCH --parsable{option} {shlex.quote(str(script))})',
+                # --parsable prints `jobid[;cluster]`
+                f'{variable}=${{{variable}%%;*}}',
+                f'echo "Submitted {name} as job ${{{variable}}}"',
+            ]
+
+    return '\n'.join([*lines, ''])
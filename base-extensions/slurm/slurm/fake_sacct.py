@@ -0,0 +1,109 @@
+"""
+Stand-in for `sacct` reporting simulated states of jobs recorded by `slurm.fake_sbatch`.
+
+Nothing runs: a job starts `--pending` seconds after its submission or after
+the jobs in its `--dependency` ended, runs `--concurrency` tasks at a time
+for `--runtime` seconds each, and a task fails with probability
+`--failure-rate` (the same tasks on every call). Output follows
+``sacct -n -P -o JobID,State,ExitCode`` including the collapsed line of
+pending tasks::
+
+    SACCT="python -m slurm.fake_sacct --runtime 2 --failure-rate 0.01" python -m slurm.tracker build --wait
+"""
+from typing import Dict, List, Optional
+from pathlib import Path
+import argparse
+import random
+import sys
+import time
+
+from .fake_sbatch import FakeController
+from .scripts import format_array, parse_array, parse_sbatch_options
+
+
+class FakeAccounting:
+    def __init__(self, controller: FakeController, pending: float = 1.0, runtime: float = 1.0, concurrency: int = 100, failure_rate: float = 0.0):
+        self.controller = controller
+        self.pending = pending
+        self.runtime = runtime
+        self.concurrency = concurrency
+        self.failure_rate = failure_rate
+        self.jobs = {str(job['job_id']): job for job in controller.jobs()}
+        self._indices: Dict[str, List[int]] = {}
+        self._ends: Dict[str, float] = {}
+
+    def indices(self, job_id: str) -> List[int]:
+        if job_id not in self._indices:
+            script = Path(self.jobs[job_id]['script'])
+            array = parse_sbatch_options(script).get('array', '1') if script.exists() else '1'
+            self._indices[job_id] = parse_array(array)[0]
+        return self._indices[job_id]
+
+    def start(self, job_id: str) -> float:
+        job = self.jobs[job_id]
+        upstream = [
+            upstream.split('+')[0]
+            for condition in filter(None, job['dependency'].split(','))
+            for upstream in condition.split(':')[1:]
+        ]
+        return max([job['time'] + self.pending, *(self.end(upstream) for upstream in upstream if upstream in self.jobs)])
+
+    def end(self, job_id: str) -> float:
+        if job_id not in self._ends:
+            waves = -(-len(self.indices(job_id)) // self.concurrency)
+            self._ends[job_id] = self.start(job_id) + waves * self.runtime
+        return self._ends[job_id]
+
+    def fails(self, job_id: str, index: int) -> bool:
+        return random.Random(f'{job_id}_{index}').random() < self.failure_rate
+
+    def lines(self, job_ids: List[str], now: Optional[float] = None) -> List[str]:
+        now = time.time() if now is None else now
+        lines = []
+        for job_id in job_ids:
+            if job_id not in self.jobs:
+                continue
+            start = self.start(job_id)
+            pending = []
+            for position, index in enumerate(self.indices(job_id)):
+                task_start = start + position // self.concurrency * self.runtime
+                if now < task_start:
+                    pending.append(index)
+                elif now < task_start + self.runtime:
+                    lines.append(f'{job_id}_{index}|RUNNING|0:0')
+                elif self.fails(job_id, index):
+                    lines.append(f'{job_id}_{index}|FAILED|1:0')
+                else:
+                    lines.append(f'{job_id}_{index}|COMPLETED|0:0')
+            if pending:
+                lines.append(f'{job_id}_[{format_array(pending)}]|PENDING|0:0')
+        return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m slurm.fake_sacct', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--state', default=None, help='State directory of slurm.fake_sbatch')
+    parser.add_argument('-j', '--jobs', default='')
+    parser.add_argument('--pending', type=float, default=1.0)
+    parser.add_argument('--runtime', type=float, default=1.0)
+    parser.add_argument('--concurrency', type=int, default=100, help='Running tasks per job')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    # Output options of sacct, the format is always JobID,State,ExitCode
+    parser.add_argument('-o', '--format', default=None)
+    parser.add_argument('-n', '--noheader', action='store_true')
+    parser.add_argument('-P', '--parsable2', action='store_true')
+    parser.add_argument('-X', '--allocations', action='store_true')
+    options = parser.parse_args(argv)
+
+    controller = FakeController(options.state)
+    controller.count_call('sacct')
+    accounting = FakeAccounting(controller, options.pending, options.runtime, options.concurrency, options.failure_rate)
+    lines = accounting.lines(options.jobs.split(',') if options.jobs else list(accounting.jobs))
+    if not options.noheader:
+        lines.insert(0, 'JobID|State|ExitCode')
+    print('\n'.join(lines))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Stand-in for `sbatch` that only records submissions, for testing submission code.
+
+Jobs are numbered from a counter in the state directory and appended to
+`jobs.jsonl`, nothing is run. The controller can be made slow and unreliable
+like a busy slurmctld::
+
+    SBATCH="python -m slurm.fake_sbatch --latency 0.2 --max-rate 5 --error-rate 0.1" bash submit.sh
+
+`--max-rate` limits submissions per second across all processes sharing the
+state and rejects the rest with the transient errors sbatch prints when the
+controller is overloaded. `--error-rate` fails that fraction of submissions
+at random with the same errors.
+"""
+from typing import List, Optional
+from pathlib import Path
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from pipeline.manifest import FileLock
+
+
+STATE_ENVIRONMENT_VARIABLE = 'PIPELINE_FAKE_SBATCH'
+
+TRANSIENT_ERRORS = (
+    'sbatch: error: Batch job submission failed: Socket timed out on send/recv operation',
+    'sbatch: error: Batch job submission failed: Resource temporarily unavailable',
+)
+
+
+class FakeController:
+    """
+    State in `path`: `counter` (last job ID), `bucket` (token bucket of `max_rate`), `jobs.jsonl`
+    and `<command>_calls` counting the calls of the fake commands.
+    """
+
+    def __init__(self, path=None):
+        path = path or os.environ.get(STATE_ENVIRONMENT_VARIABLE) or Path(tempfile.gettempdir()) / f'pipeline_fake_sbatch_{os.getuid()}'
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _locked(self):
+        return FileLock(self.path / 'lock')
+
+    def _take_token(self, max_rate: float) -> bool:
+        # Token bucket holding at most one second of submissions
+        bucket_path = self.path / 'bucket'
+        now = time.time()
+        try:
+            tokens, last = map(float, bucket_path.read_text().split())
+        except (OSError, ValueError):
+            tokens, last = max_rate, now
+        tokens = min(max_rate, tokens + (now - last) * max_rate)
+        taken = tokens >= 1
+        bucket_path.write_text(f'{tokens - taken} {now}\n')
+        return taken
+
+    def submit(self, script, dependency: str = '', max_rate: Optional[float] = None, options: List[str] = ()) -> Optional[int]:
+        """
+        Records a job and returns its ID, None if the submission was rejected by the rate limit.
+        """
+        with self._locked():
+            if max_rate and not self._take_token(max_rate):
+                return None
+
+            counter_path = self.path / 'counter'
+            job_id = int(counter_path.read_text()) + 1 if counter_path.exists() else 1
+            counter_path.write_text(f'{job_id}\n')
+            with open(self.path / 'jobs.jsonl', 'a') as file:
+                file.write(json.dumps({
+                    'job_id': job_id,
+                    'script': str(Path(script).resolve()),
+                    'dependency': dependency,
+                    'options': list(options),
+                    'time': time.time(),
+                }) + '\n')
+            return job_id
+
+    def count_call(self, command: str):
+        with self._locked():
+            path = self.path / f'{command}_calls'
+            path.write_text(f'{self.calls(command) + 1}\n')
+
+    def calls(self, command: str) -> int:
+        path = self.path / f'{command}_calls'
+        return int(path.read_text()) if path.exists() else 0
+
+    def jobs(self) -> List[dict]:
+        path = self.path / 'jobs.jsonl'
+        if not path.exists():
+            return []
+        return [json.loads(line) for line in path.read_text().splitlines() if line]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m slurm.fake_sbatch', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('script', nargs='?')
+    parser.add_argument('--state', default=None, help=f'State directory, defaults to ${STATE_ENVIRONMENT_VARIABLE}')
+    parser.add_argument('-d', '--dependency', default='')
+    parser.add_argument('--parsable', action='store_true')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds every call takes')
+    parser.add_argument('--max-rate', type=float, default=None, help='Accepted submissions per second')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of submissions failing at random')
+    parser.add_argument('--jobs', action='store_true', help='Print the recorded jobs as JSON lines')
+    options, unknown = parser.parse_known_args(argv)
+
+    controller = FakeController(options.state)
+    if options.jobs:
+        for job in controller.jobs():
+            print(json.dumps(job))
+        return 0
+
+    controller.count_call('sbatch')
+
+    if options.script is None:
+        parser.error('the script to submit is required')
+
+    time.sleep(options.latency)
+    if random.random() < options.error_rate:
+        print(random.choice(TRANSIENT_ERRORS), file=sys.stderr)
+        return 1
+
+    job_id = controller.submit(options.script, options.dependency, options.max_rate, unknown)
+    if job_id is None:
+        print(random.choice(TRANSIENT_ERRORS), file=sys.stderr)
+        return 1
+
+    print(job_id if options.parsable else f'Submitted batch job {job_id}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
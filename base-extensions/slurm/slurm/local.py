@@ -0,0 +1,349 @@
+"""
+Runs generated sbatch scripts on the local machine instead of a SLURM cluster.
+
+Every array task executes the unchanged sbatch script with the SLURM
+environment variables it relies on, so the same build can be tested offline
+or run on a big workstation::
+
+    python -m slurm.local /path/to/build --workers 16
+"""
+from typing import Callable, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from pathlib import Path
+from queue import Queue
+import argparse
+import os
+import re
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from .rerun import array_offset
+from .scripts import parse_sbatch_options, parse_array, parse_memory, find_sbatch_scripts, expand_filename_pattern
+from .usage import TaskUsage, append_usage
+
+
+_USAGE_LOG = re.compile(r'^usage_log=(.+)$', re.MULTILINE)
+
+_USAGE_NAME = re.compile(r'^usage_name=(.+)$', re.MULTILINE)
+
+
+@dataclass
+class LocalTask:
+    script: Path
+
+    task_id: int
+
+    job_id: str
+
+    job_name: str
+
+    stdout: Path
+
+    stderr: Path
+
+    cpus: int = 1
+
+    memory: Optional[int] = None
+
+    task_count: int = 1
+
+    # `--open-mode=append`, tasks share output files
+    append: bool = False
+
+    returncode: Optional[int] = None
+
+    elapsed: Optional[float] = None
+
+    # Peak resident memory in bytes and CPU time of the script and its children
+    max_rss: Optional[int] = None
+
+    cpu_seconds: Optional[float] = None
+
+    # Killed for exceeding `memory`, like OUT_OF_MEMORY tasks of SLURM
+    out_of_memory: bool = False
+
+
+@dataclass
+class LocalExecutor:
+    # Number of tasks running at once, defaults to the number of cores divided by `cpus_per_task`
+    workers: Optional[int] = None
+
+    # Pin tasks to `cpus_per_task` cores and kill tasks whose resident memory exceeds `mem`/`mem_per_cpu`.
+    # Memory is measured by polling the process tree in /proc, so it is only enforced on Linux.
+    enforce_limits: bool = True
+
+    # Seconds between two measurements of the memory of a task
+    memory_poll: float = 1.0
+
+    shell: str = 'bash'
+
+    # Extra environment variables of every task
+    env: Dict[str, str] = field(default_factory=lambda: {})
+
+    def tasks(self, script, job_id=None) -> List[LocalTask]:
+        """
+        Array tasks of a single sbatch script.
+        """
+        script = Path(script).resolve()
+        options = parse_sbatch_options(script)
+
+        job_name = options.get('job_name', script.stem)
+        job_id = job_id or f'local{os.getpid()}'
+        indices, _ = parse_array(options['array']) if 'array' in options else ([0], None)
+
+        cpus = int(options.get('cpus_per_task') or 1)
+        memory = None
+        if options.get('mem'):
+            memory = parse_memory(options['mem'])
+        elif options.get('mem_per_cpu'):
+            memory = parse_memory(options['mem_per_cpu']) * cpus
+
+        stdout = options.get('output', str(script.parent / 'slurm-%A_%a.out'))
+        stderr = options.get('error', stdout)
+
+        return [
+            LocalTask(
+                script=script,
+                task_id=index,
+                job_id=job_id,
+                job_name=job_name,
+                stdout=Path(expand_filename_pattern(stdout, job_id, index, job_name)),
+                stderr=Path(expand_filename_pattern(stderr, job_id, index, job_name)),
+                cpus=cpus,
+                memory=memory,
+                task_count=len(indices),
+                append=options.get('open_mode') == 'append',
+            )
+            for index in indices
+        ]
+
+    def run(self, target) -> List[LocalTask]:
+        """
+        Runs all tasks of a finalized configurator, a build directory, an sbatch script or a list of them.
+        """
+        scripts = []
+        for item in (target if isinstance(target, (list, tuple)) else [target]):
+            if hasattr(item, 'sbatch_filenames'):
+                scripts.extend(item.sbatch_filenames)
+            elif Path(item).is_dir():
+                scripts.extend(find_sbatch_scripts(item))
+            else:
+                scripts.append(item)
+
+        tasks = []
+        throttles = {}
+        for number, script in enumerate(scripts, start=1):
+            script_tasks = self.tasks(script, job_id=f'local{os.getpid()}{number:03d}')
+            tasks.extend(script_tasks)
+            _, throttle = parse_array(parse_sbatch_options(script).get('array', '0'))
+            if throttle:
+                throttles[Path(script).resolve()] = threading.Semaphore(throttle)
+
+        return self.run_tasks(tasks, throttles)
+
+    def run_tasks(
+        self,
+        tasks: List[LocalTask],
+        throttles: Optional[Dict] = None,
+        throttle: Optional[int] = None,
+        wait_for: Optional[Callable[[LocalTask], bool]] = None,
+        on_finish: Optional[Callable[[LocalTask], None]] = None,
+    ) -> List[LocalTask]:
+        """
+        Runs `tasks` on the worker slots.
+
+        `throttles` maps scripts to semaphores limiting their running tasks and
+        `throttle` limits all tasks. `wait_for` blocks until a task may start
+        and returns False to skip it; `on_finish` is called after every task.
+        """
+        throttles = throttles or {}
+        shared = threading.Semaphore(throttle) if throttle else None
+        cpus = max((task.cpus for task in tasks), default=1)
+        available = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+        workers = self.workers or max(1, len(available) // cpus)
+
+        # Every worker slot owns its own set of cores
+        slots = Queue()
+        for slot in range(workers):
+            cores = available[slot * cpus:(slot + 1) * cpus]
+            slots.put(set(cores) if len(cores) == cpus else None)
+
+        def execute(task):
+            if wait_for is not None and not wait_for(task):
+                return task
+            semaphore = throttles.get(task.script, shared)
+            if semaphore is not None:
+                semaphore.acquire()
+            cores = slots.get()
+            try:
+                self.run_task(task, cores)
+            finally:
+                slots.put(cores)
+                if semaphore is not None:
+                    semaphore.release()
+            if on_finish is not None:
+                on_finish(task)
+            return task
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(execute, tasks))
+
+    def task_environment(self, task: LocalTask) -> Dict[str, str]:
+        return {
+            **os.environ,
+            **self.env,
+            'SLURM_JOB_ID': task.job_id,
+            'SLURM_ARRAY_JOB_ID': task.job_id,
+            'SLURM_ARRAY_TASK_ID': str(task.task_id),
+            'SLURM_ARRAY_TASK_COUNT': str(task.task_count),
+            'SLURM_JOB_NAME': task.job_name,
+            'SLURM_CPUS_PER_TASK': str(task.cpus),
+            'SLURM_SUBMIT_DIR': str(task.script.parent),
+            # Scripts leave recording their usage to `record_usage`
+            'PIPELINE_USAGE_BY_EXECUTOR': '1',
+        }
+
+    def run_task(self, task: LocalTask, cores=None) -> LocalTask:
+        task.stdout.parent.mkdir(parents=True, exist_ok=True)
+        task.stderr.parent.mkdir(parents=True, exist_ok=True)
+
+        start_time = time.time()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            mode = 'a' if task.append else 'w'
+            stdout = stack.enter_context(open(task.stdout, mode))
+            stderr = stdout if task.stderr == task.stdout else stack.enter_context(open(task.stderr, mode))
+            # Limits are applied to the running child, `preexec_fn` is unsafe with threads
+            process = stack.enter_context(subprocess.Popen(
+                [self.shell, str(task.script)],
+                cwd=task.script.parent,
+                env=self.task_environment(task),
+                stdout=stdout,
+                stderr=stderr,
+            ))
+            if self.enforce_limits and cores and hasattr(os, 'sched_setaffinity'):
+                try:
+                    os.sched_setaffinity(process.pid, cores)
+                except ProcessLookupError:
+                    pass
+
+            watcher = None
+            if self.enforce_limits and task.memory is not None and os.path.isdir('/proc'):
+                watcher = _MemoryWatcher(process.pid, task.memory, self.memory_poll)
+                watcher.start()
+
+            # The child stays unreaped until the watcher stopped, so it never signals a reused pid
+            os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+            if watcher is not None:
+                task.out_of_memory = watcher.stop()
+
+            # Resource usage of the whole process tree the script waited for
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        task.returncode = process.returncode
+        task.elapsed = time.perf_counter() - start
+        task.max_rss = usage.ru_maxrss * 1024
+        task.cpu_seconds = usage.ru_utime + usage.ru_stime
+        self.record_usage(task, start_time)
+        return task
+
+    def record_usage(self, task: LocalTask, start: float):
+        """
+        Appends the usage of `task` to the usage log named in its script, as tasks on a cluster do.
+        """
+        text = task.script.read_text()
+        log, name = _USAGE_LOG.search(text), _USAGE_NAME.search(text)
+        if log is None or name is None:
+            return
+        append_usage(shlex.split(log.group(1))[0], TaskUsage(
+            shlex.split(name.group(1))[0], task.task_id + array_offset(task.script), task.returncode,
+            start, start + task.elapsed, task.max_rss, task.cpu_seconds,
+        ))
+
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _process_tree(pid: int) -> Dict[int, int]:
+    """
+    Resident memory in bytes of `pid` and all its descendants, read from /proc.
+    """
+    children, rss = {}, {}
+    for entry in os.scandir('/proc'):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry.name}/stat', 'rb') as file:
+                stat = file.read()
+        except OSError:
+            continue
+        # Fields after the command name, which may contain spaces: state, ppid, ..., rss is the 22nd
+        fields = stat[stat.rindex(b')') + 2:].split()
+        child = int(entry.name)
+        children.setdefault(int(fields[1]), []).append(child)
+        rss[child] = int(fields[21]) * _PAGE_SIZE
+
+    tree, pending = {}, [pid]
+    while pending:
+        current = pending.pop()
+        if current in rss and current not in tree:
+            tree[current] = rss[current]
+            pending.extend(children.get(current, []))
+    return tree
+
+
+class _MemoryWatcher(threading.Thread):
+    """
+    Kills the process tree of `pid` once its resident memory exceeds `limit` bytes.
+    """
+
+    def __init__(self, pid: int, limit: int, poll: float):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.limit = limit
+        self.poll = poll
+        self.killed = False
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.poll):
+            tree = _process_tree(self.pid)
+            if sum(tree.values()) > self.limit:
+                self.killed = True
+                for pid in tree:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                return
+
+    def stop(self) -> bool:
+        self._stopped.set()
+        self.join()
+        return self.killed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m slurm.local', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('targets', nargs='+', help='Build directories or sbatch scripts')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--no-limits', action='store_true', help='Do not enforce mem and cpus_per_task')
+    options = parser.parse_args(argv)
+
+    tasks = LocalExecutor(workers=options.workers, enforce_limits=not options.no_limits).run(options.targets)
+    failed = [task for task in tasks if task.returncode]
+    for task in failed:
+        reason = 'ran out of memory' if task.out_of_memory else f'failed with exit code {task.returncode}'
+        print(f'{task.job_name}[{task.task_id}] {reason}, see {task.stderr}', file=sys.stderr)
+    print(f'{len(tasks) - len(failed)} of {len(tasks)} tasks succeeded')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+Local stand-in for `sbatch` running jobs with `LocalExecutor`.
+
+Every submission returns a job ID at once and runs the job in a background
+process that waits for its `--dependency` conditions, so the submit script of
+a build drives the local executor and independent commands overlap::
+
+    SBATCH="python -m slurm.local_sbatch" bash /path/to/build/submit.sh
+    python -m slurm.local_sbatch --wait
+
+Supported dependency types are `afterok`, `afterany`, `afternotok`,
+`aftercorr` and `after`, which is treated as `afterany`.
+"""
+from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from pipeline.manifest import FileLock
+
+from .local import LocalExecutor, LocalTask
+from .scripts import parse_sbatch_options, parse_array
+from .status import append_status, read_status
+
+
+STATE_ENVIRONMENT_VARIABLE = 'PIPELINE_LOCAL_SBATCH'
+
+PENDING = 'PENDING'
+RUNNING = 'RUNNING'
+COMPLETED = 'COMPLETED'
+FAILED = 'FAILED'
+CANCELLED = 'CANCELLED'
+
+FINAL_STATES = (COMPLETED, FAILED, CANCELLED)
+
+
+def parse_dependency_option(value: str) -> List[Tuple[str, str]]:
+    """
+    Parses `afterok:12:13,aftercorr:14` into `[('afterok', '12'), ('afterok', '13'), ('aftercorr', '14')]`.
+    """
+    if '?' in value:
+        raise ValueError(f'Alternative dependencies are not supported: {value!r}')
+
+    conditions = []
+    for condition in filter(None, value.split(',')):
+        kind, *jobs = condition.split(':')
+        if kind not in ('after', 'afterany', 'afterok', 'afternotok', 'aftercorr'):
+            raise ValueError(f'Unsupported dependency type {kind!r}')
+        # Time offsets of `after:job+minutes` are ignored
+        conditions.extend((kind, job.split('+')[0]) for job in jobs if job)
+    return conditions
+
+
+class LocalScheduler:
+    """
+    Jobs kept in `path/jobs/<id>/`: `job.json`, the `status.log` of its tasks and its `state`.
+    """
+
+    def __init__(self, path=None, poll_interval: float = 0.1):
+        if path is None:
+            path = os.environ.get(STATE_ENVIRONMENT_VARIABLE) or Path(tempfile.gettempdir()) / f'pipeline-local-sbatch-{os.getuid()}'
+        self.path = Path(path)
+        self.poll_interval = poll_interval
+        (self.path / 'jobs').mkdir(parents=True, exist_ok=True)
+
+    def job_path(self, job_id) -> Path:
+        return self.path / 'jobs' / str(job_id)
+
+    def _next_id(self) -> str:
+        counter = self.path / 'next_id'
+        with FileLock(self.path / 'lock'):
+            job_id = int(counter.read_text()) if counter.exists() else 1
+            counter.write_text(str(job_id + 1))
+        return str(job_id)
+
+    def submit(self, script, dependencies: List[Tuple[str, str]] = (), workers: Optional[int] = None) -> str:
+        """
+        Registers a job and starts it in a background process, returns its ID.
+        """
+        for _, dependency in dependencies:
+            if not self.job_path(dependency).exists():
+                raise ValueError(f'Unknown job {dependency}')
+
+        job_id = self._next_id()
+        job_path = self.job_path(job_id)
+        job_path.mkdir()
+        (job_path / 'job.json').write_text(json.dumps({
+            'script': str(Path(script).resolve()),
+            'dependencies': list(map(list, dependencies)),
+            'workers': workers,
+            'submitted': time.time(),
+        }))
+        self._set_state(job_id, PENDING)
+
+        with open(job_path / 'scheduler.log', 'w') as log:
+            subprocess.Popen(
+                [sys.executable, '-m', 'slurm.local_sbatch', '--state', str(self.path), '--run-job', job_id],
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=log,
+                start_new_session=True,
+            )
+        return job_id
+
+    def _set_state(self, job_id, state: str):
+        temporary = self.job_path(job_id) / f'.state.{os.getpid()}'
+        temporary.write_text(state)
+        os.replace(temporary, self.job_path(job_id) / 'state')
+
+    def state(self, job_id) -> str:
+        try:
+            return (self.job_path(job_id) / 'state').read_text()
+        except OSError:
+            return PENDING
+
+    def statuses(self, job_id):
+        return read_status(self.job_path(job_id) / 'status.log')
+
+    def _condition(self, kind: str, job_id: str, task_id: int) -> Optional[bool]:
+        """
+        True once the condition is met, False if it never will be and None while undecided.
+        """
+        state = self.state(job_id)
+
+        if kind == 'aftercorr':
+            status = self.statuses(job_id).get(task_id)
+            if status is not None:
+                return status.returncode == 0
+            if state not in FINAL_STATES:
+                return None
+            # The job has no corresponding task unless it was cancelled
+            return state != CANCELLED
+
+        if state not in FINAL_STATES:
+            return None
+        if kind == 'afterok':
+            return state == COMPLETED
+        if kind == 'afternotok':
+            return state != COMPLETED
+        return True
+
+    def wait_dependencies(self, dependencies: List[Tuple[str, str]], task_id: int) -> bool:
+        pending = list(dependencies)
+        while pending:
+            undecided = []
+            for kind, job_id in pending:
+                satisfied = self._condition(kind, job_id, task_id)
+                if satisfied is False:
+                    return False
+                if satisfied is None:
+                    undecided.append((kind, job_id))
+            pending = undecided
+            if pending:
+                time.sleep(self.poll_interval)
+        return True
+
+    def run_job(self, job_id) -> str:
+        job = json.loads((self.job_path(job_id) / 'job.json').read_text())
+        dependencies = [tuple(dependency) for dependency in job['dependencies']]
+        status_path = self.job_path(job_id) / 'status.log'
+
+        executor = LocalExecutor(workers=job['workers'])
+        script = Path(job['script'])
+        tasks = executor.tasks(script, job_id=job_id)
+        _, throttle = parse_array(parse_sbatch_options(script).get('array', '0'))
+
+        cancelled = []
+
+        def wait_for(task: LocalTask) -> bool:
+            if not self.wait_dependencies(dependencies, task.task_id):
+                cancelled.append(task.task_id)
+                return False
+            if self.state(job_id) == PENDING:
+                self._set_state(job_id, RUNNING)
+            return True
+
+        def record(task: LocalTask):
+            end = time.time()
+            append_status(status_path, task.task_id, task.returncode, end - task.elapsed, end)
+
+        tasks = executor.run_tasks(tasks, throttle=throttle, wait_for=wait_for, on_finish=record)
+
+        if cancelled:
+            state = CANCELLED
+        elif all(task.returncode == 0 for task in tasks):
+            state = COMPLETED
+        else:
+            state = FAILED
+        self._set_state(job_id, state)
+        return state
+
+    def jobs(self) -> List[str]:
+        return sorted((path.name for path in (self.path / 'jobs').iterdir()), key=int)
+
+    def wait(self, job_ids: Optional[List[str]] = None, timeout: Optional[float] = None) -> Dict[str, str]:
+        """
+        Blocks until jobs `job_ids` (all known jobs by default) reach a final state, returns their states.
+        """
+        job_ids = [str(job_id) for job_id in (job_ids or self.jobs())]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            states = {job_id: self.state(job_id) for job_id in job_ids}
+            if all(state in FINAL_STATES for state in states.values()):
+                return states
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f'Jobs still running: {", ".join(j for j, s in states.items() if s not in FINAL_STATES)}')
+            time.sleep(self.poll_interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m slurm.local_sbatch', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('script', nargs='?', help='sbatch script to submit')
+    parser.add_argument('--state', default=None, help=f'State directory, defaults to ${STATE_ENVIRONMENT_VARIABLE} or a temporary directory')
+    parser.add_argument('-d', '--dependency', default='')
+    parser.add_argument('--parsable', action='store_true')
+    parser.add_argument('--workers', type=int, default=None, help='Tasks of the job running at once')
+    parser.add_argument('--wait', nargs='*', default=None, metavar='JOB', help='Wait for jobs, all jobs if none are given')
+    parser.add_argument('--run-job', default=None, help=argparse.SUPPRESS)
+    options, unknown = parser.parse_known_args(argv)
+
+    scheduler = LocalScheduler(options.state)
+
+    if options.run_job is not None:
+        scheduler.run_job(options.run_job)
+        return 0
+
+    if options.wait is not None:
+        states = scheduler.wait(options.wait)
+        for job_id, state in states.items():
+            print(f'{job_id} {state}')
+        return 0 if all(state == COMPLETED for state in states.values()) else 1
+
+    if options.script is None:
+        parser.error('the script to submit is required')
+    if unknown:
+        print(f'Ignoring sbatch options {" ".join(unknown)}', file=sys.stderr)
+
+    job_id = scheduler.submit(options.script, parse_dependency_option(options.dependency), options.workers)
+    print(job_id if options.parsable else f'Submitted batch job {job_id}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+Sharded append-only logs of array tasks.
+
+Instead of two files per array task, the output of task N is appended to
+shard ``N % shards`` of the log directory as records::
+
+    PLOG <job> <task> <stream> <compression> <timestamp> <length>\\n<payload>
+
+A record is written with a single `O_APPEND` write while holding a lock on
+the shard, and indexed by one line ``<job> <task> <stream> <compression>
+<timestamp> <offset> <length>`` in ``<shard>.idx``. Fetching one task reads
+only the index of its shard and its own records. If an index is lost or
+torn, `rebuild_index` recovers it from the record headers.
+
+Usage from a shell script::
+
+    python -m slurm.logsink append /path/to/logs/name --task 42 --job 123 --stdout out.txt --stderr err.txt
+    python -m slurm.logsink cat /path/to/logs/name 42 --stream stderr
+"""
+from typing import Dict, Iterator, List, NamedTuple, Optional, Union
+from pathlib import Path
+import argparse
+import fcntl
+import json
+import os
+import sys
+import time
+import zlib
+
+
+MAGIC = b'PLOG'
+
+STREAMS = ('stdout', 'stderr')
+
+COMPRESSIONS = (None, 'zlib')
+
+META_FILENAME = 'meta.json'
+
+# Largest payload of a record, longer outputs are split into several records
+RECORD_SIZE = 4 << 20
+
+
+class LogRecord(NamedTuple):
+    job: str
+
+    task: int
+
+    stream: str
+
+    compression: Optional[str]
+
+    timestamp: float
+
+    # Offset of the payload in the shard
+    offset: int
+
+    length: int
+
+    shard: int
+
+
+def _header(job: str, task: int, stream: str, compression: Optional[str], timestamp: float, length: int) -> bytes:
+    return f'{MAGIC.decode()} {job} {task} {stream} {compression or "-"} {timestamp:.3f} {length}\n'.encode()
+
+
+def _parse_fields(fields, shard: int, offset: Optional[int] = None) -> LogRecord:
+    # Index lines carry the offset, record headers are followed by the payload
+    job, task, stream, compression, timestamp = fields[:5]
+    if offset is None:
+        offset = int(fields[5])
+    return LogRecord(
+        job.decode(), int(task), stream.decode(), None if compression == b'-' else compression.decode(),
+        float(timestamp), offset, int(fields[-1]), shard,
+    )
+
+
+class LogSink:
+    """
+    Appends task outputs to `shards` shared files in the directory `path`.
+    """
+
+    def __init__(self, path, shards: int = 16, compression: Optional[str] = None, record_size: int = RECORD_SIZE):
+        if shards < 1:
+            raise ValueError(f'`shards` must be positive, got {shards}')
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'Unknown compression {compression!r}, expected one of {COMPRESSIONS}')
+
+        self.path = Path(path)
+        self.shards = shards
+        self.compression = compression
+        self.record_size = record_size
+
+    def shard(self, task: int) -> int:
+        return task % self.shards
+
+    def shard_filename(self, shard: int) -> Path:
+        return self.path / f'{shard:04d}.log'
+
+    def index_filename(self, shard: int) -> Path:
+        return self.path / f'{shard:04d}.idx'
+
+    def write_meta(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        temporary = self.path / f'.{META_FILENAME}.{os.getpid()}.tmp'
+        temporary.write_text(json.dumps({'shards': self.shards, 'compression': self.compression}))
+        os.replace(temporary, self.path / META_FILENAME)
+
+    def append(self, task: int, outputs: Dict[str, Union[bytes, str, os.PathLike]], job='0', timestamp: Optional[float] = None) -> int:
+        """
+        Appends `outputs` of one task, stream name to bytes or the name of a file holding them,
+        and returns the number of records written.
+
+        Records of one call are contiguous in the shard. Empty outputs are skipped.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        shard = self.shard(task)
+        # Readers find the number of shards in the metadata
+        if not (self.path / META_FILENAME).exists():
+            self.write_meta()
+
+        descriptor = os.open(self.shard_filename(shard), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX)
+            position = os.lseek(descriptor, 0, os.SEEK_END)
+            index = []
+            for stream, output in outputs.items():
+                if stream not in STREAMS:
+                    raise ValueError(f'Unknown stream {stream!r}, expected one of {STREAMS}')
+                for payload in self._chunks(output):
+                    if self.compression == 'zlib':
+                        payload = zlib.compress(payload)
+                    header = _header(job, task, stream, self.compression, timestamp, len(payload))
+                    _write_all(descriptor, header + payload)
+                    position += len(header)
+                    index.append(f'{job} {task} {stream} {self.compression or "-"} {timestamp:.3f} {position} {len(payload)}\n')
+                    position += len(payload)
+
+            if index:
+                index_descriptor = os.open(self.index_filename(shard), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    _write_all(index_descriptor, ''.join(index).encode())
+                finally:
+                    os.close(index_descriptor)
+            return len(index)
+        finally:
+            os.close(descriptor)
+
+    def _chunks(self, output) -> Iterator[bytes]:
+        if isinstance(output, bytes):
+            for start in range(0, len(output), self.record_size):
+                yield output[start:start + self.record_size]
+            return
+
+        if not os.path.exists(output):
+            return
+        with open(output, 'rb') as file:
+            while payload := file.read(self.record_size):
+                yield payload
+
+
+def _write_all(descriptor: int, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(descriptor, view):]
+
+
+def open_sink(path) -> LogSink:
+    """
+    Sink of an existing log directory with the layout recorded in its metadata.
+    """
+    meta_filename = Path(path) / META_FILENAME
+    if not meta_filename.exists():
+        raise FileNotFoundError(f'{path} is not a log sink, {META_FILENAME} is missing')
+    meta = json.loads(meta_filename.read_text())
+    return LogSink(path, meta['shards'], meta.get('compression'))
+
+
+def scan_shard(filename, shard: int = 0) -> Iterator[LogRecord]:
+    """
+    Records of a shard read from their headers, skipping bytes torn by killed writers.
+    """
+    with open(filename, 'rb') as file:
+        data = file.read()
+
+    position = 0
+    while (position := data.find(MAGIC + b' ', position)) >= 0:
+        end = data.find(b'\n', position)
+        fields = data[position:end].split()[1:] if end >= 0 else []
+        try:
+            if len(fields) != 6:
+                raise ValueError
+            record = _parse_fields(fields, shard, end + 1)
+        except ValueError:
+            position += len(MAGIC)
+            continue
+        # A payload cut short is followed by a record of a later writer instead
+        stop = record.offset + record.length
+        if stop != len(data) and not data.startswith(MAGIC + b' ', stop):
+            position += len(MAGIC)
+            continue
+        yield record
+        position = stop
+
+
+def rebuild_index(path) -> int:
+    """
+    Rewrites the indices of all shards from the record headers and returns the number of records.
+    """
+    sink = open_sink(path)
+    count = 0
+    for shard in range(sink.shards):
+        filename = sink.shard_filename(shard)
+        if not filename.exists():
+            continue
+        lines = [
+            f'{r.job} {r.task} {r.stream} {r.compression or "-"} {r.timestamp:.3f} {r.offset} {r.length}\n'
+            for r in scan_shard(filename, shard)
+        ]
+        temporary = sink.index_filename(shard).with_suffix('.idx.tmp')
+        temporary.write_text(''.join(lines))
+        os.replace(temporary, sink.index_filename(shard))
+        count += len(lines)
+    return count
+
+
+def task_records(path, task: int) -> List[LogRecord]:
+    """
+    All records of `task` in the order they were written.
+    """
+    sink = open_sink(path)
+    shard = sink.shard(task)
+    filename = sink.index_filename(shard)
+    if not filename.exists():
+        return []
+
+    key = str(task).encode()
+    records = []
+    with open(filename, 'rb') as file:
+        for line in file:
+            fields = line.split()
+            # Skip lines torn by a killed task
+            if len(fields) != 7 or fields[1] != key:
+                continue
+            try:
+                records.append(_parse_fields(fields, shard))
+            except ValueError:
+                continue
+    return records
+
+
+def read_task(path, task: int, stream: str = 'stdout', attempt: Optional[int] = -1) -> bytes:
+    """
+    Output of `stream` of `task`.
+
+    Records are grouped into attempts by job id in the order the jobs first wrote,
+    `attempt=-1` is the latest run of the task and `None` concatenates all attempts.
+    """
+    records = task_records(path, task)
+    jobs = list(dict.fromkeys(record.job for record in records))
+    if attempt is not None:
+        if not jobs:
+            return b''
+        records = [record for record in records if record.job == jobs[attempt]]
+
+    sink = open_sink(path)
+    chunks = []
+    with open(sink.shard_filename(sink.shard(task)), 'rb') as file:
+        for record in records:
+            if record.stream != stream:
+                continue
+            file.seek(record.offset)
+            payload = file.read(record.length)
+            if record.compression == 'zlib':
+                payload = zlib.decompress(payload)
+            chunks.append(payload)
+    return b''.join(chunks)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m slurm.logsink',
+        description='Append task outputs to a sharded log or print the output of a task.',
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    append = commands.add_parser('append')
+    append.add_argument('path')
+    append.add_argument('--task', type=int, required=True)
+    append.add_argument('--job', default=os.environ.get('SLURM_ARRAY_JOB_ID', os.environ.get('SLURM_JOB_ID', '0')))
+    append.add_argument('--shards', type=int, default=16)
+    append.add_argument('--compression', choices=[c for c in COMPRESSIONS if c])
+    for stream in STREAMS:
+        append.add_argument(f'--{stream}', help=f'File holding {stream} of the task')
+
+    cat = commands.add_parser('cat')
+    cat.add_argument('path')
+    cat.add_argument('task', type=int)
+    cat.add_argument('--stream', choices=[*STREAMS, 'both'], default='both')
+    cat.add_argument('--attempt', default='-1', help='Index of the run of the task, -1 for the latest or `all`')
+
+    reindex = commands.add_parser('reindex')
+    reindex.add_argument('path')
+
+    options = parser.parse_args(argv)
+
+    if options.command == 'append':
+        sink = LogSink(options.path, options.shards, options.compression)
+        outputs = {stream: getattr(options, stream) for stream in STREAMS if getattr(options, stream)}
+        sink.append(options.task, outputs, job=options.job)
+    elif options.command == 'cat':
+        attempt = None if options.attempt == 'all' else int(options.attempt)
+        for stream in (STREAMS if options.stream == 'both' else [options.stream]):
+            sys.stdout.buffer.write(read_task(options.path, options.task, stream, attempt))
+        sys.stdout.flush()
+    else:
+        print(f'{rebuild_index(options.path)} records indexed')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
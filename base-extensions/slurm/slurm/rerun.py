@@ -0,0 +1,190 @@
+"""
+Resubmission of failed or missing array tasks.
+
+Generated sbatch scripts append the exit code of every task to a status log
+(see `slurm.status`). The status log, array range and chunk offset of every
+script are recorded in the `submit.json` of the build when the script is
+generated, see `SlurmCommandConfigurator.script_record`. A rerun script is a copy of the original script whose
+`--array` only lists the tasks without a successful record. For worker pools
+the tasks are requeued in the queue instead and the rerun script starts as
+many workers as there are tasks, up to the original number::
+
+    python -m slurm.rerun /path/to/build
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+from pathlib import Path
+import argparse
+import json
+import os
+import re
+import sys
+
+from .scripts import format_array, parse_array
+from .status import read_status
+from .worker import TaskQueue
+
+
+_ARRAY = re.compile(r'^#SBATCH\s+--array[=\s].*$', re.MULTILINE)
+
+RERUN_DIRECTORY = 'rerun'
+
+# Written next to the submit script by `SlurmArguments.write_submit_script`
+RECORDS_FILENAME = 'submit.json'
+
+
+def read_records(filename) -> Dict[Path, dict]:
+    """
+    Records of the sbatch scripts listed in a `submit.json`, by absolute filename.
+    """
+    records = json.loads(Path(filename).read_text()).get('records', {})
+    return {Path(os.path.abspath(script)): record for script, record in records.items()}
+
+
+def script_record(script, records=None) -> Optional[dict]:
+    """
+    Record of `script` or of the script its `rerun/` copy was made from, None if it has none.
+
+    `records` is the `submit.json` of the build, by default the one next to the script.
+    """
+    script = Path(os.path.abspath(script))
+    if script.parent.name == RERUN_DIRECTORY:
+        script = script.parent.parent / script.name
+    try:
+        return read_records(records or script.parent / RECORDS_FILENAME).get(script)
+    except (OSError, ValueError):
+        return None
+
+
+def script_status_log(script, records=None) -> Optional[Path]:
+    record = script_record(script, records)
+    return None if record is None else Path(record['status_log'])
+
+
+def script_queue(script, records=None) -> Optional[Path]:
+    record = script_record(script, records)
+    return None if record is None or record['queue'] is None else Path(record['queue'])
+
+
+def array_offset(script, records=None) -> int:
+    """
+    Number added to SLURM_ARRAY_TASK_ID by a script running one chunk of a split array.
+    """
+    record = script_record(script, records)
+    return 0 if record is None else record['offset']
+
+
+def failed_tasks(script, include_missing: bool = True, statuses: Optional[Dict] = None, record: Optional[dict] = None) -> List[int]:
+    """
+    Array indices of `script` whose last recorded exit code is not zero, or that have no record.
+    """
+    record = record or script_record(script)
+    if record is None:
+        raise ValueError(f'{script} does not record task statuses')
+
+    if statuses is None:
+        statuses = read_status(record['status_log'])
+
+    offset = record['offset']
+    indices, _ = parse_array(record['array'] or '')
+
+    failed = []
+    for index in indices:
+        status = statuses.get(index + offset)
+        if status is None and include_missing or status is not None and status.returncode != 0:
+            failed.append(index)
+    return failed
+
+
+def write_rerun_script(script, indices: Iterable[int], filename=None, throttle: Optional[int] = None) -> Path:
+    """
+    Copies `script` with `--array` restricted to `indices` and limited to `throttle` running tasks.
+
+    The copy goes to `rerun/` next to the script, a `rerun/` copy is replaced.
+    """
+    script = Path(script)
+    if filename is None:
+        directory = script.parent if script.parent.name == RERUN_DIRECTORY else script.parent / RERUN_DIRECTORY
+        filename = directory / script.name
+    filename = Path(filename)
+    filename.parent.mkdir(parents=True, exist_ok=True)
+
+    array = f'#SBATCH --array={format_array(indices, throttle)}'
+
+    text = script.read_text()
+    if _ARRAY.search(text):
+        text = _ARRAY.sub(lambda _: array, text, count=1)
+    else:
+        first, rest = text.split('\n', 1)
+        text = f'{first}\n{array}\n{rest}'
+
+    filename.write_text(text)
+    return filename
+
+
+def requeue_failed(script, include_missing: bool = True, record: Optional[dict] = None) -> Optional[Path]:
+    """
+    Requeues failed or missing tasks of the worker pool started by `script` and
+    writes its rerun script, None if there is nothing to rerun.
+    """
+    record = record or script_record(script)
+    queue = TaskQueue(record['queue'])
+    tasks = queue.requeue_failed(include_missing)
+    if not tasks:
+        return None
+    workers, throttle = parse_array(record['array'] or '1')
+    return write_rerun_script(script, range(1, min(len(workers), len(tasks)) + 1), throttle=throttle)
+
+
+def rerun_failed(scripts: Iterable, include_missing: bool = True, status_log=None, queue=None, records=None) -> List[Path]:
+    """
+    Writes rerun scripts for every script with failed tasks, returns their filenames.
+
+    `scripts` may contain sbatch scripts and build directories, whose scripts are
+    taken from `records`, by default their `submit.json`. With `status_log` or
+    `queue` only the scripts recording into that log or pulling from that queue
+    are considered.
+    """
+    paths: List[Tuple[Path, dict]] = []
+    for item in scripts:
+        if not Path(item).is_dir():
+            if (record := script_record(item, records)) is not None:
+                paths.append((Path(item), record))
+            continue
+        try:
+            paths.extend(read_records(records or Path(item) / RECORDS_FILENAME).items())
+        except OSError:
+            continue
+
+    statuses = {}
+    written = []
+    for script, record in paths:
+        if record['queue'] is not None:
+            if status_log is None and (queue is None or Path(record['queue']) == Path(queue)):
+                if rerun := requeue_failed(script, include_missing, record):
+                    written.append(rerun)
+            continue
+
+        log = Path(record['status_log'])
+        if queue is not None or status_log is not None and log != Path(status_log):
+            continue
+        if log not in statuses:
+            statuses[log] = read_status(log)
+
+        if failed := failed_tasks(script, include_missing, statuses[log], record):
+            written.append(write_rerun_script(script, failed, throttle=parse_array(record['array'] or '')[1]))
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m slurm.rerun', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('targets', nargs='+', help='Build directories or sbatch scripts')
+    parser.add_argument('--failed-only', action='store_true', help='Do not rerun tasks without a status record')
+    options = parser.parse_args(argv)
+
+    for filename in rerun_failed(options.targets, include_missing=not options.failed_only):
+        print(filename)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
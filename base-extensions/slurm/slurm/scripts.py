@@ -0,0 +1,106 @@
+"""
+Helpers for reading generated sbatch scripts back.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+from pathlib import Path
+import re
+
+
+_SBATCH_OPTION = re.compile(r'^#SBATCH\s+--([\w-]+)(?:[=\s]\s*(.*?))?\s*$')
+
+_MEMORY = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)b?\s*$', re.IGNORECASE)
+
+_MEMORY_UNITS = {'k': 1 << 10, '': 1 << 20, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40}
+
+
+def parse_sbatch_options(filename) -> Dict[str, str]:
+    """
+    Reads `#SBATCH --key=value` lines of a script, keys use underscores as `SlurmSBatchHeader` fields.
+    """
+    options = {}
+    with open(filename) as file:
+        for line in file:
+            if not line.startswith('#'):
+                if line.strip():
+                    break
+                continue
+            if match := _SBATCH_OPTION.match(line):
+                options[match.group(1).replace('-', '_')] = match.group(2) or ''
+    return options
+
+
+def is_sbatch_script(filename) -> bool:
+    with open(filename, errors='replace') as file:
+        for line in file:
+            if line.startswith('#SBATCH'):
+                return True
+            if line.strip() and not line.startswith('#'):
+                return False
+    return False
+
+
+def find_sbatch_scripts(build_path) -> List[Path]:
+    return sorted(path for path in Path(build_path).glob('*.sh') if is_sbatch_script(path))
+
+
+def parse_array(spec: str) -> Tuple[List[int], Optional[int]]:
+    """
+    Parses an `--array` value such as `1-10:2,15%4` into indices and the throttle.
+    """
+    throttle = None
+    if '%' in spec:
+        spec, throttle = spec.split('%', 1)
+        throttle = int(throttle)
+
+    indices = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        step = 1
+        if ':' in part:
+            part, step = part.split(':', 1)
+            step = int(step)
+        if '-' in part:
+            first, last = part.split('-', 1)
+            indices.extend(range(int(first), int(last) + 1, step))
+        else:
+            indices.append(int(part))
+
+    return indices, throttle
+
+
+def format_array(indices: Iterable[int], throttle: Optional[int] = None) -> str:
+    """
+    Compresses indices into an `--array` value, e.g. `[3, 17, 18, 19, 40]` into `3,17-19,40`.
+    """
+    ranges = []
+    for index in sorted(set(indices)):
+        if ranges and ranges[-1][1] + 1 == index:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+
+    spec = ','.join(str(first) if first == last else f'{first}-{last}' for first, last in ranges)
+    if throttle:
+        spec = f'{spec}%{throttle}'
+    return spec
+
+
+def parse_memory(value: str) -> int:
+    """
+    Converts a SLURM memory specification (`500`, `4G`, `1gb`) to bytes, megabytes by default.
+    """
+    match = _MEMORY.match(str(value))
+    if match is None:
+        raise ValueError(f'Invalid memory specification: {value!r}')
+    number, unit = match.groups()
+    return int(float(number) * _MEMORY_UNITS[unit.lower()])
+
+
+def expand_filename_pattern(pattern: str, job_id, task_id, job_name: str = '') -> str:
+    """
+    Replaces the sbatch filename patterns `%A`, `%a`, `%j`, `%x` and `%%`.
+    """
+    replacements = {'A': str(job_id), 'a': str(task_id), 'j': str(job_id), 'x': job_name, '%': '%'}
+    return re.sub(r'%([Aajx%])', lambda match: replacements[match.group(1)], pattern)
@@ -1,7 +1,12 @@
-from typing import Optional, Union, Dict, List
+from typing import Optional, Dict, List
 from pathlib import Path
+import json
+import shlex
+import sys
 
 import pipeline
+from pipeline import merge_defaults, events
+from pipeline.manifest import BuildManifest
 
 ShellArguments = pipeline.get_class('shell_templates.Arguments')
 ShellCommand = pipeline.get_class('shell_templates.Command')
@@ -11,35 +16,9 @@ from dataclasses import dataclass, field, fields, asdict
 from string import Template
 from copy import deepcopy
 
-
-def deep_set_default(d: dict, default_values: dict):
-    """
-    Recursively sets default values for missing or None keys in a nested dictionary.
-    
-    :param d: The target dictionary to update.
-    :param default_values: The default values dictionary to use.
-    """
-    for key, default in default_values.items():
-        # If key is missing or is None, set it to the default value
-        if key not in d or d[key] is None:
-            d[key] = default
-        # If both are dictionaries, recurse into the nested dictionary
-        elif isinstance(d[key], dict) and isinstance(default, dict):
-            deep_set_default(d[key], default)
-
-
-def update_dataclass(one, another, dtype=None):
-    data = asdict(one)
-    deep_set_default(data, asdict(another))
-    
-    if dtype is None: dtype = type(one)
-    def dataclass_from_dict(dtype, data):
-        try:
-            fieldtypes = { f.name: f.type for f in fields(dtype)}
-            return dtype(**{f: dataclass_from_dict(fieldtypes[f], data[f]) for f in data})
-        except BaseException as ex:
-            return data # Not a dataclass field
-    return dataclass_from_dict(dtype, data)
+# Submission, tracking, reruns and queues are imported by the methods using them,
+# array tasks importing the plugin do not pay for them
+from .dependencies import parse_dependency, submit_script, topological_order
 
 
 @dataclass
@@ -59,6 +38,9 @@ class SlurmSBatchHeader:
 
     error_template: Optional[str] = None
 
+    # `append` lets the tasks of an array share output files
+    open_mode: Optional[str] = None
+
     array: Optional[str] = None
 
     array_template: Optional[str] = None
@@ -103,6 +85,9 @@ class SlurmDefaultTemplateBody:
 
     after_command: Optional[str] = None
 
+    # Interpreter used by helpers called from the generated script.
+    python: Optional[str] = None
+
 
 @dataclass
 class Slurm:
@@ -114,6 +99,63 @@ class Slurm:
 
     filename_template: Optional[str] = None
 
+    # If True, tasks read their line through a byte-offset index
+    # instead of scanning the whole command file.
+    index: Optional[bool] = None
+
+    # Number of consecutive commands run by a single array task.
+    pack: Optional[int] = None
+
+    # Number of commands of a pack running at the same time,
+    # defaults to `header.cpus_per_task`.
+    pack_concurrency: Optional[int] = None
+
+    # Largest array accepted by the cluster (MaxArraySize - 1). Bigger arrays
+    # are split into several sbatch scripts launched by one submit script.
+    max_array_size: Optional[int] = None
+
+    # Maximum number of simultaneously running tasks of an array (`--array=...%N`).
+    array_throttle: Optional[int] = None
+
+    submit_filename_template: Optional[str] = None
+
+    # If set, this many long-lived worker tasks pull commands from a
+    # queue in the build directory instead of one array task per pack.
+    workers: Optional[int] = None
+
+    # Number of tasks a worker slot claims from the queue at once
+    claim_size: Optional[int] = None
+
+    # Seconds after which the claimed tasks of a worker that stopped renewing them are claimed again
+    worker_lease: Optional[float] = None
+
+    queue_path_template: Optional[str] = None
+
+    # Append-only log of exit codes of array tasks, see `slurm.status`
+    status_filename_template: Optional[str] = None
+
+    # Commands of the same arguments this command runs after, `name` waits for
+    # the whole array to succeed, `aftercorr:name` task by task, see `slurm.dependencies`
+    dependencies: Optional[List[str]] = None
+
+    # If True, tasks append their stdout and stderr to `log_shards` shared files
+    # in `log_path_template` instead of two files per task, see `slurm.logsink`
+    log_sink: Optional[bool] = None
+
+    log_shards: Optional[int] = None
+
+    # None or 'zlib', applied to every record
+    log_compression: Optional[str] = None
+
+    log_path_template: Optional[str] = None
+
+    # If True, array tasks append wall time, peak memory and CPU time to the
+    # usage log of the build, see `slurm.usage` and `SlurmArguments.tune_resources`,
+    # off by default
+    record_usage: Optional[bool] = None
+
+    usage_filename_template: Optional[str] = None
+
 
 @dataclass
 class SlurmCommand(ShellCommand):
@@ -132,13 +174,16 @@ class SlurmArguments(ShellArguments):
 
     folders_to_create: List[str] = field(default_factory=lambda: ['logs'])
 
+    # Script submitting all generated commands in dependency order
+    submit_script_template: str = '{build_path}/submit.sh'
+
     def __post_init__(self):
         getattr(super(), '__post_init__')()
 
         for folder in self.folders_to_create:
             (self.build_path / folder).mkdir(parents=True, exist_ok=True)
 
-        self.default_slurm = update_dataclass(self.default_slurm, Slurm(
+        self.default_slurm = merge_defaults(self.default_slurm, Slurm(
         template =\
 """#!/bin/bash
 
@@ -146,17 +191,24 @@ ${header}
 
 ${before_command}
 
-# Take SLURM_ARRAY_TASK_ID line from .sh script
-command=$$(cat ${build_path}/$${SLURM_JOB_NAME}.sh | sed -n "$${SLURM_ARRAY_TASK_ID}p")
+run_command() {
+    local command="$$1"
 
-echo "Executing $${command}"
-echo "Started at $$(date)"
+    echo "Executing $${command}"
+    echo "Started at $$(date)"
 
-${exec} $${command}
+    ${exec} $${command}
+    local status=$$?
 
-echo "Finished at $$(date)"
+    echo "Finished at $$(date)"
+    return $${status}
+}
+
+${run_commands}
 
 ${after_command}
+
+exit $${task_status:-0}
 """,
         header = SlurmSBatchHeader(
             job_name_template = '{name}',
@@ -169,21 +221,243 @@ ${after_command}
             before_command = '',
             after_command = '',
             exec = 'eval',    
+            python = sys.executable,
         ),
         
         filename_template = '{build_path}/slurm_{name}.sh',  
+
+        index = False,
+
+        pack = 1,
+
+        submit_filename_template = '{build_path}/submit_{name}.sh',
+
+        claim_size = 1,
+
+        worker_lease = 300.0,
+
+        queue_path_template = '{build_path}/queue_{name}',
+
+        status_filename_template = '{build_path}/status_{name}.log',
+
+        log_sink = False,
+
+        log_shards = 16,
+
+        log_path_template = '{build_path}/logs/{name}',
+
+        record_usage = False,
+
+        usage_filename_template = '{build_path}/usage.log',
         ))
         
 
+        with self.tracing(), events.span('slurm.merge_defaults', count=0) as span:
+            for f in fields(self):
+                if (command := getattr(self, f.name)) and isinstance(command, SlurmCommand):
+                    setattr(command, 'slurm', merge_defaults(getattr(command, 'slurm'), self.default_slurm))
+                    span.count += 1
+
+        # Fail on unknown commands and cycles before anything is generated
+        topological_order(self.dependencies())
+
+    def slurm_commands(self) -> Dict[str, SlurmCommand]:
+        return {
+            f.name: getattr(self, f.name) for f in fields(self)
+            if isinstance(getattr(self, f.name), SlurmCommand)
+        }
+
+    def dependencies(self) -> Dict[str, list]:
+        return {
+            name: [parse_dependency(spec) for spec in command.slurm.dependencies or []]
+            for name, command in self.slurm_commands().items()
+        }
+
+    def sbatch_scripts(self) -> Dict[str, List[str]]:
+        """
+        sbatch scripts of every command, one per array chunk.
+        """
+        previous = None
+        scripts = {}
+        for name, command in self.slurm_commands().items():
+            filenames = getattr(command, '__sbatch_filenames', None)
+            if filenames is None:
+                # Not built in this run, the scripts of an earlier run are listed in its submit.json
+                if previous is None:
+                    previous = self.submitted_scripts()
+                filenames = [filename for filename in previous.get(name, []) if Path(filename).exists()]
+            scripts[name] = filenames
+        return scripts
+
+    def sbatch_records(self, scripts: Dict[str, List[str]]) -> Dict[str, dict]:
+        """
+        Records of `scripts` written by `SlurmCommandConfigurator.script_record`, by filename.
+        """
+        previous = None
+        records = {}
+        for name, filenames in scripts.items():
+            own = getattr(getattr(self, name), '__sbatch_records', None)
+            if own is None:
+                if previous is None:
+                    previous = self.submitted_records()
+                own = previous
+            records.update((filename, own[filename]) for filename in filenames if filename in own)
+        return records
+
+    @property
+    def submit_script_path(self) -> Path:
+        return Path(self.submit_script_template.format(build_path=self.build_path))
+
+    def submitted_scripts(self) -> Dict[str, List[str]]:
+        """
+        sbatch scripts per command as written by the last `write_submit_script`.
+        """
+        try:
+            return json.loads(self.submit_script_path.with_suffix('.json').read_text())['scripts']
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def submitted_records(self) -> Dict[str, dict]:
+        """
+        Records of the sbatch scripts by filename as written by the last `write_submit_script`.
+        """
+        try:
+            return json.loads(self.submit_script_path.with_suffix('.json').read_text())['records']
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def write_submit_script(self, filename=None) -> Path:
+        """
+        Writes the script submitting the sbatch scripts of all generated commands in dependency order.
+
+        The scripts, their records and dependencies are also written as JSON next
+        to it for `slurm.submit` and `slurm.rerun`.
+        """
+        scripts = self.sbatch_scripts()
+        records = self.sbatch_records(scripts)
+        dependencies = self.dependencies()
+        filename = Path(filename) if filename else self.submit_script_path
+        outputs = {
+            filename: submit_script(scripts, dependencies),
+            filename.with_suffix('.json'): json.dumps({'scripts': scripts, 'records': records, 'dependencies': dependencies}, indent=1),
+        }
+        for path, text in outputs.items():
+            if self.manifest is not None:
+                self.manifest.write_text(path, text)
+            else:
+                path.write_text(text)
+        return filename
+
+    def submit(self, submitter: Optional['Submitter'] = None, force: bool = False) -> Dict[str, List['SubmittedJob']]:
+        """
+        Submits the generated sbatch scripts in dependency order, see `slurm.submit`.
+
+        Job IDs are kept in the build manifest, scripts submitted before unchanged are not submitted again.
+        """
+        from .submit import Submitter
+
+        manifest = self.manifest or BuildManifest(self.build_path)
+        with self.tracing():
+            return (submitter or Submitter()).submit(self.sbatch_scripts(), self.dependencies(), manifest, force=force)
+
+    def after_build_all(self, results):
+        getattr(super(), 'after_build_all')(results)
+        # Commands built in other processes did not record their scripts here
+        for name, result in results.items():
+            setattr(getattr(self, name), '__sbatch_filenames', result.sbatch_filenames)
+            setattr(getattr(self, name), '__sbatch_records', result.sbatch_records)
+        self.write_submit_script()
+
+    def job_tracker(self, **kwargs) -> 'JobTracker':
+        """
+        Tracker of the jobs submitted with `submit`, see `slurm.tracker`.
+        """
+        from .tracker import JobTracker
+
+        return JobTracker(self.build_path, manifest=self.manifest, **kwargs)
+
+    def tune_resources(
+        self,
+        names: Optional[List[str]] = None,
+        usage_log=None,
+        apply: bool = False,
+        percentile: float = 95.0,
+        margin: float = 0.2,
+        min_samples: int = 1,
+    ) -> Dict[str, 'ResourceProposal']:
+        """
+        Proposes `mem`, `time` and `cpus_per_task` of commands `names` (all by default) from recorded usage.
+
+        The usage is read from `usage_log` or from the most recent other build in
+        `base_path` that recorded the command. With `apply` the proposals replace
+        the requests in `slurm.header` of the commands, call it before building.
+        `cpus_per_task` is left alone for packs running `cpus_per_task` commands at once.
+        """
+        from .usage import propose_resources, read_usage
+
+        proposals = {}
+        for name, command in self.slurm_commands().items():
+            if names is not None and name not in names:
+                continue
+
+            filenames = [Path(usage_log)] if usage_log is not None else self._previous_usage_logs(command)
+            for filename in filenames:
+                if tasks := read_usage(filename, name).get(name):
+                    break
+            else:
+                continue
+
+            proposal = propose_resources(tasks.values(), percentile, margin, min_samples=min_samples)
+            if proposal is None:
+                continue
+            proposals[name] = proposal
+
+            if apply:
+                header = command.slurm.header
+                if proposal.mem is not None:
+                    # --mem and --mem-per-cpu exclude each other
+                    header.mem, header.mem_per_cpu = proposal.mem, None
+                header.time = proposal.time
+                packs_by_cpus = (command.slurm.pack or 1) > 1 and command.slurm.pack_concurrency is None
+                if proposal.cpus_per_task is not None and not packs_by_cpus:
+                    header.cpus_per_task = proposal.cpus_per_task
+        return proposals
+
+    def _previous_usage_logs(self, command) -> List[Path]:
+        template = command.slurm.usage_filename_template or '{build_path}/usage.log'
+        current = self.build_path.resolve()
+        candidates = [
+            Path(template.format(build_path=path))
+            for path in self.base_path.iterdir()
+            if path.is_dir() and path.resolve() != current
+        ]
+        return sorted((path for path in candidates if path.exists()), key=lambda path: path.stat().st_mtime, reverse=True)
+
+    def rerun_failed(self, names: Optional[List[str]] = None, include_missing: bool = True) -> List[Path]:
+        """
+        Writes `rerun/` copies of the sbatch scripts of commands `names` (all by default)
+        restricted to tasks that failed or, with `include_missing`, never reported.
+        Worker pools get their tasks requeued and a script starting the workers again.
+        """
+        from .rerun import rerun_failed
+
+        records = self.submit_script_path.with_suffix('.json')
+        written = []
         for f in fields(self):
-            if (command := getattr(self, f.name)) and isinstance(command, SlurmCommand):
-                setattr(command, 'slurm', update_dataclass(getattr(command, 'slurm'), self.default_slurm))
+            command = getattr(self, f.name)
+            if not isinstance(command, SlurmCommand) or names is not None and f.name not in names:
+                continue
+            if command.slurm.workers:
+                queue = command.slurm.queue_path_template.format(name=f.name, build_path=self.build_path)
+                written.extend(rerun_failed([self.build_path], include_missing, queue=queue, records=records))
+                continue
+            status_log = command.slurm.status_filename_template.format(name=f.name, build_path=self.build_path)
+            written.extend(rerun_failed([self.build_path], include_missing, status_log, records=records))
+        return written
 
 
 @dataclass
 class SlurmCommandConfigurator(ShellCommandConfigurator):
-    __slurm_array_size: int = 0
-
     slurm_template: Optional[str] = None
 
     slurm_header: SlurmSBatchHeader = field(default_factory=SlurmSBatchHeader)
@@ -192,16 +466,103 @@ class SlurmCommandConfigurator(ShellCommandConfigurator):
     
     slurm_filename_template: Optional[str] = None 
 
+    # Number of commands per array task, defaults to `command.slurm.pack`
+    pack: Optional[int] = None
+
+    pack_concurrency: Optional[int] = None
+
+    # Number of queue workers, defaults to `command.slurm.workers`
+    workers: Optional[int] = None
+
+    # Defaults to `command.slurm.log_sink`
+    log_sink: Optional[bool] = None
+
+    # sbatch scripts written by `slurm_finalize`
+    sbatch_filenames: List[str] = field(default_factory=lambda: [], init=False)
+
+    # What reruns, trackers and local runs need to know about each of them, see `script_record`
+    sbatch_records: Dict[str, dict] = field(default_factory=lambda: {}, init=False)
+
     def __post_init__(self):
         getattr(super(), '__post_init__')()
         
         assert self.args
         assert self.name    
 
+        if hasattr(self.command, 'slurm'):
+            if self.write_index is None:
+                self.write_index = self.command.slurm.index
+            if self.pack is None:
+                self.pack = self.command.slurm.pack
+            if self.pack_concurrency is None:
+                self.pack_concurrency = self.command.slurm.pack_concurrency
+            if self.workers is None:
+                self.workers = self.command.slurm.workers
+            if self.log_sink is None:
+                self.log_sink = self.command.slurm.log_sink
+
+        # Workers read arbitrary lines of the command file
+        if self.workers:
+            self.write_index = True
+
+        if self.pack is None:
+            self.pack = 1
+
+        if self.pack < 1:
+            raise ValueError(f'`pack` must be positive, got {self.pack}')
+
     
-    def append_command(self, *args, **kwargs):
-        self.__slurm_array_size += 1
-        getattr(super(), 'append_command')(*args, **kwargs)
+    def _count_command(self, count=1):
+        getattr(super(), '_count_command')(count)
+        # Keep cached render defaults in sync instead of rebuilding metadata
+        if self._defaults is not None:
+            self._defaults['array_size'] = self.array_size
+            self._defaults['num_commands'] = self.num_commands
+
+    def _count_columns(self, keys, size):
+        columns = getattr(super(), '_count_columns')(keys, size)
+        counts = range(self.num_commands + 1, self.num_commands + size + 1)
+        if 'num_commands' in keys:
+            columns['num_commands'] = list(counts)
+        if 'array_size' in keys:
+            columns['array_size'] = [self._array_size(count) for count in counts]
+        return columns
+
+    @property
+    def array_size(self):
+        return self._array_size(self.num_commands)
+
+    def _array_size(self, num_commands):
+        if self.workers:
+            return min(self.workers, num_commands)
+        return -(-num_commands // self.pack)
+
+    @property
+    def status_path(self):
+        template = getattr(getattr(self.command, 'slurm', None), 'status_filename_template', None)
+        return Path((template or '{build_path}/status_{name}.log').format(**self.metadata))
+
+    @property
+    def log_path(self):
+        template = getattr(getattr(self.command, 'slurm', None), 'log_path_template', None)
+        return Path((template or '{build_path}/logs/{name}').format(**self.metadata))
+
+    @property
+    def log_sink_writer(self) -> 'LogSink':
+        slurm = getattr(self.command, 'slurm', None)
+        from .logsink import LogSink
+
+        return LogSink(self.log_path, getattr(slurm, 'log_shards', None) or 16, getattr(slurm, 'log_compression', None))
+
+    @property
+    def usage_path(self):
+        template = getattr(getattr(self.command, 'slurm', None), 'usage_filename_template', None)
+        return Path((template or '{build_path}/usage.log').format(**self.metadata))
+
+    @property
+    def queue_path(self):
+        template = getattr(getattr(self.command, 'slurm', None), 'queue_path_template', None)
+        return Path((template or '{build_path}/queue_{name}').format(**self.metadata))
 
     
     @property
@@ -209,10 +570,206 @@ class SlurmCommandConfigurator(ShellCommandConfigurator):
         data = getattr(super(), 'metadata')
         return {
             **data,
-            'array_size': self.__slurm_array_size,
+            'array_size': self.array_size,
+            'num_commands': self.num_commands,
         }
 
 
+    def fetch_command_string(self, first='${SLURM_ARRAY_TASK_ID}', last=None, python=None):
+        """
+        Shell snippet printing lines `first` to `last` of the command file.
+        """
+        # Tables are decoded by the lookup as well
+        if self.write_index or self.storage == 'table':
+            lines = first if last is None else f'{first} {last}'
+            return f'{python or "python"} -m shell_templates.lookup {self.filename} {lines}'
+        if last is None:
+            return f'sed -n "{first}{{p;q}}" {self.filename}'
+        return f'sed -n "{first},{last}p;{last}q" {self.filename}'
+
+    @staticmethod
+    def task_id_string(offset=0):
+        if offset:
+            return f'$(( SLURM_ARRAY_TASK_ID + {offset} ))'
+        return '${SLURM_ARRAY_TASK_ID}'
+
+    def log_capture_string(self, task, python=None):
+        """
+        Shell snippet redirecting the rest of the script to node-local files appended to the log sink on exit.
+        """
+        sink = self.log_sink_writer
+        append = ' '.join([
+            f'{python or "python"} -m slurm.logsink append {shlex.quote(str(sink.path))} --task {task}',
+            f'--shards {sink.shards}',
+            *([f'--compression {sink.compression}'] if sink.compression else []),
+            '--stdout \\"${log_tmp}/stdout\\" --stderr \\"${log_tmp}/stderr\\" 1>&3 2>&4',
+        ])
+        return '\n'.join([
+            '# Capture the output of the task, it is appended to the shared log when the script exits',
+            'log_tmp=$(mktemp -d "${TMPDIR:-/tmp}/pipeline_log.XXXXXX")',
+            f'trap "{append}; rm -rf \\"${{log_tmp}}\\"" EXIT',
+            'trap "exit 143" TERM',
+            'exec 3>&1 4>&2 1>"${log_tmp}/stdout" 2>"${log_tmp}/stderr"',
+        ])
+
+    def run_commands_string(self, header, python=None, offset=0, exec=None):
+        """
+        Shell snippet running the commands of the current array task with `run_command`.
+
+        `offset` is added to SLURM_ARRAY_TASK_ID for arrays split into several scripts.
+        The snippet leaves the exit code of the task in `task_status` and, except
+        for queue workers that keep their own log, appends it to the status log.
+        With `log_sink` the output of the task goes to the shared log.
+        """
+        concurrency = self.pack_concurrency or header.cpus_per_task or 1
+
+        if self.workers:
+            claim_size = getattr(getattr(self.command, 'slurm', None), 'claim_size', None) or 1
+            lease = getattr(getattr(self.command, 'slurm', None), 'worker_lease', None) or 300.0
+            return '\n'.join([
+                *([self.log_capture_string(self.task_id_string(offset), python), ''] if self.log_sink else []),
+                '# Pull commands from the shared queue until it is drained',
+                f'{python or "python"} -m slurm.worker {self.filename} --queue {self.queue_path}'
+                f' --worker {self.task_id_string(offset)} --exec {shlex.quote(exec or "eval")}'
+                f' --concurrency {concurrency} --claim-size {claim_size} --lease {lease:g}',
+                'task_status=$?',
+            ])
+
+        lines = [
+            f'task_id={self.task_id_string(offset)}',
+            f'status_log={shlex.quote(str(self.status_path))}',
+            'task_start=${EPOCHREALTIME:-$(date +%s.%N)}',
+            '',
+            *([self.log_capture_string('${task_id}', python), ''] if self.log_sink else []),
+        ]
+
+        if self.pack == 1:
+            lines = [
+                '# Take SLURM_ARRAY_TASK_ID line from .sh script',
+                *lines,
+                f'run_command "$({self.fetch_command_string("${task_id}", python=python)})"',
+                'task_status=$?',
+            ]
+        else:
+            fetch = self.fetch_command_string('${first}', '${last}', python=python)
+            lines = [
+                f'# Take {self.pack} lines of SLURM_ARRAY_TASK_ID pack from .sh script and run {concurrency} at a time',
+                *lines,
+                f'first=$(( (task_id - 1) * {self.pack} + 1 ))',
+                f'last=$(( task_id * {self.pack} ))',
+                f'commands=$({fetch})',
+                '',
+                'running=0',
+                'failed=0',
+                'while IFS= read -r command; do',
+                f'    if (( running >= {concurrency} )); then',
+                '        wait -n || failed=$(( failed + 1 ))',
+                '        running=$(( running - 1 ))',
+                '    fi',
+                '    run_command "${command}" &',
+                '    running=$(( running + 1 ))',
+                'done <<< "${commands}"',
+                '',
+                'while (( running > 0 )); do',
+                '    wait -n || failed=$(( failed + 1 ))',
+                '    running=$(( running - 1 ))',
+                'done',
+                '',
+                'echo "${failed} commands of the pack failed"',
+                'task_status=$(( failed > 0 ))',
+            ]
+
+        lines += [
+            '',
+            '# Record the exit code of the task for reruns of failed tasks',
+            'task_end=${EPOCHREALTIME:-$(date +%s.%N)}',
+            'echo "${task_id} ${task_status} ${task_start} ${task_end}" >> "${status_log}"',
+        ]
+
+        if getattr(getattr(self.command, 'slurm', None), 'record_usage', False):
+            lines += ['', self.usage_string()]
+
+        return '\n'.join(lines)
+
+    def usage_string(self):
+        """
+        Shell snippet appending wall time and, inside a SLURM cgroup, peak memory and CPU time to the usage log.
+
+        `LocalExecutor` measures tasks itself and sets PIPELINE_USAGE_BY_EXECUTOR.
+        """
+        return '\n'.join([
+            '# Record the resources the task used, see slurm.usage',
+            f'usage_log={shlex.quote(str(self.usage_path))}',
+            f'usage_name={shlex.quote(self.name)}',
+            'if [[ -z "${PIPELINE_USAGE_BY_EXECUTOR}" ]]; then',
+            '    task_rss=- task_cpu=-',
+            '    cgroup=$(sed -n "s/^0:://p" /proc/self/cgroup 2>/dev/null)',
+            '    if [[ "${cgroup}" == */job_${SLURM_JOB_ID}/* && -r "/sys/fs/cgroup${cgroup}/memory.peak" ]]; then',
+            '        task_rss=$(< "/sys/fs/cgroup${cgroup}/memory.peak")',
+            '        task_cpu=$(sed -n "s/^usage_usec //p" "/sys/fs/cgroup${cgroup}/cpu.stat")',
+            '    elif cgroup=$(sed -n "s/^[0-9]*:memory://p" /proc/self/cgroup 2>/dev/null)',
+            '            [[ "${cgroup}" == */job_${SLURM_JOB_ID}/* && -r "/sys/fs/cgroup/memory${cgroup}/memory.max_usage_in_bytes" ]]; then',
+            '        task_rss=$(< "/sys/fs/cgroup/memory${cgroup}/memory.max_usage_in_bytes")',
+            '    fi',
+            '    echo "${usage_name} ${task_id} ${task_status} ${task_start} ${task_end} ${task_rss} ${task_cpu:--}" >> "${usage_log}"',
+            'fi',
+        ])
+
+    def array_chunks(self, max_array_size=None):
+        """
+        Splits the array into `(offset, size)` chunks of at most `max_array_size` tasks.
+        """
+        if not max_array_size or self.array_size <= max_array_size:
+            return [(0, self.array_size)]
+
+        return [
+            (offset, min(max_array_size, self.array_size - offset))
+            for offset in range(0, self.array_size, max_array_size)
+        ]
+
+    def script_record(self, header, metadata, offset=0, throttle=None) -> dict:
+        """
+        Offset, `--array` range, status log and queue of an sbatch script, kept in `submit.json`.
+        """
+        array = header.array
+        if array is None and header.array_template is not None:
+            array = header.array_template.format(**metadata) + (f'%{throttle}' if throttle else '')
+        return {
+            'command': self.name,
+            'offset': offset,
+            'array': array,
+            'status_log': str(self.status_path),
+            'queue': str(self.queue_path) if self.workers else None,
+        }
+
+    def render_sbatch(self, template, header, body, metadata, offset=0, throttle=None):
+        with events.span('slurm.render_sbatch', name=metadata.get('name')):
+            return self._render_sbatch(template, header, body, metadata, offset, throttle)
+
+    def _render_sbatch(self, template, header, body, metadata, offset, throttle):
+        mapping = dict(body)
+
+        if throttle and header.array is None and header.array_template is not None:
+            header = deepcopy(header)
+            header.array = f'{header.array_template.format(**metadata)}%{throttle}'
+
+        # Only messages of SLURM itself end up in the per-array file
+        if self.log_sink and (header.output is None or header.error is None):
+            header = deepcopy(header)
+            shared = str(self.log_path / 'slurm_%A.log')
+            header.output = header.output or shared
+            header.error = header.error or header.output
+            header.open_mode = header.open_mode or 'append'
+
+        python = mapping.get('python')
+        mapping.setdefault('header', header.to_sbatch_header_string(metadata))
+        mapping.setdefault('fetch_command', self.fetch_command_string(self.task_id_string(offset), python=python))
+        mapping.setdefault('run_commands', self.run_commands_string(header, python=python, offset=offset, exec=mapping.get('exec')))
+        for k, v in metadata.items():
+            mapping.setdefault(k, v)
+
+        return Template(template).substitute(mapping)
+
     def slurm_finalize(
         self,
     ):
@@ -220,6 +777,8 @@ class SlurmCommandConfigurator(ShellCommandConfigurator):
         filename_template = self.slurm_filename_template
         header = self.slurm_header
         mapping = self.slurm_body
+        max_array_size = throttle = None
+        submit_filename_template = '{build_path}/submit_{name}.sh'
 
         if hasattr(self.command, 'slurm'):
             if template is None:
@@ -228,16 +787,74 @@ class SlurmCommandConfigurator(ShellCommandConfigurator):
                 filename_template = self.command.slurm.filename_template
             for k, v in asdict(self.command.slurm.body).items():
                 mapping.setdefault(k, v)
-            header = update_dataclass(header, self.command.slurm.header)
-
-        mapping.setdefault('header', header.to_sbatch_header_string(self.metadata))
-        for k, v in self.metadata.items():
-            mapping.setdefault(k, v)
-
-        with open(filename_template.format(**self.metadata), 'w') as file:
-            file.write(Template(template).substitute(mapping))
+            header = merge_defaults(header, self.command.slurm.header)
+            max_array_size = self.command.slurm.max_array_size
+            throttle = self.command.slurm.array_throttle
+            submit_filename_template = self.command.slurm.submit_filename_template or submit_filename_template
+
+        metadata = self.metadata
+        chunks = self.array_chunks(max_array_size)
+
+        if self.log_sink:
+            self.log_sink_writer.write_meta()
+
+        # Statuses of a previous generation do not describe new commands. Workers
+        # of a new job start a drained queue over, see `TaskQueue.start_job`.
+        from .worker import TaskQueue
+
+        queue = TaskQueue(self.queue_path)
+        if self.changed is not False or self.workers and not queue.state_path.exists():
+            if self.workers:
+                queue.initialize(self.num_commands)
+            else:
+                self.status_path.unlink(missing_ok=True)
+
+        if len(chunks) == 1:
+            self.sbatch_filenames = [filename_template.format(**metadata)]
+            self.sbatch_records = {self.sbatch_filenames[0]: self.script_record(header, metadata, throttle=throttle)}
+            self.write_text(self.sbatch_filenames[0], self.render_sbatch(template, header, mapping, metadata, throttle=throttle))
+            return
+
+        # Every chunk is a separate array numbered from 1 reading its lines at an offset
+        self.sbatch_filenames = filenames = []
+        self.sbatch_records = {}
+        for chunk, (offset, size) in enumerate(chunks, start=1):
+            chunk_metadata = {
+                **metadata,
+                'name': f'{self.name}_{chunk}',
+                'array_size': size,
+                'array_offset': offset,
+                'chunk': chunk,
+            }
+            filenames.append(filename_template.format(**chunk_metadata))
+            self.sbatch_records[filenames[-1]] = self.script_record(header, chunk_metadata, offset, throttle)
+            self.write_text(filenames[-1], self.render_sbatch(template, header, mapping, chunk_metadata, offset, throttle))
+
+        self.write_text(submit_filename_template.format(**metadata), '\n'.join([
+            '#!/bin/bash',
+            f'# Submits {self.array_size} array tasks of {self.name} as {len(chunks)} arrays',
+            'set -e',
+            '',
+            *[f'sbatch {filename}' for filename in filenames],
+            '',
+        ]))
             
     
-    def __exit__(self, *args, **kwargs):
-        self.slurm_finalize()
-        return super().__exit__(*args, **kwargs)
+    def __exit__(self, exc_type, exc_value, traceback):
+        # The command file goes first, whether it changed decides what happens to statuses
+        result = super().__exit__(exc_type, exc_value, traceback)
+        # A failed build leaves no sbatch script behind that could be submitted
+        if exc_type is not None:
+            return result
+
+        with events.span('slurm.finalize', count=self.array_size, name=self.name):
+            self.slurm_finalize()
+
+        # Keep the build's submit script in sync with the generated sbatch scripts
+        setattr(self.command, '__sbatch_filenames', list(self.sbatch_filenames))
+        setattr(self.command, '__sbatch_records', dict(self.sbatch_records))
+        # `build_all` writes the submit script once all commands are generated
+        if isinstance(self.args, SlurmArguments) and not getattr(self.args, '_building_all', False):
+            with events.span('slurm.submit_script'):
+                self.args.write_submit_script()
+        return result
@@ -0,0 +1,54 @@
+"""
+Append-only per-task status log.
+
+Every finished task appends one short line ``<task id> <exit code> <start> <end>``
+with a single `O_APPEND` write, so thousands of tasks can share one file and
+a whole build is scanned with one sequential read.
+"""
+from typing import Dict, NamedTuple
+import os
+
+
+class TaskStatus(NamedTuple):
+    task_id: int
+
+    returncode: int
+
+    start: float
+
+    end: float
+
+
+def append_status(filename, task_id: int, returncode: int, start: float, end: float):
+    record = f'{task_id} {returncode} {start:.3f} {end:.3f}\n'.encode()
+    descriptor = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descriptor, record)
+    finally:
+        os.close(descriptor)
+
+
+def read_status(filename) -> Dict[int, TaskStatus]:
+    """
+    Latest status of every task found in the log, later records win.
+    """
+    statuses = {}
+    if not os.path.exists(filename):
+        return statuses
+
+    with open(filename, 'rb') as file:
+        records = file.read().split(b'\n')
+
+    make = TaskStatus._make
+    for record in records:
+        fields = record.split()
+        # Skip records torn by a killed task
+        if len(fields) != 4:
+            continue
+        try:
+            task_id = int(fields[0])
+            statuses[task_id] = make((task_id, int(fields[1]), float(fields[2]), float(fields[3])))
+        except ValueError:
+            continue
+
+    return statuses
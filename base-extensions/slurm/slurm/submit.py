@@ -0,0 +1,275 @@
+"""
+Submission of the sbatch scripts of a build with bounded concurrency and retries.
+
+Commands are submitted in dependency order, all chunks of the commands whose
+dependencies already have job IDs at the same time with at most
+`max_concurrency` sbatch calls in flight and at most `rate` calls per second.
+Transient controller errors (timeouts, "Resource temporarily unavailable",
+submit limits) are retried with exponential backoff and jitter.
+
+Job IDs are recorded in the `extra` section of the build manifest together
+with the digest of the script and its `--dependency`, so submitting a build
+again skips scripts that were already submitted unchanged and resumes a
+submission that failed halfway::
+
+    python -m slurm.submit /path/to/build --concurrency 4 --rate 2
+    python -m slurm.submit /path/to/build --sbatch "python -m slurm.fake_sbatch --max-rate 5"
+
+A timed out sbatch call may still have submitted its job, such calls are
+retried as well and can leave a duplicate job behind.
+"""
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+import argparse
+import json
+import os
+import random
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+from pipeline import events
+from pipeline.manifest import BuildManifest, digest_bytes
+
+from .dependencies import chunk_conditions, topological_order
+
+
+MANIFEST_KEY_PREFIX = 'slurm.submit:'
+
+TRANSIENT_ERROR = re.compile('|'.join([
+    'Socket timed out',
+    'Resource temporarily unavailable',
+    'temporarily unable to accept job',
+    'Unable to contact slurm controller',
+    'Connection refused',
+    'Zero Bytes were transmitted',
+    'Transport endpoint is not connected',
+    'MaxSubmitJob',
+    'Job violates accounting/QOS policy',
+]), re.IGNORECASE)
+
+
+class SubmissionError(RuntimeError):
+    pass
+
+
+@dataclass
+class SubmittedJob:
+    name: str
+
+    # 1-based index of the array chunk
+    chunk: int
+
+    script: str
+
+    job_id: str
+
+    dependency: str
+
+    # Number of sbatch calls, 0 if the job of an earlier submission was reused
+    attempts: int
+
+
+class _RateLimiter:
+    def __init__(self, rate: Optional[float]):
+        self.interval = 1 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next, now)
+            self._next = start + self.interval
+        time.sleep(start - now)
+
+
+@dataclass
+class Submitter:
+    # Submission command, defaults to $SBATCH or `sbatch`
+    sbatch: Optional[str] = None
+
+    # sbatch calls in flight at once
+    max_concurrency: int = 4
+
+    # sbatch calls per second over all threads, None for no limit
+    rate: Optional[float] = None
+
+    # sbatch calls per script before giving up
+    max_attempts: int = 8
+
+    # Seconds before the first retry, doubled for every further retry up to `max_backoff`
+    backoff: float = 1.0
+
+    max_backoff: float = 60.0
+
+    # Seconds an sbatch call may take
+    timeout: Optional[float] = 120.0
+
+    # Extra options of every sbatch call
+    options: List[str] = field(default_factory=lambda: [])
+
+    def command(self) -> List[str]:
+        return shlex.split(self.sbatch or os.environ.get('SBATCH') or 'sbatch')
+
+    def sbatch_call(self, script, dependency: str = '', limiter: Optional[_RateLimiter] = None) -> Tuple[str, int]:
+        """
+        Submits `script` and returns its job ID and the number of calls it took.
+        """
+        command = [*self.command(), '--parsable', *self.options]
+        if dependency:
+            command.append(f'--dependency={dependency}')
+        command.append(str(script))
+
+        for attempt in range(1, self.max_attempts + 1):
+            if limiter is not None:
+                limiter.wait()
+            try:
+                process = subprocess.run(command, capture_output=True, text=True, timeout=self.timeout)
+                error = process.stderr.strip() or f'exit code {process.returncode}'
+                if process.returncode == 0:
+                    # --parsable prints `jobid[;cluster]`
+                    return process.stdout.strip().splitlines()[-1].split(';')[0], attempt
+                transient = TRANSIENT_ERROR.search(process.stderr) is not None
+            except subprocess.TimeoutExpired:
+                error, transient = f'sbatch timed out after {self.timeout}s', True
+
+            if not transient or attempt == self.max_attempts:
+                raise SubmissionError(f'Submitting {script} failed after {attempt} attempts: {error}')
+            delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def submit(
+        self,
+        scripts: Dict[str, List[str]],
+        dependencies: Dict[str, List[Tuple[str, str]]],
+        manifest: Optional[BuildManifest] = None,
+        force: bool = False,
+    ) -> Dict[str, List[SubmittedJob]]:
+        """
+        Submits `scripts` (command name -> sbatch scripts) in dependency order.
+
+        With a `manifest`, scripts already submitted with the same content and
+        dependencies keep their job, unless `force`. Raises `SubmissionError`
+        after the commands that could be submitted are recorded.
+        """
+        levels: Dict[str, int] = {}
+        for name in topological_order(dependencies):
+            levels[name] = 1 + max((levels[upstream] for _, upstream in dependencies[name]), default=-1)
+
+        jobs: Dict[str, List[SubmittedJob]] = {}
+        limiter = _RateLimiter(self.rate)
+
+        def submit_chunk(name, chunk, script):
+            conditions = chunk_conditions(name, chunk, scripts, dependencies)
+            dependency = ','.join(
+                f'{kind}:' + ':'.join(jobs[upstream][number - 1].job_id for number in numbers)
+                for kind, upstream, numbers in conditions
+            )
+            digest = digest_bytes(Path(script).read_bytes())
+            key = f'{MANIFEST_KEY_PREFIX}{_relative(script, manifest)}'
+
+            record = manifest.get_extra(key) if manifest is not None and not force else None
+            if record and record['digest'] == digest and record['dependency'] == dependency:
+                return SubmittedJob(name, chunk, str(script), record['job_id'], dependency, 0)
+
+            job_id, attempts = self.sbatch_call(script, dependency, limiter)
+            if manifest is not None:
+                manifest.set_extra(key, {
+                    'job_id': job_id, 'name': name, 'chunk': chunk, 'script': str(script),
+                    'digest': digest, 'dependency': dependency, 'time': time.time(),
+                })
+            return SubmittedJob(name, chunk, str(script), job_id, dependency, attempts)
+
+        with events.span('slurm.submit', count=0) as span, ThreadPoolExecutor(self.max_concurrency) as pool:
+            for level in sorted(set(levels.values())):
+                names = [name for name in levels if levels[name] == level and scripts.get(name)]
+                futures = {
+                    name: [pool.submit(submit_chunk, name, chunk, script) for chunk, script in enumerate(scripts[name], start=1)]
+                    for name in names
+                }
+
+                errors = []
+                for name, chunk_futures in futures.items():
+                    try:
+                        jobs[name] = [future.result() for future in chunk_futures]
+                    except SubmissionError as error:
+                        errors.append(str(error))
+                        # Let the other chunks of the command finish and record their jobs
+                        for future in chunk_futures:
+                            future.exception()
+                if errors:
+                    raise SubmissionError('\n'.join(errors))
+                span.count += sum(len(futures[name]) for name in names)
+
+        return jobs
+
+
+def submitted_jobs(manifest: BuildManifest) -> List[dict]:
+    """
+    Submission records of a build, ordered by command and chunk.
+    """
+    records = [record for key, record in manifest.extra.items() if key.startswith(MANIFEST_KEY_PREFIX)]
+    return sorted(records, key=lambda record: (record.get('name', ''), record.get('chunk', 0)))
+
+
+def _relative(script, manifest: Optional[BuildManifest]) -> str:
+    if manifest is None:
+        return str(script)
+    try:
+        return str(Path(script).resolve().relative_to(manifest.build_path.resolve()))
+    except ValueError:
+        return str(script)
+
+
+def load_plan(filename) -> Tuple[Dict[str, List[str]], Dict[str, List[Tuple[str, str]]]]:
+    """
+    Scripts and dependencies written next to the submit script by `SlurmArguments.write_submit_script`.
+    """
+    plan = json.loads(Path(filename).read_text())
+    dependencies = {name: [tuple(dependency) for dependency in upstream] for name, upstream in plan['dependencies'].items()}
+    return plan['scripts'], dependencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m slurm.submit', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('build_path')
+    parser.add_argument('--plan', default=None, help='Scripts and dependencies written with the submit script, defaults to submit.json')
+    parser.add_argument('--sbatch', default=None, help='Submission command, defaults to $SBATCH or sbatch')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=None, help='sbatch calls per second')
+    parser.add_argument('--max-attempts', type=int, default=8)
+    parser.add_argument('--backoff', type=float, default=1.0)
+    parser.add_argument('--force', action='store_true', help='Submit scripts again even if they were submitted unchanged')
+    options = parser.parse_args(argv)
+
+    submitter = Submitter(
+        sbatch=options.sbatch,
+        max_concurrency=options.concurrency,
+        rate=options.rate,
+        max_attempts=options.max_attempts,
+        backoff=options.backoff,
+    )
+    scripts, dependencies = load_plan(options.plan or Path(options.build_path) / 'submit.json')
+    try:
+        jobs = submitter.submit(scripts, dependencies, BuildManifest(options.build_path), force=options.force)
+    except SubmissionError as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    for name, chunks in jobs.items():
+        for job in chunks:
+            verb = 'Submitted' if job.attempts else 'Already submitted'
+            print(f'{verb} {name}[{job.chunk}] as job {job.job_id}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,339 @@
+"""
+States of the array tasks of a submitted build.
+
+`JobTracker` reads the job IDs that `slurm.submit` recorded in the build
+manifest and asks `sacct` for all unfinished jobs at once, at most once per
+`interval`, in parsable form::
+
+    sacct -n -P -X -o JobID,State,ExitCode -j 101,102,103
+
+sacct collapses pending tasks of an array into one line (`101_[5-1000]`), so
+the output grows with the number of started tasks, not the size of the
+arrays. States are cached in `job_states.json` in the build directory; jobs
+whose tasks all finished are never polled again, and every poll returns the
+tasks whose state changed::
+
+    python -m slurm.tracker /path/to/build --wait
+    python -m slurm.tracker /path/to/build --sacct "python -m slurm.fake_sacct --runtime 2"
+"""
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from dataclasses import dataclass, field
+from pathlib import Path
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+from pipeline.manifest import BuildManifest
+
+from .rerun import array_offset
+from .scripts import format_array, parse_array, parse_sbatch_options
+from .submit import submitted_jobs
+
+
+SACCT_FORMAT = 'JobID,State,ExitCode'
+
+CACHE_FILENAME = 'job_states.json'
+
+UNKNOWN = 'UNKNOWN'
+
+PENDING_STATES = ('PENDING', 'REQUEUED', 'RESIZING')
+
+RUNNING_STATES = ('RUNNING', 'COMPLETING', 'CONFIGURING', 'SUSPENDED', 'STOPPED', 'SIGNALING', 'STAGE_OUT')
+
+FAILED_STATES = ('FAILED', 'CANCELLED', 'TIMEOUT', 'OUT_OF_MEMORY', 'NODE_FAIL', 'BOOT_FAIL', 'DEADLINE', 'PREEMPTED')
+
+FINAL_STATES = ('COMPLETED', *FAILED_STATES)
+
+
+class StatusError(RuntimeError):
+    pass
+
+
+class StateChange(NamedTuple):
+    name: str
+
+    # Task index in the whole command, chunks of split arrays included
+    index: int
+
+    job_id: str
+
+    old: str
+
+    new: str
+
+
+@dataclass
+class CommandSummary:
+    name: str
+
+    total: int = 0
+
+    pending: int = 0
+
+    running: int = 0
+
+    completed: int = 0
+
+    failed: int = 0
+
+    # Tasks sacct did not report yet
+    unknown: int = 0
+
+    failed_indices: List[int] = field(default_factory=lambda: [])
+
+    @property
+    def done(self) -> bool:
+        return self.completed + self.failed == self.total
+
+
+@dataclass
+class TrackedJob:
+    name: str
+
+    chunk: int
+
+    job_id: str
+
+    offset: int
+
+    indices: List[int]
+
+
+def parse_sacct(text: str) -> Iterator[Tuple[str, Optional[List[int]], str]]:
+    """
+    Yields `(job ID, array indices or None, state)` of `sacct -P -o JobID,State,...` lines.
+    """
+    for line in text.splitlines():
+        fields = line.strip().split('|')
+        if len(fields) < 2 or not fields[0]:
+            continue
+        job_id, state = fields[0], fields[1].split(' ')[0]
+        # Job steps such as 101_3.batch are not tasks
+        if '.' in job_id:
+            continue
+        job, separator, tasks = job_id.partition('_')
+        if not separator:
+            yield job, None, state
+            continue
+        indices, _ = parse_array(tasks.strip('[]'))
+        yield job, indices, state
+
+
+class JobTracker:
+    """
+    Cached states of the tasks of all jobs submitted from `build_path`.
+    """
+
+    def __init__(
+        self,
+        build_path,
+        sacct: Optional[str] = None,
+        interval: float = 30.0,
+        max_interval: float = 300.0,
+        manifest: Optional[BuildManifest] = None,
+    ):
+        self.build_path = Path(build_path)
+        # Query command, defaults to $SACCT or `sacct`
+        self.sacct = sacct
+        self.interval = interval
+        self.max_interval = max_interval
+        self.manifest = manifest or BuildManifest(self.build_path)
+        self.cache_path = self.build_path / CACHE_FILENAME
+        self.calls = 0
+
+        self._last_poll: Optional[float] = None
+        self.jobs: List[TrackedJob] = []
+        self._states: Dict[str, Dict[int, str]] = {}
+        self.reload()
+
+    def reload(self):
+        """
+        Reads the submitted jobs from the manifest and the cached states.
+        """
+        self.manifest.reload()
+        self.jobs = []
+        for record in submitted_jobs(self.manifest):
+            script = Path(record['script'])
+            indices, _ = parse_array(parse_sbatch_options(script).get('array', '1')) if script.exists() else ([], None)
+            offset = array_offset(script) if script.exists() else 0
+            self.jobs.append(TrackedJob(record['name'], record['chunk'], str(record['job_id']), offset, indices))
+
+        cached = {}
+        if self.cache_path.exists():
+            try:
+                cached = json.loads(self.cache_path.read_text())
+            except ValueError:
+                cached = {}
+        self._states = {
+            job.job_id: {
+                index: state
+                for state, spec in cached.get(job.job_id, {}).items()
+                for index in parse_array(spec)[0]
+            }
+            for job in self.jobs
+        }
+
+    def command(self) -> List[str]:
+        return shlex.split(self.sacct or os.environ.get('SACCT') or 'sacct')
+
+    def _is_final(self, job: TrackedJob) -> bool:
+        states = self._states[job.job_id]
+        return all(states.get(index) in FINAL_STATES for index in job.indices)
+
+    def poll(self, force: bool = False) -> List[StateChange]:
+        """
+        Queries all unfinished jobs with one sacct call and returns the tasks whose state changed.
+
+        Without `force` nothing is queried within `interval` seconds of the previous poll.
+        """
+        now = time.monotonic()
+        if not force and self._last_poll is not None and now - self._last_poll < self.interval:
+            return []
+
+        active = {job.job_id: job for job in self.jobs if not self._is_final(job)}
+        if not active:
+            return []
+
+        command = [*self.command(), '-n', '-P', '-X', '-o', SACCT_FORMAT, '-j', ','.join(active)]
+        process = subprocess.run(command, capture_output=True, text=True)
+        self.calls += 1
+        self._last_poll = time.monotonic()
+        if process.returncode != 0:
+            raise StatusError(f'{shlex.join(command[:1])} failed: {process.stderr.strip() or process.returncode}')
+
+        changes = []
+        for job_id, indices, state in parse_sacct(process.stdout):
+            job = active.get(job_id)
+            if job is None:
+                continue
+            states = self._states[job_id]
+            for index in (job.indices if indices is None else indices):
+                old = states.get(index, UNKNOWN)
+                if old != state:
+                    states[index] = state
+                    changes.append(StateChange(job.name, job.offset + index, job_id, old, state))
+
+        if changes:
+            self._save()
+        return changes
+
+    def _save(self):
+        cached = {}
+        for job_id, states in self._states.items():
+            by_state: Dict[str, List[int]] = {}
+            for index, state in states.items():
+                by_state.setdefault(state, []).append(index)
+            cached[job_id] = {state: format_array(indices) for state, indices in by_state.items()}
+
+        temporary = self.cache_path.with_name(f'.{self.cache_path.name}.{os.getpid()}.tmp')
+        temporary.write_text(json.dumps(cached))
+        os.replace(temporary, self.cache_path)
+
+    def states(self, name: str) -> Dict[int, str]:
+        """
+        State of every task of command `name` by its index in the command.
+        """
+        return {
+            job.offset + index: self._states[job.job_id].get(index, UNKNOWN)
+            for job in self.jobs if job.name == name
+            for index in job.indices
+        }
+
+    def summary(self) -> Dict[str, CommandSummary]:
+        summaries = {}
+        for job in self.jobs:
+            summary = summaries.setdefault(job.name, CommandSummary(job.name))
+            states = self._states[job.job_id]
+            for index in job.indices:
+                state = states.get(index, UNKNOWN)
+                summary.total += 1
+                if state in PENDING_STATES:
+                    summary.pending += 1
+                elif state in RUNNING_STATES:
+                    summary.running += 1
+                elif state == 'COMPLETED':
+                    summary.completed += 1
+                elif state in FAILED_STATES:
+                    summary.failed += 1
+                    summary.failed_indices.append(job.offset + index)
+                else:
+                    summary.unknown += 1
+        return summaries
+
+    def wait(
+        self,
+        names: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+        on_change: Optional[Callable[[List[StateChange]], None]] = None,
+        max_errors: int = 5,
+    ) -> Dict[str, CommandSummary]:
+        """
+        Polls until all tasks of `names` (all commands by default) finished and returns the summaries.
+
+        The delay between polls starts at `interval` and doubles up to `max_interval`
+        while no task changes. Failing sacct calls are retried `max_errors` times in a row.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = self.interval
+        errors = 0
+        while True:
+            try:
+                changes = self.poll(force=True)
+                errors = 0
+            except StatusError:
+                errors += 1
+                if errors >= max_errors:
+                    raise
+                changes = []
+
+            if changes and on_change is not None:
+                on_change(changes)
+
+            summaries = {name: summary for name, summary in self.summary().items() if names is None or name in names}
+            if all(summary.done for summary in summaries.values()):
+                return summaries
+
+            delay = self.interval if changes else min(delay * 2, self.max_interval)
+            if deadline is not None and time.monotonic() + delay > deadline:
+                raise TimeoutError(f'Commands still running: {", ".join(n for n, s in summaries.items() if not s.done)}')
+            time.sleep(delay)
+
+
+def format_summary(summaries: Dict[str, CommandSummary]) -> str:
+    lines = [f'{"command":<24} {"total":>8} {"pending":>8} {"running":>8} {"done":>8} {"failed":>8} {"unknown":>8}']
+    for summary in summaries.values():
+        lines.append(
+            f'{summary.name:<24} {summary.total:>8} {summary.pending:>8} {summary.running:>8}'
+            f' {summary.completed:>8} {summary.failed:>8} {summary.unknown:>8}'
+        )
+        if summary.failed_indices:
+            lines.append(f'  failed tasks: {format_array(summary.failed_indices)}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m slurm.tracker', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('build_path')
+    parser.add_argument('--sacct', default=None, help='Query command, defaults to $SACCT or sacct')
+    parser.add_argument('--wait', action='store_true', help='Poll until all tasks finished')
+    parser.add_argument('--interval', type=float, default=30.0, help='Seconds between polls while tasks change')
+    parser.add_argument('--timeout', type=float, default=None)
+    options = parser.parse_args(argv)
+
+    tracker = JobTracker(options.build_path, sacct=options.sacct, interval=options.interval)
+    if options.wait:
+        summaries = tracker.wait(timeout=options.timeout)
+    else:
+        tracker.poll(force=True)
+        summaries = tracker.summary()
+
+    print(format_summary(summaries))
+    return 0 if all(summary.failed == 0 for summary in summaries.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""
+Resource usage of array tasks and requests derived from it.
+
+Every array task appends one line to the usage log of its build::
+
+    <command> <task id> <exit code> <start> <end> <peak memory bytes|-> <cpu microseconds|->
+
+On a cluster peak memory and CPU time are read from the cgroup SLURM runs
+the task in, `LocalExecutor` measures its tasks itself. `propose_resources`
+turns the usage of successful tasks into `mem`, `time` and `cpus_per_task`
+from a percentile plus a safety margin, so the next build of the same
+command requests what it needs::
+
+    python -m slurm.usage /path/to/build --percentile 95 --margin 0.2
+"""
+from typing import Dict, Iterable, List, NamedTuple, Optional
+from dataclasses import dataclass, field
+from pathlib import Path
+import argparse
+import math
+import os
+import sys
+
+from .scripts import parse_memory
+
+
+class TaskUsage(NamedTuple):
+    name: str
+
+    task_id: int
+
+    returncode: int
+
+    start: float
+
+    end: float
+
+    # Bytes, None if the task ran without a measurable cgroup
+    max_rss: Optional[int]
+
+    cpu_seconds: Optional[float]
+
+    @property
+    def wall(self) -> float:
+        return self.end - self.start
+
+
+def append_usage(filename, usage: TaskUsage):
+    record = ' '.join([
+        usage.name, str(usage.task_id), str(usage.returncode), f'{usage.start:.3f}', f'{usage.end:.3f}',
+        '-' if usage.max_rss is None else str(usage.max_rss),
+        '-' if usage.cpu_seconds is None else str(round(usage.cpu_seconds * 1e6)),
+    ]) + '\n'
+    descriptor = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descriptor, record.encode())
+    finally:
+        os.close(descriptor)
+
+
+def read_usage(filename, name: Optional[str] = None) -> Dict[str, Dict[int, TaskUsage]]:
+    """
+    Latest usage of every task by command, later records win.
+    """
+    usages: Dict[str, Dict[int, TaskUsage]] = {}
+    if not os.path.exists(filename):
+        return usages
+
+    with open(filename, 'rb') as file:
+        records = file.read().decode(errors='replace').split('\n')
+
+    for record in records:
+        fields = record.split()
+        # Skip records torn by a killed task
+        if len(fields) != 7 or name is not None and fields[0] != name:
+            continue
+        try:
+            usage = TaskUsage(
+                fields[0], int(fields[1]), int(fields[2]), float(fields[3]), float(fields[4]),
+                None if fields[5] == '-' else int(fields[5]),
+                None if fields[6] == '-' else int(fields[6]) / 1e6,
+            )
+        except ValueError:
+            continue
+        usages.setdefault(usage.name, {})[usage.task_id] = usage
+
+    return usages
+
+
+def nearest_rank(values: List[float], q: float) -> float:
+    """
+    Nearest-rank percentile, `q` in [0, 100].
+    """
+    values = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(values)))
+    return values[rank - 1]
+
+
+def format_memory(size: int) -> str:
+    """
+    SLURM memory specification in whole megabytes, or gigabytes above 10G.
+    """
+    megabytes = math.ceil(size / (1 << 20))
+    if megabytes > 10 << 10:
+        return f'{math.ceil(megabytes / 1024)}G'
+    return f'{megabytes}M'
+
+
+def format_time(seconds: float) -> str:
+    """
+    SLURM time limit `[D-]HH:MM:SS` rounded up to whole minutes.
+    """
+    minutes = max(1, math.ceil(seconds / 60))
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{days}-{hours:02d}:{minutes:02d}:00' if days else f'{hours:02d}:{minutes:02d}:00'
+
+
+@dataclass
+class ResourceProposal:
+    name: str
+
+    # Successful tasks the proposal is based on
+    samples: int
+
+    mem: Optional[str] = None
+
+    time: Optional[str] = None
+
+    cpus_per_task: Optional[int] = None
+
+    # Percentiles the proposal was derived from, before the margin
+    observed: Dict[str, float] = field(default_factory=lambda: {})
+
+
+def propose_resources(
+    usages: Iterable[TaskUsage],
+    percentile: float = 95.0,
+    margin: float = 0.2,
+    min_mem: str = '100M',
+    min_time: float = 60.0,
+    min_samples: int = 1,
+) -> Optional[ResourceProposal]:
+    """
+    Requests covering `percentile` percent of the successful tasks plus `margin`.
+
+    Returns None without `min_samples` successful tasks. Memory and CPUs are
+    only proposed if tasks reported them.
+    """
+    usages = [usage for usage in usages if usage.returncode == 0]
+    if len(usages) < max(1, min_samples):
+        return None
+
+    proposal = ResourceProposal(usages[0].name, len(usages))
+
+    wall = nearest_rank([usage.wall for usage in usages], percentile)
+    proposal.observed['wall_seconds'] = wall
+    proposal.time = format_time(max(min_time, wall * (1 + margin)))
+
+    if rss := [usage.max_rss for usage in usages if usage.max_rss is not None]:
+        peak = nearest_rank(rss, percentile)
+        proposal.observed['max_rss_bytes'] = peak
+        proposal.mem = format_memory(max(parse_memory(min_mem), peak * (1 + margin)))
+
+    if cpu := [usage.cpu_seconds / usage.wall for usage in usages if usage.cpu_seconds is not None and usage.wall > 0]:
+        utilization = nearest_rank(cpu, percentile)
+        proposal.observed['cpu_utilization'] = utilization
+        # Cores kept busy, the margin is not applied to whole cores
+        proposal.cpus_per_task = max(1, math.ceil(utilization - 0.05))
+
+    return proposal
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m slurm.usage', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('build_path')
+    parser.add_argument('--usage-log', default=None, help='Defaults to usage.log in the build directory')
+    parser.add_argument('--name', default=None, help='Only this command')
+    parser.add_argument('--percentile', type=float, default=95.0)
+    parser.add_argument('--margin', type=float, default=0.2)
+    options = parser.parse_args(argv)
+
+    filename = options.usage_log or Path(options.build_path) / 'usage.log'
+    print(f'{"command":<24} {"tasks":>6} {"mem":>8} {"time":>12} {"cpus":>5}')
+    for name, tasks in read_usage(filename, options.name).items():
+        proposal = propose_resources(tasks.values(), options.percentile, options.margin)
+        if proposal is None:
+            print(f'{name:<24} {0:>6} no successful tasks')
+            continue
+        print(f'{name:<24} {proposal.samples:>6} {proposal.mem or "-":>8} {proposal.time:>12} {proposal.cpus_per_task or "-":>5}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""
+Long-lived workers pulling commands from a task queue on a shared filesystem.
+
+Instead of one array task per command, a few worker jobs claim task numbers
+from a queue guarded by `flock`, run the corresponding lines of the command
+file and record their exit codes in the queue's status log. Workers exit as
+soon as the queue is drained, so fast workers simply take more tasks::
+
+    python -m slurm.worker /path/to/commands.sh --queue /path/to/queue --worker 3
+
+Every claim is a lease renewed by the worker while it runs the task. Tasks of
+a worker that died (time limit, preemption, out of memory) are claimed again
+once their lease expired, and workers wait for the leases of other workers
+before they exit. A job submitted for a queue that another job drained
+starts the queue over, `requeue` schedules single tasks again for reruns.
+"""
+from typing import Iterable, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from pipeline.manifest import FileLock
+from shell_templates.lookup import read_lines, index_filename_for
+
+from .status import append_status, read_status
+
+
+class TaskQueue:
+    """
+    Tasks `1..total` of a command file, claimed in increasing order after
+    requeued tasks and tasks whose lease expired.
+
+    `state.json` holds the next unclaimed task, the requeued tasks, the claims
+    with their owner and lease expiry, and the job the queue was last used by.
+    """
+
+    def __init__(self, path, lease: float = 300.0):
+        self.path = Path(path)
+        # Seconds a claim stays valid without being renewed
+        self.lease = lease
+
+    @property
+    def state_path(self):
+        return self.path / 'state.json'
+
+    @property
+    def lock_path(self):
+        return self.path / 'lock'
+
+    @property
+    def status_path(self):
+        return self.path / 'status.log'
+
+    def initialize(self, total: int):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self._locked():
+            self._write(_new_state(total))
+            self.status_path.unlink(missing_ok=True)
+
+    def _locked(self):
+        return FileLock(self.lock_path)
+
+    def _read(self) -> dict:
+        return json.loads(self.state_path.read_text())
+
+    def _write(self, state: dict):
+        temporary = self.state_path.with_name(f'.{self.state_path.name}.{os.getpid()}.tmp')
+        temporary.write_text(json.dumps(state))
+        os.replace(temporary, self.state_path)
+
+    @staticmethod
+    def _drained(state: dict) -> bool:
+        return state['next'] > state['total'] and not state['requeued'] and not state['claims']
+
+    def start_job(self, job: Optional[str]) -> bool:
+        """
+        Registers the job of a worker, returns True if the queue was started over.
+
+        The first worker of a new job resets a drained queue, so submitting an
+        unchanged build again runs all tasks again. A queue with unfinished
+        tasks is taken over as it is.
+        """
+        if job is None:
+            return False
+        with self._locked():
+            state = self._read()
+            if state['job'] == job:
+                return False
+            reset = state['job'] is not None and self._drained(state)
+            if reset:
+                state = _new_state(state['total'])
+                self.status_path.unlink(missing_ok=True)
+            state['job'] = job
+            self._write(state)
+            return reset
+
+    def claim(self, count: int = 1, owner: str = '') -> List[int]:
+        """
+        Atomically takes up to `count` tasks for `owner`, an empty list if no task is left to claim.
+        """
+        with self._locked():
+            state = self._read()
+            now = time.time()
+            claims = state['claims']
+
+            tasks = sorted(int(task) for task, (_, expires) in claims.items() if expires < now)[:count]
+            while len(tasks) < count and state['requeued']:
+                tasks.append(state['requeued'].pop(0))
+            last = min(state['next'] + count - len(tasks), state['total'] + 1)
+            tasks.extend(range(state['next'], last))
+            state['next'] = max(state['next'], last)
+
+            for task in tasks:
+                claims[str(task)] = [owner, now + self.lease]
+            if tasks:
+                self._write(state)
+            return tasks
+
+    def renew(self, owner: str):
+        """
+        Extends the leases of all claims of `owner`.
+        """
+        with self._locked():
+            state = self._read()
+            expires = time.time() + self.lease
+            for claim in state['claims'].values():
+                if claim[0] == owner:
+                    claim[1] = expires
+            self._write(state)
+
+    def in_flight(self) -> int:
+        """
+        Number of tasks claimed and not completed, including expired claims.
+        """
+        with self._locked():
+            return len(self._read()['claims'])
+
+    def requeue(self, tasks: Iterable[int]):
+        """
+        Schedules `tasks` to be claimed again before any unclaimed task.
+        """
+        with self._locked():
+            state = self._read()
+            requeued = set(state['requeued'])
+            for task in tasks:
+                if task not in requeued and str(task) not in state['claims']:
+                    state['requeued'].append(task)
+                    requeued.add(task)
+            self._write(state)
+
+    def requeue_failed(self, include_missing: bool = True) -> List[int]:
+        """
+        Requeues claimed tasks that failed or, with `include_missing`, never reported
+        and are not held by a worker. Returns the requeued tasks.
+        """
+        statuses = self.statuses()
+        with self._locked():
+            state = self._read()
+            held = {int(task) for task in state['claims']} | set(state['requeued'])
+            tasks = [
+                task for task in range(1, state['next'])
+                if task not in held and (
+                    (status := statuses.get(task)) is None and include_missing
+                    or status is not None and status.returncode != 0
+                )
+            ]
+            state['requeued'] += tasks
+            self._write(state)
+            return tasks
+
+    def complete(self, task_id: int, returncode: int, start: float, end: float, owner: Optional[str] = None):
+        append_status(self.status_path, task_id, returncode, start, end)
+        with self._locked():
+            state = self._read()
+            claim = state['claims'].get(str(task_id))
+            # A task that was claimed again after its lease expired belongs to the new owner
+            if claim is not None and (owner is None or claim[0] == owner):
+                del state['claims'][str(task_id)]
+                self._write(state)
+
+    def statuses(self):
+        return read_status(self.status_path)
+
+    @property
+    def total(self) -> int:
+        return self._read()['total']
+
+
+def _new_state(total: int) -> dict:
+    return {'next': 1, 'total': total, 'requeued': [], 'claims': {}, 'job': None}
+
+
+def run_worker(
+    filename,
+    queue,
+    worker: Optional[str] = None,
+    exec: str = 'eval',
+    concurrency: int = 1,
+    claim_size: int = 1,
+    shell: str = 'bash',
+    job: Optional[str] = None,
+    poll: Optional[float] = None,
+):
+    """
+    Runs tasks claimed from `queue` until it is drained, returns the number of failed tasks.
+
+    While other workers hold claims the worker polls every `poll` seconds
+    (5 seconds or a quarter of a shorter lease by default) to take over the tasks of dead workers.
+    """
+    queue = TaskQueue(queue) if not isinstance(queue, TaskQueue) else queue
+    index_filename = index_filename_for(filename)
+    output = threading.Lock()
+    owner = f'{worker}@{socket.gethostname()}:{os.getpid()}'
+    poll = min(5.0, queue.lease / 4) if poll is None else poll
+
+    queue.start_job(job)
+
+    def run(task_id, command):
+        start = time.time()
+        process = subprocess.run([shell, '-c', f'{exec} {command}'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        end = time.time()
+        queue.complete(task_id, process.returncode, start, end, owner)
+        with output:
+            sys.stdout.write(f'[worker {worker}] task {task_id}: {command}\n')
+            sys.stdout.buffer.write(process.stdout)
+            sys.stdout.write(f'[worker {worker}] task {task_id} exited with {process.returncode} after {end - start:.1f}s\n')
+            sys.stdout.flush()
+        return process.returncode
+
+    # Every slot claims on its own, so a slow task never holds back the others
+    def slot(_):
+        failed = 0
+        while True:
+            tasks = queue.claim(claim_size, owner)
+            if not tasks:
+                if not queue.in_flight():
+                    return failed
+                time.sleep(poll)
+                continue
+            commands = _read_commands(filename, tasks, index_filename)
+            failed += sum(1 for task_id, command in zip(tasks, commands) if run(task_id, command))
+
+    stopped = threading.Event()
+
+    def heartbeat():
+        while not stopped.wait(queue.lease / 3):
+            queue.renew(owner)
+
+    renewer = threading.Thread(target=heartbeat, daemon=True)
+    renewer.start()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return sum(pool.map(slot, range(concurrency)))
+    finally:
+        stopped.set()
+
+
+def _read_commands(filename, tasks: List[int], index_filename) -> List[str]:
+    # Claims are mostly consecutive, read every run of tasks at once
+    commands = []
+    first = 0
+    for i in range(1, len(tasks) + 1):
+        if i == len(tasks) or tasks[i] != tasks[i - 1] + 1:
+            commands += read_lines(filename, tasks[first], tasks[i - 1], index_filename)
+            first = i
+    return commands
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m slurm.worker', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('filename', help='Command file with its byte-offset index')
+    parser.add_argument('--queue', required=True, help='Queue directory created at generation time')
+    parser.add_argument('--worker', default=os.environ.get('SLURM_ARRAY_TASK_ID', str(os.getpid())))
+    parser.add_argument('--exec', default='eval')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--claim-size', type=int, default=1, help='Tasks claimed per slot at once')
+    parser.add_argument('--lease', type=float, default=300.0, help='Seconds before tasks of a dead worker are claimed again')
+    parser.add_argument('--job', default=os.environ.get('SLURM_ARRAY_JOB_ID', os.environ.get('SLURM_JOB_ID')))
+    options = parser.parse_args(argv)
+
+    failed = run_worker(
+        options.filename,
+        TaskQueue(options.queue, options.lease),
+        worker=options.worker,
+        exec=options.exec,
+        concurrency=options.concurrency,
+        claim_size=options.claim_size,
+        job=options.job,
+    )
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
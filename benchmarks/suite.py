@@ -0,0 +1,378 @@
+"""
+Benchmark suite of the build hot paths with JSON results and baseline comparison.
+
+Every scenario runs in a fresh interpreter, so start-up is measured cold and
+peak memory is the high-water mark of that scenario only. Times are the best
+of `--repeat` runs, memory the largest.
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --sizes 1000 1000000 10000000 --baseline results.json --threshold 0.1
+
+Scenarios, those marked with * run for every size:
+
+    startup_cold     import pipeline and resolve one plugin class
+    startup_cached   the same with the entry point index of PIPELINE_PLUGIN_CACHE
+    startup_warm     `get_class` once plugins are resolved
+    arguments        `BaseArguments` and `SlurmArguments` with `--commands` commands
+    merge_defaults   `pipeline.merge_defaults` of a `Slurm` section with the defaults
+    append_command*  per-call `append_command` into a streamed command file
+    append_list*     the same kept in `recipe` until `finalize`, for its memory
+    append_many*     `append_many` of the same commands
+    append_table*    `append_table` of a dict of columns
+    append_csv*      `append_table` of a CSV file
+    dedup*           `append_many` with `dedup` where half of the commands repeat
+    sharded*         `append_sweep` of a grid in one process per core (at least two) against one process
+    table*           `append_many` into `storage='table'`, its size and the read of one line
+    finalize*        `finalize` and `slurm_finalize` of a configurator holding every size in memory
+    lookup*          fetching one line in a generated sbatch script, `sed` against the index
+"""
+from typing import List
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def peak_memory_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+def timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def slurm_arguments(tmp, commands=1):
+    from dataclasses import field, make_dataclass
+    import pipeline
+
+    global Arguments
+    SlurmArguments = pipeline.get_class('slurm.Arguments')
+    SlurmCommand = pipeline.get_class('slurm.Command')
+    # A module attribute, so that `append_sharded` can pickle the arguments for its workers
+    Arguments = make_dataclass('Arguments', [
+        (f'command_{number}', SlurmCommand, field(default_factory=lambda: SlurmCommand(
+            recipe=['python train.py', '--seed ${seed}', '--lr ${lr}', '--out ${build_path}/run_${seed}'],
+        )))
+        for number in range(commands)
+    ], bases=(SlurmArguments,))
+    Arguments.__module__ = __name__
+    return Arguments(base_path=tmp, create_if_not_exist=True)
+
+
+def mappings(size):
+    return ({'seed': seed, 'lr': 0.001 * (seed % 10)} for seed in range(size))
+
+
+def columns(size):
+    return {'seed': list(range(size)), 'lr': [0.001 * (seed % 10) for seed in range(size)]}
+
+
+def startup_cold(tmp, size, commands):
+    os.environ.pop('PIPELINE_PLUGIN_CACHE', None)
+    start = time.perf_counter()
+    import pipeline
+    pipeline.get_class('slurm.Command')
+    return {'seconds': time.perf_counter() - start}
+
+
+def startup_cached(tmp, size, commands):
+    # Another interpreter writes the index this one reads
+    code = 'import pipeline; pipeline.get_class("slurm.Command")'
+    env = {**os.environ, 'PIPELINE_PLUGIN_CACHE': os.path.join(tmp, 'plugins.json')}
+    subprocess.run([sys.executable, '-c', code], env=env, check=True)
+    os.environ['PIPELINE_PLUGIN_CACHE'] = env['PIPELINE_PLUGIN_CACHE']
+    start = time.perf_counter()
+    import pipeline
+    pipeline.get_class('slurm.Command')
+    return {'seconds': time.perf_counter() - start}
+
+
+def startup_warm(tmp, size, commands):
+    import pipeline
+    pipeline.get_class('slurm.Command')
+    calls = 100_000
+    seconds = timed(lambda: [pipeline.get_class('slurm.Command') for _ in range(calls)])
+    return {'seconds': seconds, 'items': calls}
+
+
+def arguments(tmp, size, commands):
+    from pipeline.base import BaseArguments
+
+    slurm_arguments(tmp, 1)
+    base = timed(BaseArguments, tmp)
+    slurm = timed(slurm_arguments, tmp, commands)
+    return {'seconds': slurm, 'base_seconds': base, 'items': commands}
+
+
+def merge_defaults(tmp, size, commands):
+    import pipeline
+
+    Slurm = pipeline.get_class('slurm.Slurm')
+    SlurmSBatchHeader = pipeline.get_class('slurm.SBatchHeader')
+    defaults = Slurm(
+        template='#!/bin/bash\n${header}\n${run_commands}',
+        header=SlurmSBatchHeader(mem='1gb', time='0-01:00:00', job_name_template='{name}', array_template='1-{array_size}'),
+        filename_template='{build_path}/slurm_{name}.sh',
+        pack=1,
+    )
+    value = Slurm(header=SlurmSBatchHeader(mem='4gb', cpus_per_task=4), pack=8)
+    calls = 20_000
+    seconds = timed(lambda: [pipeline.merge_defaults(value, defaults) for _ in range(calls)])
+    return {'seconds': seconds, 'items': calls}
+
+
+def append_command(tmp, size, commands):
+    args = slurm_arguments(tmp)
+    with args.command_0.build(stream=True) as script:
+        seconds = timed(lambda: [script.append_command(mapping=mapping) for mapping in mappings(size)])
+    return {'seconds': seconds, 'items': size}
+
+
+def append_list(tmp, size, commands):
+    args = slurm_arguments(tmp)
+    with args.command_0.build() as script:
+        seconds = timed(lambda: [script.append_command(mapping=mapping) for mapping in mappings(size)])
+    return {'seconds': seconds, 'items': size}
+
+
+def append_many(tmp, size, commands):
+    args = slurm_arguments(tmp)
+    with args.command_0.build(stream=True) as script:
+        seconds = timed(script.append_many, mappings(size))
+    return {'seconds': seconds, 'items': size}
+
+
+def append_table(tmp, size, commands):
+    args = slurm_arguments(tmp)
+    data = columns(size)
+    with args.command_0.build(stream=True) as script:
+        seconds = timed(script.append_table, data)
+    return {'seconds': seconds, 'items': size}
+
+
+def append_csv(tmp, size, commands):
+    import csv
+
+    args = slurm_arguments(tmp)
+    data = columns(size)
+    filename = os.path.join(tmp, 'parameters.csv')
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(data)
+        writer.writerows(zip(*data.values()))
+    with args.command_0.build(stream=True) as script:
+        seconds = timed(script.append_table, filename)
+    return {'seconds': seconds, 'items': size}
+
+
+def dedup(tmp, size, commands):
+    args = slurm_arguments(tmp)
+    distinct = max(1, size // 2)
+    with args.command_0.build(stream=True, dedup=True) as script:
+        seconds = timed(script.append_many, ({'seed': seed % distinct, 'lr': 0.001} for seed in range(size)))
+    return {'seconds': seconds, 'items': size, 'distinct': script.num_commands}
+
+
+def sharded(tmp, size, commands):
+    import hashlib
+    import pipeline
+
+    Sweep = pipeline.get_class('shell_templates.Sweep')
+    sweep = Sweep('grid', {'seed': list(range(max(1, size // 10))), 'lr': [10 ** -i for i in range(10)]})
+    args = slurm_arguments(tmp)
+    result = {'items': len(sweep), 'processes': max(2, os.cpu_count() or 1)}
+    digests = []
+    for name, processes in (('serial', None), ('sharded', result['processes'])):
+        with args.command_0.build(stream=True, write_index=True) as script:
+            result[f'{name}_seconds'] = timed(script.append_sweep, sweep, processes)
+        with open(script.filename, 'rb') as file:
+            digests.append(hashlib.sha256(file.read()).hexdigest())
+    # Shards must give the same command file as a single process
+    result['identical'] = digests[0] == digests[1]
+    result['seconds'] = result['sharded_seconds']
+    return result
+
+
+def table(tmp, size, commands):
+    from shell_templates.table import read_line
+
+    args = slurm_arguments(tmp)
+    with args.command_0.build(stream=True, write_index=True) as lines:
+        lines.append_many(mappings(size))
+    with args.command_0.build(storage='table') as script:
+        seconds = timed(script.append_many, mappings(size))
+
+    samples = 200
+    numbers = [random.randint(1, size) for _ in range(samples)]
+    read = timed(lambda: [read_line(script.filename, number) for number in numbers])
+    return {
+        'seconds': seconds,
+        'items': size,
+        'read_us': read / samples * 1e6,
+        'disk_mb': os.path.getsize(script.filename) / (1 << 20),
+        'lines_disk_mb': (os.path.getsize(lines.filename) + os.path.getsize(lines.index_filename)) / (1 << 20),
+    }
+
+
+def finalize(tmp, size, commands):
+    from shell_templates.shell_templates import ShellTemplatesCommandConfigurator
+
+    args = slurm_arguments(tmp)
+    script = args.command_0.build()
+    script.append_many(mappings(size))
+    command_file = timed(ShellTemplatesCommandConfigurator.finalize, script)
+    sbatch = timed(script.slurm_finalize)
+    return {'seconds': command_file + sbatch, 'finalize_seconds': command_file, 'slurm_finalize_seconds': sbatch, 'items': size}
+
+
+def lookup(tmp, size, commands):
+    args = slurm_arguments(tmp)
+    samples = 20
+    result = {'items': samples}
+    for name, index in (('sed', False), ('index', True)):
+        with args.command_0.build(stream=True, write_index=index) as script:
+            script.append_many(mappings(size))
+        # The last line is the worst case for a scan
+        fetch = script.fetch_command_string(size, python=sys.executable)
+        seconds = timed(lambda: [subprocess.run(['bash', '-c', fetch], stdout=subprocess.DEVNULL, check=True) for _ in range(samples)])
+        result[f'{name}_seconds'] = seconds
+    result['seconds'] = result['index_seconds']
+    return result
+
+
+SCENARIOS = {
+    'startup_cold': (startup_cold, False),
+    'startup_cached': (startup_cached, False),
+    'startup_warm': (startup_warm, False),
+    'arguments': (arguments, False),
+    'merge_defaults': (merge_defaults, False),
+    'append_command': (append_command, True),
+    'append_list': (append_list, True),
+    'append_many': (append_many, True),
+    'append_table': (append_table, True),
+    'append_csv': (append_csv, True),
+    'dedup': (dedup, True),
+    'sharded': (sharded, True),
+    'table': (table, True),
+    'finalize': (finalize, True),
+    'lookup': (lookup, True),
+}
+
+
+def run_child(name, size, commands):
+    function, _ = SCENARIOS[name]
+    with tempfile.TemporaryDirectory() as tmp:
+        result = function(tmp, size, commands)
+    result['peak_memory_mb'] = peak_memory_mb()
+    print(json.dumps(result))
+
+
+def run_scenario(name, size, commands, repeat) -> dict:
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', name, '--size', str(size), '--commands', str(commands)],
+            stdout=subprocess.PIPE, check=True, text=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    best = min(runs, key=lambda run: run['seconds'])
+    result = {'scenario': name, 'size': size if SCENARIOS[name][1] else None, **best}
+    result['peak_memory_mb'] = max(run['peak_memory_mb'] for run in runs)
+    if result.get('items'):
+        result['items_per_second'] = result['items'] / result['seconds']
+    return result
+
+
+def key(result) -> str:
+    return result['scenario'] if result['size'] is None else f'{result["scenario"]}[{result["size"]}]'
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'commit': commit or None,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results: List[dict], baseline: dict, threshold: float) -> List[str]:
+    """
+    Prints every result against the baseline, returns the keys slower or bigger than `threshold`.
+    """
+    previous = {key(result): result for result in baseline['results']}
+    regressions = []
+    print(f'{"scenario":>24} {"seconds":>10} {"baseline":>10} {"ratio":>7} {"memory MB":>10} {"baseline":>10}')
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            print(f'{key(result):>24} {result["seconds"]:>10.4f} {"-":>10}')
+            continue
+        ratio = result['seconds'] / old['seconds'] if old['seconds'] else float('inf')
+        memory_ratio = result['peak_memory_mb'] / old['peak_memory_mb'] if old['peak_memory_mb'] else 1
+        flag = ''
+        # Differences below a millisecond are timer noise
+        slower = ratio > 1 + threshold and result['seconds'] - old['seconds'] > 1e-3
+        if slower or memory_ratio > 1 + threshold:
+            regressions.append(key(result))
+            flag = ' REGRESSION'
+        print(f'{key(result):>24} {result["seconds"]:>10.4f} {old["seconds"]:>10.4f} {ratio:>7.2f}'
+              f' {result["peak_memory_mb"]:>10.1f} {old["peak_memory_mb"]:>10.1f}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--commands', type=int, default=500, help='Commands of SlurmArguments in `arguments`')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None, help='Write results as JSON, e.g. to save a baseline')
+    parser.add_argument('--baseline', default=None, help='Results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative slowdown reported as a regression')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, default=0, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child is not None:
+        return run_child(options.child, options.size, options.commands)
+
+    results = []
+    for name in options.scenarios:
+        for size in (options.sizes if SCENARIOS[name][1] else [None]):
+            result = run_scenario(name, size or 0, options.commands, options.repeat)
+            results.append(result)
+            print(f'{key(result):>24} {result["seconds"]:>10.4f} s {result["peak_memory_mb"]:>8.1f} MB', file=sys.stderr)
+
+    report = {'environment': environment(), 'results': results}
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(report, file, indent=1)
+
+    if options.baseline:
+        with open(options.baseline) as file:
+            regressions = compare(results, json.load(file), options.threshold)
+        if regressions:
+            print(f'Regressions: {", ".join(regressions)}', file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,5 @@
-from .plugin_manager import register_class, get_class, get_all_classes
+from .plugin_manager import register_class, get_class, get_all_classes, load_plugins
+from .merge import merge_defaults
 import pathlib
 import yaml
 
@@ -15,4 +16,4 @@ yaml.add_representer(pathlib.PosixPath, represent_posixpath)
 # globals().update(_registered_classes)
 
 # Expose the register_class function to allow users to add their own classes
-__all__ = ['register_class', 'get_class', 'get_all_classes', 'load_plugins']
+__all__ = ['register_class', 'get_class', 'get_all_classes', 'load_plugins', 'merge_defaults']
@@ -1,9 +1,14 @@
 from typing import Optional, List, Dict
+from contextlib import contextmanager
 from dataclasses import dataclass, field, asdict
 from pathlib import Path, PosixPath
+import threading
 import yaml
 from datetime import datetime
 
+from .manifest import BuildManifest, digest_bytes, digest_json
+from . import events
+
 
 @dataclass
 class BaseArguments:
@@ -31,6 +36,15 @@ class BaseArguments:
     # If False, the code will raise a FileNotFoundError if these directories do not exist.
     create_if_not_exist: bool = False
 
+    # If True, generated files are only rewritten when their content changes and
+    # their digests are kept in the build manifest. Without `build_dir` the build
+    # directory name is derived from the configuration instead of the current time.
+    incremental: bool = False
+
+    # Optional file name inside build_dir. If provided, timing events of the build
+    # are collected while it runs and written there as a Chrome trace after every build.
+    trace_name: Optional[str] = None
+
     @property
     def build_path(self):
         return self.base_path / self.build_dir
@@ -47,8 +61,91 @@ class BaseArguments:
             return None
         return self.build_path / self.save_main_script_name
 
+    @property
+    def trace_path(self):
+        if self.trace_name is None:
+            return None
+        return self.build_path / self.trace_name
+
+    @property
+    def manifest(self) -> Optional[BuildManifest]:
+        if not self.incremental:
+            return None
+        if getattr(self, '_manifest', None) is None or self._manifest.build_path != self.build_path:
+            self._manifest = BuildManifest(self.build_path)
+        return self._manifest
+
+    def __getstate__(self):
+        # Manifests and trace collectors hold locks, a copy in another process opens its own
+        state = dict(self.__dict__)
+        state.pop('_manifest', None)
+        state.pop('_trace', None)
+        state.pop('_trace_lock', None)
+        return state
+
+    @contextmanager
+    def tracing(self):
+        """
+        Collects the events of the block into the trace of the build directory.
+
+        Blocks may nest and overlap across threads, the collector is registered
+        while any of them runs and the trace is rewritten when the last one ends.
+        Copies in other processes do not trace, `build_all` collects the events
+        of its worker processes itself.
+        """
+        trace = getattr(self, '_trace', None)
+        if trace is None:
+            yield
+            return
+
+        with self._trace_lock:
+            self._trace_depth += 1
+            if self._trace_depth == 1:
+                events.add_handler(trace)
+        try:
+            yield
+        finally:
+            with self._trace_lock:
+                self._trace_depth -= 1
+                if not self._trace_depth:
+                    events.remove_handler(trace)
+                    trace.write(self.trace_path)
+
+    def _write_generated(self, path, data: bytes):
+        manifest = self.manifest
+        if manifest is not None and manifest.is_current(path, digest_bytes(data)):
+            return
+
+        if path.exists() and not self.do_overwrite:
+            raise FileExistsError(f"{path} already exists. Set `do_overwrite=True` to overwrite it.")
+
+        if manifest is None:
+            path.write_bytes(data)
+        else:
+            manifest.write_bytes(path, data)
+
     
     def __post_init__(self):
+        if self.trace_name is not None:
+            self._trace = events.TraceCollector()
+            self._trace_lock = threading.Lock()
+            self._trace_depth = 0
+
+        with self.tracing():
+            with events.span('arguments.post_init', arguments=type(self).__name__):
+                self._post_init_paths()
+
+            # Handle the overwrite logic, an incremental build may regenerate identical files
+            if self.config_path:
+                with events.span('arguments.save_config'):
+                    self._write_generated(self.config_path, yaml.dump(asdict(self)).encode())
+
+        if self.main_script_path:
+            from sys import argv
+            
+            self._write_generated(self.main_script_path, Path(argv[0]).resolve().read_bytes())
+
+    def _post_init_paths(self):
         # Ensure base_path is a Path object, in case a string is provided
         if not isinstance(self.base_path, Path):
             self.base_path = Path(self.base_path)
@@ -62,6 +159,9 @@ class BaseArguments:
                 self.base_path.mkdir(parents=True, exist_ok=True)
         
         # Generate a build directory name based on the current date and time if not provided
+        if not self.build_dir and self.incremental:
+            self.build_dir = f'build_{digest_json(asdict(self))[:12]}'
+
         if not self.build_dir:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             self.build_dir = f'build_{timestamp}'
@@ -72,22 +172,3 @@ class BaseArguments:
             else:
                 # Create build_dir if create_if_not_exist is True
                 self.build_path.mkdir(parents=True, exist_ok=True)
-
-        # Handle the overwrite logic
-        if self.config_path and self.config_path.exists() and not self.do_overwrite:
-            raise FileExistsError(f"{self.config_path} already exists. Set `do_overwrite=True` to overwrite it.")
-
-        if self.config_path:
-            with open(self.config_path, 'w') as file:
-                yaml.dump(asdict(self), file)
-
-        if self.main_script_path and self.main_script_path.exists() and not self.do_overwrite:
-            raise FileExistsError(f"{self.main_script_path} already exists. Set `do_overwrite=True` to overwrite it.")
-
-        if self.main_script_path:
-            from shutil import copyfile
-            from sys import argv
-            
-            copyfile(Path(argv[0]).resolve(), self.main_script_path)
-        
-    
\ No newline at end of file
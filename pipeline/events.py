@@ -0,0 +1,187 @@
+"""
+Timing events of the build lifecycle.
+
+Core and plugins wrap their key steps in `span(name, ...)`. Without handlers
+`span` returns a shared no-op object, so instrumented code costs one global
+lookup when tracing is off. `TraceCollector` is the built-in handler writing
+a Chrome trace (chrome://tracing, Perfetto) with a per-event summary.
+
+Set `PIPELINE_TRACE=/path/to/trace.json` to trace a whole process including
+plugin loading, or `trace_name` of the arguments to trace into the build directory.
+"""
+from typing import Callable, Dict, List, NamedTuple, Optional
+from pathlib import Path
+import atexit
+import json
+import os
+import threading
+import time
+
+
+TRACE_ENVIRONMENT_VARIABLE = 'PIPELINE_TRACE'
+
+
+class Event(NamedTuple):
+    name: str
+
+    # Seconds since the epoch
+    start: float
+
+    duration: float
+
+    # Number of items processed, e.g. commands appended
+    count: int
+
+    attributes: dict
+
+    thread: int
+
+
+_handlers: List[Callable[[Event], None]] = []
+
+
+def add_handler(handler: Callable[[Event], None]):
+    if handler not in _handlers:
+        _handlers.append(handler)
+
+
+def remove_handler(handler: Callable[[Event], None]):
+    if handler in _handlers:
+        _handlers.remove(handler)
+
+
+def enabled() -> bool:
+    return bool(_handlers)
+
+
+def emit(name: str, start: float, duration: float = 0.0, count: int = 1, /, **attributes):
+    event = Event(name, start, duration, count, attributes, threading.get_ident())
+    for handler in list(_handlers):
+        handler(event)
+
+
+class Span:
+    """
+    Measures the duration of a `with` block, `count` and `attributes` can be updated inside it.
+    """
+
+    __slots__ = ('name', 'count', 'attributes', '_start', '_clock')
+
+    def __init__(self, name: str, count: int = 1, /, **attributes):
+        self.name = name
+        self.count = count
+        self.attributes = attributes
+
+    def __enter__(self):
+        self._start = time.time()
+        self._clock = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self._clock
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        emit(self.name, self._start, duration, self.count, **self.attributes)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    count = 0
+
+    @property
+    def attributes(self):
+        return {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str, /, count: int = 1, **attributes):
+    if not _handlers:
+        return _NULL_SPAN
+    return Span(name, count, **attributes)
+
+
+class TraceCollector:
+    """
+    Keeps events in memory and writes them as a Chrome trace with a `summary` per event name.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.events: List[Event] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Event):
+        with self._lock:
+            self.events.append(event)
+
+    def summary(self) -> Dict[str, dict]:
+        summary = {}
+        for event in self.events:
+            entry = summary.setdefault(event.name, {'calls': 0, 'count': 0, 'seconds': 0.0})
+            entry['calls'] += 1
+            entry['count'] += event.count
+            entry['seconds'] += event.duration
+        return summary
+
+    def trace(self) -> dict:
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+        return {
+            'traceEvents': [
+                {
+                    'name': event.name,
+                    'cat': event.name.split('.')[0],
+                    'ph': 'X',
+                    'ts': event.start * 1e6,
+                    'dur': event.duration * 1e6,
+                    'pid': pid,
+                    'tid': event.thread,
+                    'args': {'count': event.count, **{key: str(value) for key, value in event.attributes.items()}},
+                }
+                for event in events
+            ],
+            'displayTimeUnit': 'ms',
+            'summary': self.summary(),
+        }
+
+    def write(self, filename=None) -> Optional[Path]:
+        filename = filename or self.filename
+        if filename is None or not self.events:
+            return None
+        filename = Path(filename)
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        temporary = filename.with_name(f'.{filename.name}.{os.getpid()}.tmp')
+        temporary.write_text(json.dumps(self.trace()))
+        os.replace(temporary, filename)
+        return filename
+
+    def start(self) -> 'TraceCollector':
+        """
+        Registers the collector and writes the trace when the interpreter exits.
+        """
+        add_handler(self)
+        atexit.register(self.write)
+        return self
+
+    def stop(self) -> Optional[Path]:
+        remove_handler(self)
+        atexit.unregister(self.write)
+        return self.write()
+
+
+if os.environ.get(TRACE_ENVIRONMENT_VARIABLE):
+    TraceCollector(os.environ[TRACE_ENVIRONMENT_VARIABLE]).start()
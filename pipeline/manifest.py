@@ -0,0 +1,231 @@
+from typing import Optional, Union
+from pathlib import Path
+import fcntl
+import hashlib
+import json
+import os
+import threading
+
+
+def digest_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def digest_json(data) -> str:
+    """
+    Digest of a JSON serializable value, keys are sorted and unknown types converted with `str`.
+    """
+    return digest_bytes(json.dumps(data, sort_keys=True, default=str).encode())
+
+
+class FileLock:
+    """
+    Exclusive `flock` on `path` for the duration of a `with` block, shared between processes.
+
+    The file is created if needed and never removed, so every process locks the same inode.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = path
+        self.descriptor = None
+
+    def __enter__(self):
+        self.descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self.descriptor, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self.descriptor, fcntl.LOCK_UN)
+        os.close(self.descriptor)
+        self.descriptor = None
+        return False
+
+
+class BuildManifest:
+    """
+    Content digests of the files generated in a build directory.
+
+    Files are written through the manifest into a temporary file while being
+    hashed and only replace the existing file when the digest changed, so
+    regenerating an unchanged build leaves files and their mtimes untouched.
+
+    Several processes may write into one build: `save` merges the entries this
+    manifest changed into the file on disk under a file lock.
+    """
+
+    filename = 'manifest.json'
+
+    sections = ('files', 'inputs', 'extra')
+
+    def __init__(self, build_path: Union[str, Path]):
+        self.build_path = Path(build_path)
+        self.path = self.build_path / self.filename
+        self._lock = threading.RLock()
+        self.reload()
+
+    def _read(self) -> dict:
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def reload(self):
+        with self._lock:
+            data = self._read()
+            self.files = data.get('files', {})
+            self.inputs = data.get('inputs', {})
+            self.extra = data.get('extra', {})
+            self._changed = {section: set() for section in self.sections}
+
+    def _mark(self, section: str, key: str):
+        self._changed[section].add(key)
+
+    def _key(self, path) -> str:
+        path = Path(path)
+        try:
+            return str(path.relative_to(self.build_path))
+        except ValueError:
+            return str(path)
+
+    def save(self):
+        with self._lock:
+            with FileLock(self.path.with_name(f'.{self.path.name}.lock')):
+                # Entries written by other processes since `reload` are kept
+                data = self._read()
+                for section in self.sections:
+                    merged = data.get(section, {})
+                    own = getattr(self, section)
+                    for key in self._changed[section]:
+                        if key in own:
+                            merged[key] = own[key]
+                        else:
+                            merged.pop(key, None)
+                    setattr(self, section, merged)
+                    self._changed[section].clear()
+
+                text = json.dumps({section: getattr(self, section) for section in self.sections}, indent=1, sort_keys=True)
+                temporary = self.path.with_name(f'.{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+                temporary.write_text(text)
+                os.replace(temporary, self.path)
+
+    def is_current(self, path, digest: str) -> bool:
+        """
+        True if `path` exists and was written by the manifest with the same `digest`.
+        """
+        record = self.files.get(self._key(path))
+        return record is not None and record['digest'] == digest and self.is_intact(path)
+
+    def commit(self, path, temporary, digest: str) -> bool:
+        """
+        Moves `temporary` to `path` unless the content is unchanged, returns whether `path` changed.
+        """
+        path = Path(path)
+        if self.is_current(path, digest):
+            os.unlink(temporary)
+            return False
+
+        os.replace(temporary, path)
+        with self._lock:
+            self.files[self._key(path)] = {'digest': digest, 'size': os.stat(path).st_size}
+            self._mark('files', self._key(path))
+        self.save()
+        return True
+
+    def is_intact(self, path) -> bool:
+        """
+        True if `path` still has the size recorded when the manifest wrote it.
+        """
+        record = self.files.get(self._key(path))
+        try:
+            return record is not None and os.stat(path).st_size == record['size']
+        except OSError:
+            return False
+
+    def forget(self, path):
+        with self._lock:
+            self.files.pop(self._key(path), None)
+            self.inputs.pop(self._key(path), None)
+            self._mark('files', self._key(path))
+            self._mark('inputs', self._key(path))
+        self.save()
+
+    def open(self, path, buffering: int = -1) -> 'ManifestFile':
+        return ManifestFile(self, path, buffering)
+
+    def write_bytes(self, path, data: bytes) -> bool:
+        with self.open(path) as file:
+            file.write(data)
+        return file.changed
+
+    def write_text(self, path, text: str, encoding: str = 'utf-8') -> bool:
+        return self.write_bytes(path, text.encode(encoding))
+
+    def get_input(self, path) -> Optional[dict]:
+        return self.inputs.get(self._key(path))
+
+    def forget_input(self, path):
+        if self._key(path) in self.inputs:
+            with self._lock:
+                self.inputs.pop(self._key(path), None)
+                self._mark('inputs', self._key(path))
+            self.save()
+
+    def set_input(self, path, key: str, **values):
+        with self._lock:
+            self.inputs[self._key(path)] = {'key': key, **values}
+            self._mark('inputs', self._key(path))
+        self.save()
+
+    def get_extra(self, key: str, default=None):
+        return self.extra.get(key, default)
+
+    def set_extra(self, key: str, value):
+        """
+        Stores JSON serializable data of plugins, e.g. job IDs of a submission.
+        """
+        with self._lock:
+            self.extra[key] = value
+            self._mark('extra', key)
+        self.save()
+
+
+class ManifestFile:
+    """
+    Binary file hashed while written, committed to the manifest on close.
+    """
+
+    def __init__(self, manifest: BuildManifest, path, buffering: int = -1):
+        self.manifest = manifest
+        self.path = Path(path)
+        self.temporary = self.path.with_name(f'.{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        self.changed = None
+
+        self._hash = hashlib.sha256()
+        self._file = open(self.temporary, 'wb', buffering=buffering)
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def write(self, data: bytes):
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        self.changed = self.manifest.commit(self.path, self.temporary, self._hash.hexdigest())
+
+    def discard(self):
+        if not self._file.closed:
+            self._file.close()
+            os.unlink(self.temporary)
+        self.changed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,99 @@
+from typing import Dict, Tuple, Type
+from dataclasses import fields, is_dataclass
+import threading
+
+
+class MergePlan:
+    """
+    Fields of a dataclass type split into constructor arguments and `init=False` fields.
+
+    Plans are compiled once per type and shared, see `merge_plan`.
+    """
+
+    def __init__(self, cls: Type):
+        if not is_dataclass(cls):
+            raise TypeError(f'{cls.__qualname__} is not a dataclass')
+
+        self.cls = cls
+        self.init_fields: Tuple[str, ...] = tuple(f.name for f in fields(cls) if f.init)
+        self.other_fields: Tuple[str, ...] = tuple(f.name for f in fields(cls) if not f.init)
+
+    def merge(self, value, defaults, path: str = ''):
+        # Defaults may also be an instance of a base class of the value
+        if not is_dataclass(defaults) or not isinstance(value, type(defaults)) and not isinstance(defaults, self.cls):
+            raise TypeError(f'{path or "value"}: cannot take defaults of {self.cls.__qualname__} from {type(defaults).__qualname__}')
+
+        kwargs = {}
+        for name in self.init_fields:
+            kwargs[name] = _merge_value(getattr(value, name), getattr(defaults, name, None), f'{path}.{name}' if path else name)
+
+        try:
+            result = self.cls(**kwargs)
+        except TypeError as ex:
+            raise TypeError(f'{path or "value"}: cannot rebuild {self.cls.__qualname__}: {ex}') from ex
+
+        for name in self.other_fields:
+            if hasattr(value, name):
+                object.__setattr__(result, name, getattr(value, name))
+        return result
+
+
+_plans: Dict[Type, MergePlan] = {}
+_plans_lock = threading.Lock()
+
+
+def merge_plan(cls: Type) -> MergePlan:
+    plan = _plans.get(cls)
+    if plan is None:
+        with _plans_lock:
+            plan = _plans.setdefault(cls, MergePlan(cls))
+    return plan
+
+
+def _copy_default(default, path):
+    # Values taken from defaults must not be shared between the merged objects
+    if is_dataclass(default) and not isinstance(default, type):
+        return merge_plan(type(default)).merge(default, default, path)
+    if isinstance(default, dict):
+        return {key: _copy_default(item, f'{path}.{key}') for key, item in default.items()}
+    if isinstance(default, list):
+        return list(default)
+    return default
+
+
+def _merge_value(value, default, path):
+    if value is None:
+        return _copy_default(default, path)
+
+    if default is None:
+        return value
+
+    if is_dataclass(value) and not isinstance(value, type):
+        return merge_plan(type(value)).merge(value, default, path)
+
+    if isinstance(value, dict):
+        if not isinstance(default, dict):
+            raise TypeError(f'{path}: cannot take defaults of dict from {type(default).__qualname__}')
+        merged = dict(value)
+        for key, item in default.items():
+            merged[key] = _merge_value(merged.get(key), item, f'{path}.{key}')
+        return merged
+
+    if is_dataclass(default) or isinstance(default, dict):
+        raise TypeError(f'{path}: cannot take defaults of {type(value).__qualname__} from {type(default).__qualname__}')
+
+    return value
+
+
+def merge_defaults(value, defaults):
+    """
+    New dataclass with the fields of `value` that are None taken from `defaults`.
+
+    Nested dataclasses and dicts are merged recursively, other values are kept
+    as they are. Only the dataclass and dict containers are copied, so merging
+    costs a constructor call per dataclass instead of a deep copy. A default
+    whose structure does not match the value raises `TypeError` naming the field.
+    """
+    if value is None:
+        return _copy_default(defaults, '')
+    return merge_plan(type(value)).merge(value, defaults)
@@ -1,28 +1,125 @@
 # my_library/plugin_manager.py
+import importlib
+import json
+import os
+import sys
 
-# A dictionary to store registered plugins, now supporting any kind of class
-_registered_classes = None
+from . import events
 
-def __load_all_plugins(force_reload=False):
+ENTRY_POINT_GROUP = 'pipeline.plugins'
+
+# Set to a file path to keep an index of plugin entry points between runs.
+# The index is rebuilt whenever a directory on `sys.path` changes, i.e. when
+# distributions are installed or removed.
+CACHE_ENVIRONMENT_VARIABLE = 'PIPELINE_PLUGIN_CACHE'
+
+# Classes already resolved from entry points
+_registered_classes = {}
+
+# Classes registered with `register_class`, they take precedence over entry points
+_user_classes = {}
+
+# Entry point name -> 'module:attribute', filled on the first lookup
+_entry_points = None
+
+
+def _scan_entry_points():
+    from importlib import metadata
+
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        entry_points = entry_points.select(group=ENTRY_POINT_GROUP)
+    else:
+        entry_points = entry_points.get(ENTRY_POINT_GROUP, [])
+
+    return {entry_point.name: entry_point.value for entry_point in entry_points}
+
+
+def _environment_key():
     """
-    Load plugins from entry points and combine with user-registered classes.
-    This function supports any class type, not just subclasses of MyBaseClass.
+    Identifies the installed distributions by modification times of the `sys.path`
+    entries holding them.
+
+    The working directory and directories without `*.dist-info` or `*.egg-info`,
+    like the directory of the running script, change without installing anything.
     """
-    import pkg_resources
+    cwd = os.getcwd()
+    state = []
+    for path in sys.path:
+        if not path or os.path.abspath(path) == cwd:
+            continue
+        try:
+            if os.path.isdir(path) and not _has_distributions(path):
+                continue
+            state.append([path, os.stat(path).st_mtime_ns])
+        except OSError:
+            state.append([path, None])
+    return state
+
+
+def _has_distributions(path) -> bool:
+    with os.scandir(path) as entries:
+        return any(entry.name.endswith(('.dist-info', '.egg-info')) for entry in entries)
+
+
+def _read_index(filename, key):
+    try:
+        with open(filename) as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if index.get('key') != key:
+        return None
+    return index.get('entry_points')
+
+
+def _write_index(filename, key, entry_points):
+    directory = os.path.dirname(os.path.abspath(filename))
+    try:
+        os.makedirs(directory, exist_ok=True)
+        temporary = f'{filename}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump({'key': key, 'entry_points': entry_points}, file)
+        os.replace(temporary, filename)
+    except OSError:
+        # The index is only an optimization
+        pass
 
-    global _registered_classes
 
-    if not _registered_classes is None and not force_reload:
+def __discover_plugins(force_reload=False):
+    """
+    Collect plugin entry points without importing them.
+    """
+    global _entry_points
+
+    if _entry_points is not None and not force_reload:
         return
-        
-    _registered_classes = {}
 
-    for entry_point in pkg_resources.iter_entry_points(group='pipeline.plugins'):
-        plugin_class = entry_point.load()
-        # Use the entry point name as the key for the class
-        _registered_classes[entry_point.name] = plugin_class
-    
-    return _registered_classes
+    if force_reload:
+        _registered_classes.clear()
+
+    with events.span('plugin.discover') as span:
+        cache = os.environ.get(CACHE_ENVIRONMENT_VARIABLE)
+        if cache:
+            key = _environment_key()
+            entry_points = None if force_reload else _read_index(cache, key)
+            if entry_points is None:
+                entry_points = _scan_entry_points()
+                _write_index(cache, key, entry_points)
+        else:
+            entry_points = _scan_entry_points()
+        span.count = len(entry_points)
+
+    _entry_points = entry_points
+
+
+def _load_entry_point(value):
+    module, _, attributes = value.partition(':')
+    obj = importlib.import_module(module.strip())
+    for attribute in filter(None, attributes.strip().split('.')):
+        obj = getattr(obj, attribute)
+    return obj
 
 
 def register_class(name, class_obj):
@@ -30,22 +127,42 @@ def register_class(name, class_obj):
     Allows users or plugins to manually register their own classes.
     No subclass restriction; any class can be registered.
     """
-    _registered_classes[name] = class_obj
+    _user_classes[name] = class_obj
+
 
 def get_class(name, force_reload=False):
     """
-    Retrieve a class by name.
+    Retrieve a class by name, importing only the plugin module that defines it.
     """
+    if name in _user_classes:
+        return _user_classes[name]
+
+    __discover_plugins(force_reload=force_reload)
 
-    __load_all_plugins(force_reload=force_reload)
-    
-    return _registered_classes.get(name)
+    if name not in _registered_classes:
+        if name not in _entry_points:
+            return None
+        with events.span('plugin.load', plugin=name):
+            _registered_classes[name] = _load_entry_point(_entry_points[name])
 
-def get_all_classes(name, force_reload=False):
+    return _registered_classes[name]
+
+
+def get_all_classes(name=None, force_reload=False):
     """
     Return all registered classes.
     """
 
-    __load_all_plugins(force_reload=force_reload)
-    
-    return _registered_classes
+    __discover_plugins(force_reload=force_reload)
+
+    for entry_point_name in _entry_points:
+        get_class(entry_point_name)
+
+    return {**_registered_classes, **_user_classes}
+
+
+def load_plugins(force_reload=False):
+    """
+    Import every plugin and return all registered classes.
+    """
+    return get_all_classes(force_reload=force_reload)
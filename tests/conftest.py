@@ -0,0 +1,26 @@
+from dataclasses import field, make_dataclass
+
+import pytest
+
+import pipeline
+
+
+@pytest.fixture
+def arguments(tmp_path):
+    """
+    Returns a function building `slurm.Arguments` with the given `slurm.Command` fields in `tmp_path`.
+    """
+    SlurmArguments = pipeline.get_class('slurm.Arguments')
+    SlurmCommand = pipeline.get_class('slurm.Command')
+
+    def make(**commands):
+        global Arguments
+        # A module attribute, so that `append_sharded` can pickle the arguments for its workers
+        Arguments = make_dataclass('Arguments', [
+            (name, SlurmCommand, field(default_factory=lambda command=command: command))
+            for name, command in commands.items()
+        ], bases=(SlurmArguments,))
+        Arguments.__module__ = __name__
+        return Arguments(base_path=tmp_path, build_dir='build', create_if_not_exist=True)
+
+    return make
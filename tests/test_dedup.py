@@ -0,0 +1,104 @@
+import pytest
+
+import pipeline
+from shell_templates.dedup import DedupWriter, DigestTable, count_logical, main, map_filename_for, read_mapping
+from shell_templates.table import TableWriter, iter_rows
+from shell_templates.writer import CommandFileWriter
+
+
+COMMANDS = ['echo a', 'echo b', 'echo a', 'echo c', 'echo b', 'echo a']
+
+
+def test_digest_table_grows():
+    digests = DigestTable(capacity=4)
+    for number in range(1000):
+        assert digests.setdefault(number * 7919, number) == number
+    assert digests.size == 1000
+    assert [digests.setdefault(number * 7919, 0) for number in range(1000)] == list(range(1000))
+
+
+def test_digest_collisions_are_told_apart():
+    digests = DigestTable()
+    assert digests.setdefault(42, 1) == 1
+    assert digests.setdefault(42, 2, lambda line: False) == 2
+    assert digests.setdefault(42, 3, lambda line: line == 2) == 2
+    assert digests.size == 2
+
+
+def test_lines_are_written_once(tmp_path):
+    filename = tmp_path / 'commands.sh'
+    with DedupWriter(CommandFileWriter(filename), map_filename_for(filename)) as writer:
+        writer.write(COMMANDS[0])
+        writer.write_many(COMMANDS[1:])
+
+    assert writer.count == 3
+    assert writer.logical_count == len(COMMANDS)
+    assert filename.read_text() == 'echo a\necho b\necho c'
+    map_filename = map_filename_for(filename)
+    assert count_logical(map_filename) == len(COMMANDS)
+    assert read_mapping(map_filename, 1, len(COMMANDS)) == [1, 2, 1, 3, 2, 1]
+    assert read_mapping(map_filename, 4) == [3]
+
+
+@pytest.mark.parametrize('first, last', [(0, None), (3, 2), (len(COMMANDS) + 1, None)])
+def test_invalid_commands_raise(tmp_path, first, last):
+    filename = tmp_path / 'commands.sh'
+    with DedupWriter(CommandFileWriter(filename), map_filename_for(filename)) as writer:
+        writer.write_many(COMMANDS)
+
+    with pytest.raises(IndexError):
+        read_mapping(map_filename_for(filename), first, last)
+
+
+def test_table_rows_are_written_once(tmp_path):
+    filename = tmp_path / 'commands.table'
+    table = TableWriter(filename, format_string='echo {x} {y}', keys=('x', 'y'), block_size=2)
+    with DedupWriter(table, map_filename_for(filename)) as writer:
+        # Rows are compared value by value, not by their joined text
+        writer.write_rows([('1', '2'), ('1', '2'), ('12', ''), ('1', '2 ')])
+
+    assert list(iter_rows(filename)) == [('1', '2'), ('12', ''), ('1', '2 ')]
+    assert read_mapping(map_filename_for(filename), 1, 4) == [1, 1, 2, 3]
+
+
+def test_shards_are_deduplicated(tmp_path):
+    shard = tmp_path / 'shard.sh'
+    with CommandFileWriter(shard) as writer:
+        writer.write_many(COMMANDS[2:])
+    filename = tmp_path / 'commands.sh'
+    with DedupWriter(CommandFileWriter(filename), map_filename_for(filename)) as writer:
+        writer.write_many(COMMANDS[:2])
+        writer.write_shard(shard, len(COMMANDS) - 2, chunk_size=5)
+
+    assert filename.read_text() == 'echo a\necho b\necho c'
+    assert read_mapping(map_filename_for(filename), 1, len(COMMANDS)) == [1, 2, 1, 3, 2, 1]
+
+
+def test_main_prints_lines(tmp_path, capsys):
+    filename = tmp_path / 'commands.sh'
+    with DedupWriter(CommandFileWriter(filename), map_filename_for(filename)) as writer:
+        writer.write_many(COMMANDS)
+
+    assert main([map_filename_for(str(filename)), '2', '3']) == 0
+    assert capsys.readouterr().out == '2\n1\n'
+
+
+@pytest.mark.parametrize('storage', ['lines', 'table'])
+def test_build_counts_distinct_commands(arguments, storage):
+    SlurmCommand = pipeline.get_class('slurm.Command')
+    args = arguments(train=SlurmCommand(recipe=['echo ${seed}'], storage=storage, dedup=True))
+    with args.train.build(stream=True) as script:
+        script.append_many({'seed': seed % 10} for seed in range(25))
+        script.append_command(mapping={'seed': 3})
+
+    assert script.num_commands == 10
+    assert script.duplicates == 16
+    assert read_mapping(map_filename_for(script.filename), 24, 26) == [4, 5, 4]
+
+
+def test_dedup_cannot_append(arguments):
+    SlurmCommand = pipeline.get_class('slurm.Command')
+    args = arguments(train=SlurmCommand(recipe=['echo ${seed}'], dedup=True))
+    with pytest.raises(ValueError, match='cannot be appended'):
+        with args.train.build(stream=True, open_mode='a') as script:
+            script.append_command(mapping={'seed': 1})
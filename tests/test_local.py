@@ -0,0 +1,103 @@
+import os
+import sys
+
+import pytest
+
+import pipeline
+from slurm.local import LocalExecutor, main
+from slurm.status import read_status
+
+
+def write_script(path, body, *options):
+    path.write_text('\n'.join(['#!/bin/bash', *(f'#SBATCH --{option}' for option in options), body, '']))
+    return path
+
+
+def test_tasks_follow_sbatch_options(tmp_path):
+    script = write_script(
+        tmp_path / 'job.sh', 'true',
+        'job-name=train', 'array=1-3,7%2', 'cpus-per-task=2', 'mem-per-cpu=1G', f'output={tmp_path}/logs/%x_%A_%a.out',
+    )
+    tasks = LocalExecutor().tasks(script, job_id='42')
+
+    assert [task.task_id for task in tasks] == [1, 2, 3, 7]
+    task = tasks[0]
+    assert (task.job_name, task.cpus, task.memory, task.task_count) == ('train', 2, 2 << 30, 4)
+    assert task.stdout == task.stderr == tmp_path / 'logs' / 'train_42_1.out'
+
+
+def test_tasks_see_slurm_environment(tmp_path):
+    script = write_script(
+        tmp_path / 'job.sh', 'echo "$SLURM_ARRAY_TASK_ID/$SLURM_ARRAY_TASK_COUNT $SLURM_JOB_NAME $VALUE"; exit $((SLURM_ARRAY_TASK_ID == 2))',
+        'job-name=env', 'array=1-3', f'output={tmp_path}/%a.out',
+    )
+    tasks = LocalExecutor(env={'VALUE': 'x'}).run(script)
+
+    assert [task.returncode for task in tasks] == [0, 1, 0]
+    assert [(tmp_path / f'{index}.out').read_text() for index in (1, 2, 3)] == [f'{index}/3 env x\n' for index in (1, 2, 3)]
+    assert all(task.elapsed is not None and task.max_rss > 0 for task in tasks)
+
+
+def test_array_throttle(tmp_path):
+    log = tmp_path / 'intervals'
+    script = write_script(
+        tmp_path / 'job.sh', f'echo "$(date +%s.%N) start" >> {log}; sleep 0.1; echo "$(date +%s.%N) end" >> {log}',
+        'array=1-4%1', f'output={tmp_path}/%a.out',
+    )
+    LocalExecutor(workers=4).run(script)
+
+    events = [line.split()[1] for line in sorted(log.read_text().splitlines())]
+    assert events == ['start', 'end'] * 4
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc'), reason='memory limits need /proc')
+def test_memory_limit(tmp_path):
+    allocate = f'{sys.executable} -c "import time; data = bytearray(300 << 20); time.sleep(2)"'
+    script = write_script(tmp_path / 'job.sh', allocate, 'mem=100M', f'output={tmp_path}/out')
+
+    task, = LocalExecutor(memory_poll=0.05).run(script)
+    assert task.out_of_memory
+    assert task.returncode != 0
+    assert task.elapsed < 2
+
+    task, = LocalExecutor(memory_poll=0.05, enforce_limits=False).run(script)
+    assert not task.out_of_memory and task.returncode == 0
+    assert task.max_rss >= 300 << 20
+
+
+@pytest.mark.skipif(not hasattr(os, 'sched_getaffinity') or len(os.sched_getaffinity(0)) < 2, reason='needs two cores')
+def test_tasks_are_pinned_to_their_cores(tmp_path):
+    affinity = f'{sys.executable} -c "import os; print(len(os.sched_getaffinity(0)))"'
+    script = write_script(tmp_path / 'job.sh', affinity, 'array=1-2', 'cpus-per-task=1', f'output={tmp_path}/%a.out')
+    LocalExecutor().run(script)
+
+    assert (tmp_path / '1.out').read_text() == (tmp_path / '2.out').read_text() == '1\n'
+
+
+def test_runs_generated_builds(arguments):
+    SlurmCommand = pipeline.get_class('slurm.Command')
+    SlurmSlurm = pipeline.get_class('slurm.Slurm')
+    args = arguments(train=SlurmCommand(
+        recipe=['echo ${x} > ${build_path}/out_${x}', '&& test ${x} != 5'],
+        slurm=SlurmSlurm(max_array_size=4, pack=2),
+    ))
+    with args.train.build() as script:
+        script.append_many({'x': x} for x in range(15))
+
+    tasks = LocalExecutor(workers=2).run(script)
+
+    assert len(tasks) == 8
+    assert sorted(path.name for path in args.build_path.glob('out_*')) == sorted(f'out_{x}' for x in range(15))
+    statuses = read_status(args.build_path / 'status_train.log')
+    assert {task: status.returncode for task, status in statuses.items() if status.returncode} == {3: 1}
+    assert sorted(statuses) == list(range(1, 9))
+
+
+def test_main(arguments, capsys):
+    SlurmCommand = pipeline.get_class('slurm.Command')
+    args = arguments(train=SlurmCommand(recipe=['test ${x} != 1']))
+    with args.train.build() as script:
+        script.append_many({'x': x} for x in range(3))
+
+    assert main([str(args.build_path), '--workers', '2']) == 1
+    assert read_status(args.build_path / 'status_train.log')[2].returncode == 1
@@ -0,0 +1,97 @@
+import pytest
+
+import pipeline
+
+from shell_templates.lookup import build_index, index_filename_for, main, read_line, read_lines, write_index
+from shell_templates.writer import CommandFileWriter
+
+
+LINES = ['echo 1', '', 'echo "näive" --flag', 'python train.py --seed 3']
+
+
+def write(filename, lines, **kwargs):
+    with CommandFileWriter(filename, index_filename=index_filename_for(filename), **kwargs) as writer:
+        writer.write(lines[0])
+        writer.write_many(lines[1:])
+    return writer
+
+
+def test_streamed_index_reads_every_line(tmp_path):
+    filename = tmp_path / 'commands.sh'
+    writer = write(filename, LINES)
+
+    assert writer.count == len(LINES)
+    assert filename.read_text() == '\n'.join(LINES)
+    assert [read_line(filename, number) for number in range(1, len(LINES) + 1)] == LINES
+    assert read_lines(filename, 2, 3) == LINES[1:3]
+
+
+def test_last_line_is_clipped(tmp_path):
+    filename = tmp_path / 'commands.sh'
+    write(filename, LINES)
+
+    assert read_lines(filename, 3, 100) == LINES[2:]
+
+
+@pytest.mark.parametrize('first, last', [(0, None), (3, 2), (len(LINES) + 1, None)])
+def test_invalid_lines_raise(tmp_path, first, last):
+    filename = tmp_path / 'commands.sh'
+    write(filename, LINES)
+
+    with pytest.raises(IndexError):
+        read_lines(filename, first, last)
+
+
+@pytest.mark.parametrize('trailing_newline', [False, True])
+def test_build_index_matches_written_index(tmp_path, trailing_newline):
+    filename = tmp_path / 'commands.sh'
+    write(filename, LINES)
+    written = (tmp_path / 'commands.sh.idx').read_bytes()
+
+    if trailing_newline:
+        with open(filename, 'a') as file:
+            file.write('\n')
+    build_index(filename, tmp_path / 'scanned.idx')
+    assert (tmp_path / 'scanned.idx').read_bytes() == written
+
+    write_index(tmp_path / 'rendered.idx', LINES)
+    assert (tmp_path / 'rendered.idx').read_bytes() == written
+
+
+def test_append_mode_reindexes_the_file(tmp_path):
+    filename = tmp_path / 'commands.sh'
+    write(filename, LINES[:2])
+    write(filename, LINES[2:], open_mode='a')
+
+    assert [read_line(filename, number) for number in range(1, len(LINES) + 1)] == LINES
+
+
+def test_write_shard_moves_offsets(tmp_path):
+    shard = tmp_path / 'shard.sh'
+    write(shard, LINES[2:])
+    filename = tmp_path / 'commands.sh'
+    with CommandFileWriter(filename, index_filename=index_filename_for(filename)) as writer:
+        writer.write_many(LINES[:2])
+        writer.write_shard(shard, len(LINES) - 2, index_filename_for(shard), chunk_size=8)
+
+    assert filename.read_text() == '\n'.join(LINES)
+    assert [read_line(filename, number) for number in range(1, len(LINES) + 1)] == LINES
+
+
+def test_main_prints_lines(tmp_path, capsys):
+    filename = tmp_path / 'commands.sh'
+    write(filename, LINES)
+
+    assert main([str(filename), '3', '4']) == 0
+    assert capsys.readouterr().out == '\n'.join(LINES[2:]) + '\n'
+
+
+def test_build_writes_index_used_by_sbatch_script(arguments):
+    SlurmCommand = pipeline.get_class('slurm.Command')
+    SlurmSlurm = pipeline.get_class('slurm.Slurm')
+    args = arguments(train=SlurmCommand(recipe=['echo ${seed}'], slurm=SlurmSlurm(index=True)))
+    with args.train.build(stream=True) as script:
+        script.append_many({'seed': seed} for seed in range(100))
+
+    assert read_line(script.filename, 42) == 'echo 41'
+    assert 'shell_templates.lookup' in (args.build_path / 'slurm_train.sh').read_text()
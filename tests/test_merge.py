@@ -0,0 +1,100 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import pytest
+
+import pipeline
+from pipeline import merge_defaults
+
+
+@dataclass
+class Header:
+    mem: Optional[str] = None
+    time: Optional[str] = None
+    extra: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class Section:
+    header: Optional[Header] = None
+    pack: Optional[int] = None
+    modules: Optional[List[str]] = None
+    options: Optional[Dict[str, object]] = None
+    computed: int = field(default=0, init=False)
+
+
+@dataclass
+class LocalSection(Section):
+    queue: Optional[str] = None
+
+
+DEFAULTS = Section(
+    header=Header(mem='1gb', time='1:00:00', extra={'account': 'lab'}),
+    pack=1,
+    modules=['python'],
+    options={'retries': 2, 'mail': {'type': 'END', 'user': 'me'}},
+)
+
+
+def test_none_fields_are_taken_from_defaults():
+    value = Section(header=Header(mem='4gb'), options={'mail': {'type': 'FAIL'}})
+    merged = merge_defaults(value, DEFAULTS)
+
+    assert merged == Section(
+        header=Header(mem='4gb', time='1:00:00', extra={'account': 'lab'}),
+        pack=1,
+        modules=['python'],
+        options={'retries': 2, 'mail': {'type': 'FAIL', 'user': 'me'}},
+    )
+    # Neither argument is modified
+    assert value == Section(header=Header(mem='4gb'), options={'mail': {'type': 'FAIL'}})
+    assert DEFAULTS.header.mem == '1gb'
+
+
+def test_defaults_are_not_shared():
+    first = merge_defaults(Section(), DEFAULTS)
+    second = merge_defaults(Section(), DEFAULTS)
+    first.header.extra['account'] = 'other'
+    first.modules.append('cuda')
+    first.options['mail']['user'] = 'other'
+
+    assert second == DEFAULTS
+    assert first.header is not DEFAULTS.header
+
+
+def test_set_values_are_kept():
+    value = Section(pack=8, modules=[])
+    assert merge_defaults(value, DEFAULTS).pack == 8
+    assert merge_defaults(value, DEFAULTS).modules == []
+    assert merge_defaults(None, DEFAULTS) == DEFAULTS
+
+
+def test_init_false_fields_and_subclasses():
+    value = LocalSection(queue='fast')
+    value.computed = 3
+    merged = merge_defaults(value, DEFAULTS)
+
+    assert type(merged) is LocalSection
+    assert merged.queue == 'fast' and merged.pack == 1
+    assert merged.computed == 3
+
+
+@pytest.mark.parametrize('value, defaults, message', [
+    (Section(header=Header()), Section(header='1gb'), 'header: cannot take defaults of Header from str'),
+    (Section(options={'mail': 'END'}), DEFAULTS, "options.mail: cannot take defaults of str from dict"),
+    (Section(options={'a': 1}), Section(options=['a']), 'options: cannot take defaults of dict from list'),
+    (Section(), Header(), 'value: cannot take defaults of Section from Header'),
+    (Section(), None, 'value: cannot take defaults of Section from NoneType'),
+])
+def test_mismatched_defaults_raise_type_error(value, defaults, message):
+    with pytest.raises(TypeError, match=message):
+        merge_defaults(value, defaults)
+
+
+def test_slurm_defaults():
+    Slurm = pipeline.get_class('slurm.Slurm')
+    SlurmSBatchHeader = pipeline.get_class('slurm.SBatchHeader')
+    defaults = Slurm(header=SlurmSBatchHeader(mem='1gb', time='0-01:00:00'), pack=1)
+    merged = merge_defaults(Slurm(header=SlurmSBatchHeader(mem='4gb')), defaults)
+
+    assert (merged.header.mem, merged.header.time, merged.pack) == ('4gb', '0-01:00:00', 1)
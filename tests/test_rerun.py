@@ -0,0 +1,124 @@
+import re
+
+import pytest
+
+import pipeline
+from slurm.rerun import main, rerun_failed, script_record, write_rerun_script
+from slurm.scripts import format_array, parse_array
+from slurm.status import append_status, read_status
+from slurm.worker import TaskQueue
+
+
+@pytest.mark.parametrize('indices, throttle, spec', [
+    ([3, 17, 18, 19, 40], None, '3,17-19,40'),
+    ([5, 1, 2, 2, 3], 4, '1-3,5%4'),
+    ([7], None, '7'),
+    (range(1, 100001), None, '1-100000'),
+    (range(1, 20, 2), 2, '1,3,5,7,9,11,13,15,17,19%2'),
+])
+def test_array_ranges_round_trip(indices, throttle, spec):
+    assert format_array(indices, throttle) == spec
+    assert parse_array(spec) == (sorted(set(indices)), throttle)
+
+
+def test_parse_array_steps():
+    assert parse_array('1-10:3, 15%5') == ([1, 4, 7, 10, 15], 5)
+    assert parse_array('') == ([], None)
+
+
+def test_torn_status_records_are_skipped(tmp_path):
+    log = tmp_path / 'status.log'
+    append_status(log, 1, 1, 10.0, 11.0)
+    append_status(log, 2, 0, 10.0, 12.0)
+    append_status(log, 1, 0, 20.0, 21.0)
+    with open(log, 'a') as file:
+        file.write('3 0 10.0\nx 0 1 2\n')
+
+    statuses = read_status(log)
+    assert sorted(statuses) == [1, 2]
+    assert statuses[1].returncode == 0 and statuses[1].start == 20.0
+
+
+def array(script):
+    return re.search(r'^#SBATCH --array=(.*)$', script.read_text(), re.MULTILINE).group(1)
+
+
+@pytest.fixture
+def build(arguments):
+    SlurmCommand = pipeline.get_class('slurm.Command')
+    SlurmSlurm = pipeline.get_class('slurm.Slurm')
+    args = arguments(
+        chunked=SlurmCommand(recipe=['echo ${x}'], slurm=SlurmSlurm(max_array_size=4, array_throttle=3)),
+        pool=SlurmCommand(recipe=['echo ${x}'], slurm=SlurmSlurm(workers=3)),
+    )
+    with args.chunked.build() as script:
+        script.append_many({'x': x} for x in range(10))
+    with args.pool.build() as script:
+        script.append_many({'x': x} for x in range(10))
+
+    # Tasks 3, 6 and 10 failed, task 9 never reported
+    log = args.build_path / 'status_chunked.log'
+    for task in (1, 2, 3, 4, 5, 6, 7, 8, 10):
+        append_status(log, task, int(task in (3, 6, 10)), 0.0, 1.0)
+    return args
+
+
+def test_rerun_scripts_of_split_arrays(build):
+    chunks = [build.build_path / f'slurm_chunked_{chunk}.sh' for chunk in (1, 2, 3)]
+    assert [script_record(chunk)['offset'] for chunk in chunks] == [0, 4, 8]
+
+    written = build.rerun_failed(['chunked'])
+
+    assert written == [chunk.parent / 'rerun' / chunk.name for chunk in chunks]
+    # Indices are relative to the chunk, the throttle is kept
+    assert [array(script) for script in written] == ['3%3', '2%3', '1-2%3']
+    assert script_record(written[2]) == script_record(chunks[2])
+
+
+def test_failed_only(build):
+    written = build.rerun_failed(['chunked'], include_missing=False)
+    assert [array(script) for script in written] == ['3%3', '2%3', '2%3']
+
+
+def test_nothing_to_rerun(build):
+    for task in (3, 6, 9, 10):
+        append_status(build.build_path / 'status_chunked.log', task, 0, 2.0, 3.0)
+    assert build.rerun_failed(['chunked']) == []
+
+
+def test_rerun_of_a_rerun_script(build):
+    rerun = build.rerun_failed(['chunked'])[2]
+    append_status(build.build_path / 'status_chunked.log', 9, 0, 2.0, 3.0)
+
+    assert rerun_failed([rerun]) == [rerun]
+    assert array(rerun) == '2%3'
+
+
+def test_worker_pool_requeues_tasks(build):
+    queue = TaskQueue(build.build_path / 'queue_pool')
+    tasks = queue.claim(10, owner='a')
+    for task in tasks[:-1]:
+        queue.complete(task, int(task == 4), 0.0, 1.0, 'a')
+    # Task 10 is still running
+    assert build.rerun_failed(['pool']) == [build.build_path / 'rerun' / 'slurm_pool.sh']
+    assert array(build.build_path / 'rerun' / 'slurm_pool.sh') == '1'
+
+    queue.complete(10, 1, 0.0, 1.0, 'a')
+    build.rerun_failed(['pool'])
+    assert array(build.build_path / 'rerun' / 'slurm_pool.sh') == '1'
+    assert queue.claim(10, owner='b') == [4, 10]
+
+
+def test_main_reruns_build_directories(build, capsys):
+    assert main([str(build.build_path)]) == 0
+    assert capsys.readouterr().out.split() == [
+        str(build.build_path / 'rerun' / f'slurm_chunked_{chunk}.sh') for chunk in (1, 2, 3)
+    ]
+
+
+def test_write_rerun_script_adds_array(tmp_path):
+    script = tmp_path / 'job.sh'
+    script.write_text('#!/bin/bash\n#SBATCH --mem=1gb\necho $SLURM_ARRAY_TASK_ID\n')
+
+    rerun = write_rerun_script(script, [1, 2, 3, 7], throttle=2)
+    assert rerun.read_text() == '#!/bin/bash\n#SBATCH --array=1-3,7%2\n#SBATCH --mem=1gb\necho $SLURM_ARRAY_TASK_ID\n'
@@ -0,0 +1,114 @@
+import sys
+
+import pytest
+
+import pipeline
+from slurm.fake_sbatch import FakeController
+from slurm.submit import SubmissionError, Submitter, main
+
+
+@pytest.fixture
+def build(arguments):
+    SlurmCommand = pipeline.get_class('slurm.Command')
+    SlurmSlurm = pipeline.get_class('slurm.Slurm')
+    args = arguments(
+        gen=SlurmCommand(recipe=['echo ${x}'], slurm=SlurmSlurm(max_array_size=10)),
+        fill=SlurmCommand(recipe=['echo ${x}'], slurm=SlurmSlurm(max_array_size=10, dependencies=['aftercorr:gen'])),
+        other=SlurmCommand(recipe=['echo ${x}'], slurm=SlurmSlurm()),
+        last=SlurmCommand(recipe=['echo'], slurm=SlurmSlurm(dependencies=['fill', 'afterany:other'])),
+    )
+    for name, count in [('gen', 35), ('fill', 35), ('other', 3), ('last', 1)]:
+        with getattr(args, name).build() as script:
+            script.append_many({'x': x} for x in range(count))
+    return args
+
+
+def fake_sbatch(state, *options):
+    return ' '.join([sys.executable, '-m', 'slurm.fake_sbatch', '--state', str(state), *options])
+
+
+def test_submits_in_dependency_order(build, tmp_path):
+    state = tmp_path / 'state'
+    jobs = build.submit(Submitter(sbatch=fake_sbatch(state), max_concurrency=3))
+
+    assert {name: len(chunks) for name, chunks in jobs.items()} == {'gen': 4, 'fill': 4, 'other': 1, 'last': 1}
+    recorded = {job['script']: job for job in FakeController(state).jobs()}
+    assert len(recorded) == 10
+    for chunks in jobs.values():
+        for job in chunks:
+            assert recorded[job.script]['job_id'] == int(job.job_id)
+            assert recorded[job.script]['dependency'] == job.dependency
+
+    # Chunks of aftercorr dependencies wait for the same chunk
+    assert [job.dependency for job in jobs['fill']] == [f'aftercorr:{job.job_id}' for job in jobs['gen']]
+    assert jobs['gen'][0].dependency == ''
+    fill = ':'.join(job.job_id for job in jobs['fill'])
+    assert jobs['last'][0].dependency == f'afterok:{fill},afterany:{jobs["other"][0].job_id}'
+
+
+def test_transient_errors_are_retried(build, tmp_path):
+    state = tmp_path / 'state'
+    submitter = Submitter(sbatch=fake_sbatch(state, '--error-rate', '0.3', '--max-rate', '50'), backoff=0.01, max_attempts=30)
+    jobs = build.submit(submitter)
+
+    assert len(FakeController(state).jobs()) == 10
+    attempts = sum(job.attempts for chunks in jobs.values() for job in chunks)
+    assert attempts == FakeController(state).calls('sbatch') >= 10
+
+
+def test_submitted_scripts_are_skipped(build, tmp_path):
+    state = tmp_path / 'state'
+    sbatch = fake_sbatch(state)
+    first = build.submit(Submitter(sbatch=sbatch))
+
+    again = build.submit(Submitter(sbatch=sbatch))
+    assert len(FakeController(state).jobs()) == 10
+    assert all(job.attempts == 0 for chunks in again.values() for job in chunks)
+    assert again['last'][0].job_id == first['last'][0].job_id
+
+    # A changed script is submitted again together with the jobs depending on it
+    build.do_overwrite = True
+    with build.other.build() as script:
+        script.append_many({'x': x} for x in range(4))
+    changed = build.submit(Submitter(sbatch=sbatch))
+    assert {name: [job.attempts > 0 for job in chunks] for name, chunks in changed.items()} == {
+        'gen': [False] * 4, 'fill': [False] * 4, 'other': [True], 'last': [True],
+    }
+
+    build.submit(Submitter(sbatch=sbatch), force=True)
+    assert len(FakeController(state).jobs()) == 22
+
+
+def test_permanent_errors_are_not_retried(tmp_path):
+    script = tmp_path / 'job.sh'
+    script.write_text('#!/bin/bash\n')
+    calls = tmp_path / 'calls'
+    sbatch = f'sh -c "echo x >> {calls}; echo sbatch: error: invalid partition specified >&2; exit 1" sbatch'
+
+    with pytest.raises(SubmissionError, match='invalid partition'):
+        Submitter(sbatch=sbatch, backoff=0.01).submit({'job': [str(script)]}, {'job': []})
+    assert calls.read_text() == 'x\n'
+
+
+def test_failed_submission_resumes(build, tmp_path):
+    state = tmp_path / 'state'
+    # The rate limit rejects most calls of the first level, so the commands depending on it are not submitted
+    limited = Submitter(sbatch=fake_sbatch(state, '--max-rate', '1'), max_attempts=1)
+    with pytest.raises(SubmissionError, match='failed after 1 attempts'):
+        build.submit(limited)
+    submitted = len(FakeController(state).jobs())
+    assert submitted < 10
+
+    jobs = build.submit(Submitter(sbatch=fake_sbatch(state)))
+    assert len(FakeController(state).jobs()) == 10
+    assert sum(job.attempts == 0 for chunks in jobs.values() for job in chunks) == submitted
+
+
+def test_main_submits_a_build(build, tmp_path, capsys):
+    state = tmp_path / 'state'
+    assert main([str(build.build_path), '--sbatch', fake_sbatch(state)]) == 0
+    output = capsys.readouterr().out.splitlines()
+    assert len(output) == 10 and output[0].startswith('Submitted gen[1] as job ')
+
+    assert main([str(build.build_path), '--sbatch', fake_sbatch(state)]) == 0
+    assert all(line.startswith('Already submitted') for line in capsys.readouterr().out.splitlines())
@@ -0,0 +1,147 @@
+from itertools import islice
+import math
+
+import pytest
+
+import pipeline
+from shell_templates.shell_templates import _source_range
+from shell_templates.sweep import LazyPermutation, ShellTemplatesSweep, grid, latin_hypercube, make_sampler, random_samples, zipped
+
+
+def test_grid_changes_last_parameter_fastest():
+    assert list(grid({'a': [1, 2], 'b': 'xy'}, {'c': 0})) == [
+        {'c': 0, 'a': 1, 'b': 'x'},
+        {'c': 0, 'a': 1, 'b': 'y'},
+        {'c': 0, 'a': 2, 'b': 'x'},
+        {'c': 0, 'a': 2, 'b': 'y'},
+    ]
+
+
+def test_zip_requires_equal_lengths():
+    assert list(zipped({'a': [1, 2], 'b': [3, 4]})) == [{'a': 1, 'b': 3}, {'a': 2, 'b': 4}]
+    with pytest.raises(ValueError):
+        list(zipped({'a': [1, 2], 'b': [3]}))
+
+
+def test_samplers():
+    assert make_sampler(['a', 'b'])(0.999) == 'b'
+    assert make_sampler({'low': 1, 'high': 3})(0.999) == 3
+    assert make_sampler({'low': '1e-4', 'high': '1e-2', 'log': True})(0.5) == pytest.approx(1e-3)
+    with pytest.raises(ValueError):
+        make_sampler([])
+
+
+def test_random_samples_are_seeded():
+    parameters = {'lr': {'low': 1e-4, 'high': 1e-1, 'log': True}, 'layers': [2, 4, 8]}
+    samples = list(random_samples(parameters, 100, seed=3))
+
+    assert len(samples) == 100
+    assert samples == list(random_samples(parameters, 100, seed=3))
+    assert samples != list(random_samples(parameters, 100, seed=4))
+    assert all(1e-4 <= sample['lr'] < 1e-1 and sample['layers'] in (2, 4, 8) for sample in samples)
+
+
+@pytest.mark.parametrize('n', [1, 2, 5, 64, 1000])
+def test_lazy_permutation_is_a_permutation(n):
+    import random
+
+    permutation = LazyPermutation(n, random.Random(0))
+    assert sorted(map(permutation, range(n))) == list(range(n))
+
+
+def test_lazy_permutation_is_stable():
+    import random
+
+    # The round function does not depend on the Python hash seed, version or platform
+    permutation = LazyPermutation(10, random.Random(1))
+    assert [permutation(i) for i in range(10)] == [3, 2, 4, 7, 5, 1, 0, 6, 8, 9]
+
+
+def test_latin_hypercube_hits_every_stratum():
+    n = 50
+    samples = list(latin_hypercube({'x': {'low': 0.0, 'high': 1.0}, 'y': {'low': 0.0, 'high': 10.0}}, n, seed=0))
+
+    assert sorted(math.floor(sample['x'] * n) for sample in samples) == list(range(n))
+    assert sorted(math.floor(sample['y'] / 10 * n) for sample in samples) == list(range(n))
+
+
+@pytest.mark.parametrize('kind, length', [('grid', 6), ('zip', 3)])
+def test_sweep_length(kind, length):
+    sweep = ShellTemplatesSweep(kind, {'a': [1, 2, 3], 'b': [4, 5, 6][:3 if kind == 'zip' else 2]})
+    assert len(sweep) == len(list(sweep)) == length
+
+
+def test_sweep_validation():
+    with pytest.raises(ValueError, match='Unknown sweep kind'):
+        ShellTemplatesSweep('sobol')
+    with pytest.raises(ValueError, match='num_samples'):
+        ShellTemplatesSweep('random', {'x': [1]})
+
+
+SWEEPS = [
+    ShellTemplatesSweep('grid', {'a': [1, 2, 3], 'b': [4, 5], 'c': [6, 7, 8, 9]}, {'d': 0}),
+    ShellTemplatesSweep('zip', {'a': list(range(20)), 'b': list(range(20, 40))}),
+    ShellTemplatesSweep('random', {'x': {'low': 0.0, 'high': 1.0}, 'y': [1, 2]}, num_samples=20, seed=5),
+    ShellTemplatesSweep('latin_hypercube', {'x': {'low': 0.0, 'high': 1.0}, 'y': [1, 2]}, num_samples=20, seed=5),
+]
+
+
+@pytest.mark.parametrize('sweep', SWEEPS, ids=lambda sweep: sweep.kind)
+@pytest.mark.parametrize('start, stop', [(0, None), (0, 5), (3, 11), (7, 7), (11, 100), (100, None)])
+def test_slice_matches_islice(sweep, start, stop):
+    assert list(sweep.slice(start, stop)) == list(islice(sweep, start, stop))
+
+
+def test_seeded():
+    grid_sweep = ShellTemplatesSweep('grid', {'a': [1, 2]})
+    assert grid_sweep.seeded() is grid_sweep
+    assert SWEEPS[2].seeded() is SWEEPS[2]
+
+    sweep = ShellTemplatesSweep('random', {'x': [1, 2, 3]}, num_samples=10).seeded()
+    assert sweep.seed is not None
+    assert list(sweep) == list(sweep)
+    assert list(sweep.slice(4, 8)) == list(sweep)[4:8]
+
+
+def seeds(start, stop):
+    return ({'seed': seed, 'lr': 0.1} for seed in range(start, stop))
+
+
+@pytest.mark.parametrize('storage, write_index', [('lines', False), ('lines', True), ('table', False)])
+@pytest.mark.parametrize('source, count', [
+    (ShellTemplatesSweep('grid', {'seed': list(range(25)), 'lr': [0.1, 0.01, 0.001]}), None),
+    ([{'seed': seed, 'lr': 0.1} for seed in range(75)], None),
+    (seeds, 75),
+], ids=['sweep', 'sequence', 'function'])
+def test_sharded_generation_matches_serial(arguments, storage, write_index, source, count):
+    SlurmCommand = pipeline.get_class('slurm.Command')
+    recipe = ['train --seed ${seed} --lr ${lr}', '--total ${num_commands}']
+    args = arguments(serial=SlurmCommand(recipe=recipe), sharded=SlurmCommand(recipe=recipe))
+    options = dict(stream=True, storage=storage, write_index=write_index, table_block_size=4)
+
+    with args.serial.build(**options) as serial:
+        serial.append_command(mapping={'seed': -1, 'lr': 0})
+        serial.append_many(_source_range(source, 0, count or len(source)))
+    with args.sharded.build(**options) as sharded:
+        sharded.append_command(mapping={'seed': -1, 'lr': 0})
+        sharded.append_sharded(source, processes=2, shards=5, count=count)
+
+    assert sharded.num_commands == serial.num_commands == 76
+    for suffix in ('', '.idx') if write_index else ('',):
+        with open(serial.filename + suffix, 'rb') as file:
+            expected = file.read()
+        with open(sharded.filename + suffix, 'rb') as file:
+            assert file.read() == expected
+
+
+def test_unseeded_shards_share_one_sample(arguments):
+    SlurmCommand = pipeline.get_class('slurm.Command')
+    args = arguments(train=SlurmCommand(recipe=['train --x ${x}']))
+    n = 40
+    sweep = ShellTemplatesSweep('latin_hypercube', {'x': {'low': 0.0, 'high': 1.0}}, num_samples=n)
+    with args.train.build(stream=True) as script:
+        script.append_sweep(sweep, processes=2)
+
+    with open(script.filename) as file:
+        values = [float(line.split()[-1]) for line in file.read().split('\n')]
+    assert sorted(math.floor(value * n) for value in values) == list(range(n))
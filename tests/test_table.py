@@ -0,0 +1,99 @@
+import pytest
+
+import pipeline
+from shell_templates import lookup
+from shell_templates.table import TableWriter, iter_rows, main, read_line, read_lines
+
+
+ROWS = [(str(seed), f'{0.1 * seed:g}') for seed in range(10)]
+
+
+def write(filename, rows, **kwargs):
+    with TableWriter(filename, format_string='train --seed {seed} --lr {lr}', keys=('seed', 'lr'), **kwargs) as writer:
+        writer.write_row(rows[0])
+        writer.write_rows(rows[1:])
+    return writer
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+@pytest.mark.parametrize('block_size', [1, 3, 100])
+def test_rows_round_trip(tmp_path, compression, block_size):
+    filename = tmp_path / 'commands.table'
+    writer = write(filename, ROWS, block_size=block_size, compression=compression)
+
+    assert writer.count == len(ROWS)
+    assert list(iter_rows(filename)) == ROWS
+    lines = [f'train --seed {seed} --lr {lr}' for seed, lr in ROWS]
+    assert [read_line(filename, number) for number in range(1, len(ROWS) + 1)] == lines
+    # Across block boundaries and clipped to the rows
+    assert read_lines(filename, 2, 8) == lines[1:8]
+    assert read_lines(filename, 9, 100) == lines[8:]
+
+
+def test_lookup_reads_tables(tmp_path, capsys):
+    filename = tmp_path / 'commands.table'
+    write(filename, ROWS, block_size=4)
+
+    assert lookup.read_line(filename, 5) == 'train --seed 4 --lr 0.4'
+    assert main([str(filename), '5']) == 0
+    assert capsys.readouterr().out == 'train --seed 4 --lr 0.4\n'
+
+
+@pytest.mark.parametrize('first, last', [(0, None), (3, 2), (len(ROWS) + 1, None)])
+def test_invalid_rows_raise(tmp_path, first, last):
+    filename = tmp_path / 'commands.table'
+    write(filename, ROWS)
+
+    with pytest.raises(IndexError):
+        read_lines(filename, first, last)
+
+
+def test_lines_round_trip(tmp_path):
+    filename = tmp_path / 'commands.table'
+    lines = ['echo 1', '', 'echo "näive" | tee out']
+    with TableWriter(filename, block_size=2) as writer:
+        writer.write(lines[0])
+        writer.write_many(lines[1:])
+
+    assert read_lines(filename, 1, 3) == lines
+
+
+@pytest.mark.parametrize('value', ['a\nb', 'a\0b'])
+def test_separators_in_values_raise(tmp_path, value):
+    writer = TableWriter(tmp_path / 'commands.table', format_string='{x}', keys=('x',), block_size=2)
+    writer.write_row(('ok',))
+    with pytest.raises(ValueError, match='newline or NUL'):
+        writer.write_row((value,))
+
+
+def test_rendered_lines_need_a_lines_table(tmp_path):
+    writer = TableWriter(tmp_path / 'commands.table', format_string='{x}', keys=('x',))
+    with pytest.raises(ValueError):
+        writer.write('echo 1')
+
+
+def test_not_a_table_raises(tmp_path):
+    filename = tmp_path / 'commands.table'
+    filename.write_bytes(b'echo 1\n' * 10)
+
+    with pytest.raises(ValueError, match='not a command table'):
+        read_line(filename, 1)
+
+
+def test_table_storage_matches_lines(arguments):
+    SlurmCommand = pipeline.get_class('slurm.Command')
+    recipe = ['python train.py', '--seed ${seed}', '--name "${name}"']
+    args = arguments(
+        lines=SlurmCommand(recipe=recipe),
+        table=SlurmCommand(recipe=recipe, storage='table'),
+    )
+    mappings = [{'seed': seed, 'name': f'run {seed}'} for seed in range(50)]
+    with args.lines.build(stream=True, write_index=True) as lines:
+        lines.append_many(mappings)
+    with args.table.build(table_block_size=7) as table:
+        table.append_many(mappings[:20])
+        table.append_table({'seed': [m['seed'] for m in mappings[20:]], 'name': [m['name'] for m in mappings[20:]]})
+
+    assert table.filename.endswith('.table')
+    assert table.num_commands == lines.num_commands == 50
+    assert lookup.read_lines(table.filename, 1, 50) == lookup.read_lines(lines.filename, 1, 50)
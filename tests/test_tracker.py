@@ -0,0 +1,131 @@
+import sys
+
+import pytest
+
+import pipeline
+from slurm.fake_sacct import FakeAccounting
+from slurm.fake_sbatch import FakeController
+from slurm.submit import Submitter
+from slurm.tracker import JobTracker, StatusError, main, parse_sacct
+
+
+def test_parse_sacct():
+    text = '\n'.join([
+        '101_[5-9,12%4]|PENDING|0:0',
+        '101_3|CANCELLED by 1000|0:15',
+        '101_3.batch|CANCELLED|0:15',
+        '102|COMPLETED|0:0',
+        '',
+    ])
+    assert list(parse_sacct(text)) == [
+        ('101', [5, 6, 7, 8, 9, 12], 'PENDING'),
+        ('101', [3], 'CANCELLED'),
+        ('102', None, 'COMPLETED'),
+    ]
+
+
+FAILURE_RATE = 0.05
+
+
+@pytest.fixture
+def build(arguments, tmp_path):
+    SlurmCommand = pipeline.get_class('slurm.Command')
+    SlurmSlurm = pipeline.get_class('slurm.Slurm')
+    args = arguments(
+        gen=SlurmCommand(recipe=['echo ${x}'], slurm=SlurmSlurm(max_array_size=40)),
+        fill=SlurmCommand(recipe=['echo ${x}'], slurm=SlurmSlurm(dependencies=['gen'])),
+    )
+    for name, count in [('gen', 100), ('fill', 20)]:
+        with getattr(args, name).build() as script:
+            script.append_many({'x': x} for x in range(count))
+    args.submit(Submitter(sbatch=f'{sys.executable} -m slurm.fake_sbatch --state {tmp_path / "state"}'))
+    return args
+
+
+def fake_sacct(tmp_path, **options):
+    options = {'pending': 0.0, 'runtime': 0.2, 'concurrency': 50, 'failure_rate': FAILURE_RATE, **options}
+    return ' '.join([
+        sys.executable, '-m', 'slurm.fake_sacct', '--state', str(tmp_path / 'state'),
+        *(f'--{key.replace("_", "-")} {value}' for key, value in options.items()),
+    ])
+
+
+def expected_failures(tmp_path, tracker, name):
+    accounting = FakeAccounting(FakeController(tmp_path / 'state'), failure_rate=FAILURE_RATE)
+    return [
+        job.offset + index
+        for job in tracker.jobs if job.name == name
+        for index in job.indices if accounting.fails(job.job_id, index)
+    ]
+
+
+def test_jobs_of_split_arrays(build, tmp_path):
+    tracker = build.job_tracker(sacct=fake_sacct(tmp_path))
+    assert [(job.name, job.chunk, job.offset, len(job.indices)) for job in tracker.jobs] == [
+        ('fill', 1, 0, 20), ('gen', 1, 0, 40), ('gen', 2, 40, 40), ('gen', 3, 80, 20),
+    ]
+    summary = tracker.summary()['gen']
+    assert (summary.total, summary.unknown, summary.done) == (100, 100, False)
+
+
+def test_polls_are_cached_within_the_interval(build, tmp_path):
+    tracker = build.job_tracker(sacct=fake_sacct(tmp_path), interval=60)
+    changes = tracker.poll()
+    assert changes and tracker.calls == 1
+    assert {change.old for change in changes} == {'UNKNOWN'}
+
+    assert tracker.poll() == []
+    assert tracker.calls == 1
+
+
+def test_wait_until_done(build, tmp_path):
+    tracker = build.job_tracker(sacct=fake_sacct(tmp_path), interval=0.05, max_interval=0.2)
+    seen = []
+    summaries = tracker.wait(on_change=seen.extend)
+
+    for name, total in [('gen', 100), ('fill', 20)]:
+        summary = summaries[name]
+        assert summary.done and summary.total == total
+        assert summary.completed + summary.failed == total
+        assert summary.failed_indices == expected_failures(tmp_path, tracker, name)
+    assert set(tracker.states('gen')) == set(range(1, 101))
+    # The dependent job starts after the chunks of `gen` ended
+    first_fill = min(i for i, change in enumerate(seen) if change.name == 'fill' and change.new == 'RUNNING')
+    assert all(change.new in ('COMPLETED', 'FAILED') for change in seen[first_fill:] if change.name == 'gen')
+
+    # Finished jobs are not queried again
+    calls = FakeController(tmp_path / 'state').calls('sacct')
+    assert tracker.poll(force=True) == []
+    assert FakeController(tmp_path / 'state').calls('sacct') == calls == tracker.calls
+
+
+def test_states_are_cached_on_disk(build, tmp_path):
+    build.job_tracker(sacct=fake_sacct(tmp_path), interval=0.05).wait()
+
+    tracker = JobTracker(build.build_path, sacct='false')
+    assert tracker.poll(force=True) == []
+    assert tracker.calls == 0
+    assert tracker.summary()['gen'].failed_indices == expected_failures(tmp_path, tracker, 'gen')
+
+
+def test_failing_sacct(build):
+    tracker = build.job_tracker(sacct='sh -c "echo slurmdbd unavailable >&2; exit 1" sacct', interval=0.01)
+    with pytest.raises(StatusError, match='slurmdbd unavailable'):
+        tracker.poll()
+    with pytest.raises(StatusError):
+        tracker.wait(max_errors=3)
+    assert tracker.calls == 4
+
+
+def test_wait_timeout(build, tmp_path):
+    tracker = build.job_tracker(sacct=fake_sacct(tmp_path, pending=60), interval=0.05)
+    with pytest.raises(TimeoutError, match='fill'):
+        tracker.wait(timeout=0.2)
+
+
+def test_main_prints_summary(build, tmp_path, capsys):
+    assert main([str(build.build_path), '--sacct', fake_sacct(tmp_path, failure_rate=0), '--wait', '--interval', '0.05']) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split() == ['command', 'total', 'pending', 'running', 'done', 'failed', 'unknown']
+    assert lines[1].split() == ['fill', '20', '0', '0', '20', '0', '0']
+    assert lines[2].split() == ['gen', '100', '0', '0', '100', '0', '0']
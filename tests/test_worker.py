@@ -0,0 +1,124 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import pytest
+
+from shell_templates.lookup import index_filename_for
+from shell_templates.writer import CommandFileWriter
+from slurm.worker import TaskQueue, run_worker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = TaskQueue(tmp_path / 'queue', lease=60)
+    queue.initialize(10)
+    return queue
+
+
+def test_claims_tasks_in_order(queue):
+    assert queue.claim(owner='a') == [1]
+    assert queue.claim(3, owner='b') == [2, 3, 4]
+    assert queue.claim(10, owner='a') == [5, 6, 7, 8, 9, 10]
+    assert queue.claim(owner='a') == []
+    assert queue.in_flight() == 10
+
+    for task in range(1, 11):
+        queue.complete(task, 0, 0.0, 1.0, 'a' if task not in (2, 3, 4) else 'b')
+    assert queue.in_flight() == 0
+    assert sorted(queue.statuses()) == list(range(1, 11))
+
+
+def test_concurrent_claims_are_disjoint(tmp_path):
+    queue = TaskQueue(tmp_path / 'queue')
+    queue.initialize(200)
+
+    def claim_all(owner):
+        tasks = []
+        while claimed := queue.claim(3, owner):
+            tasks += claimed
+        return tasks
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        claims = list(pool.map(claim_all, 'abcd'))
+    assert sorted(sum(claims, [])) == list(range(1, 201))
+
+
+def test_expired_leases_are_claimed_again(tmp_path):
+    queue = TaskQueue(tmp_path / 'queue', lease=0.2)
+    queue.initialize(3)
+    assert queue.claim(2, owner='dead') == [1, 2]
+
+    time.sleep(0.3)
+    assert queue.claim(owner='alive') == [1]
+    # The dead worker reporting late does not release the new claim
+    queue.complete(1, 0, 0.0, 1.0, 'dead')
+    assert queue.in_flight() == 2
+
+
+def test_renew_extends_leases(tmp_path):
+    queue = TaskQueue(tmp_path / 'queue', lease=0.3)
+    queue.initialize(3)
+    assert queue.claim(owner='a') == [1]
+
+    time.sleep(0.2)
+    queue.renew('a')
+    time.sleep(0.2)
+    assert queue.claim(owner='b') == [2]
+
+
+def test_requeued_tasks_come_first(queue):
+    assert queue.claim(4, owner='a') == [1, 2, 3, 4]
+    queue.complete(1, 0, 0.0, 1.0, 'a')
+    queue.complete(2, 1, 0.0, 1.0, 'a')
+
+    # Claimed tasks and duplicates are not requeued
+    queue.requeue([2, 1, 2, 3])
+    assert queue.claim(3, owner='b') == [2, 1, 5]
+
+
+def test_requeue_failed(queue):
+    assert queue.claim(5, owner='a') == [1, 2, 3, 4, 5]
+    queue.complete(1, 0, 0.0, 1.0, 'a')
+    queue.complete(2, 1, 0.0, 1.0, 'a')
+    queue.complete(3, 0, 0.0, 1.0, 'a')
+    queue.complete(4, 0, 0.0, 1.0, 'a')
+    # Task 5 is still held, task 6 never claimed
+    assert queue.requeue_failed(include_missing=False) == [2]
+    assert queue.requeue_failed() == []
+
+    queue.complete(5, 0, 0.0, 1.0, 'a')
+    assert queue.claim(owner='b') == [2]
+
+
+def test_new_job_starts_a_drained_queue_over(tmp_path):
+    queue = TaskQueue(tmp_path / 'queue')
+    queue.initialize(1)
+    assert not queue.start_job('100')
+    assert queue.claim(owner='a') == [1]
+
+    # An unfinished queue is taken over as it is
+    assert not queue.start_job('101')
+    queue.complete(1, 0, 0.0, 1.0, 'a')
+    assert not queue.start_job('101')
+    assert queue.start_job('102')
+    assert queue.statuses() == {}
+    assert queue.claim(owner='b') == [1]
+
+
+@pytest.mark.parametrize('concurrency, claim_size', [(1, 1), (3, 2)])
+def test_run_worker(tmp_path, capsys, concurrency, claim_size):
+    filename = tmp_path / 'commands.sh'
+    with CommandFileWriter(filename, index_filename=index_filename_for(filename)) as writer:
+        writer.write_many(f'echo task {task}; exit $(( {task} % 4 == 0 ))' for task in range(1, 11))
+    queue = TaskQueue(tmp_path / 'queue')
+    queue.initialize(10)
+
+    failed = run_worker(filename, queue, worker='w', concurrency=concurrency, claim_size=claim_size, poll=0.05)
+
+    assert failed == 2
+    statuses = queue.statuses()
+    assert {task: status.returncode for task, status in statuses.items()} == {
+        task: int(task % 4 == 0) for task in range(1, 11)
+    }
+    assert queue.in_flight() == 0
+    assert 'task 7\n' in capsys.readouterr().out